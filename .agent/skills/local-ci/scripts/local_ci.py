@@ -4,7 +4,13 @@ import argparse
 import subprocess
 import time
 import re
-from typing import List, Tuple
+import json
+import hashlib
+import signal
+import threading
+import heapq
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Optional, Tuple
 
 try:
     from tqdm import tqdm
@@ -17,22 +23,78 @@ except ImportError:
 if sys.stdout and hasattr(sys.stdout, 'reconfigure'):
     sys.stdout.reconfigure(encoding='utf-8')
 
+# ---------------------------------------------------------
+# 子进程登记: 阶段失败时可立即终止其他在途阶段的子进程
+# ---------------------------------------------------------
+CANCEL = threading.Event()
+_PROCESSES = set()
+_PROCESS_LOCK = threading.Lock()
+_OUTPUT_LOCK = threading.Lock()  # 并发分片的结果输出
+
+
+def popen_group_kwargs() -> dict:
+    """让子进程独立成组，取消时连同其子进程 (flake8 / xdist workers) 一起终止"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def register_process(process: subprocess.Popen):
+    """登记在途子进程；若已在取消中则立即终止"""
+    with _PROCESS_LOCK:
+        _PROCESSES.add(process)
+    if CANCEL.is_set():
+        kill_process_tree(process)
+
+
+def unregister_process(process: subprocess.Popen):
+    with _PROCESS_LOCK:
+        _PROCESSES.discard(process)
+
+
+def kill_process_tree(process: subprocess.Popen):
+    """终止子进程及其进程组"""
+    if process.poll() is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+
+
+def cancel_processes():
+    """取消所有在途阶段: 置位 CANCEL 并终止已登记的子进程"""
+    CANCEL.set()
+    with _PROCESS_LOCK:
+        processes = list(_PROCESSES)
+    for process in processes:
+        kill_process_tree(process)
+
 def run_command(cmd: List[str], cwd: str = ".") -> Tuple[int, str, str]:
     """Run a command and return returncode, stdout, stderr."""
     try:
-        result = subprocess.run(
+        process = subprocess.Popen(
             cmd, 
             cwd=cwd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,  # 将 stderr 重定向到 stdout
             text=True,
             encoding='utf-8', 
-            errors='replace'
+            errors='replace',
+            **popen_group_kwargs()
         )
-        # 由于 stderr 已重定向到 stdout，返回空字符串作为 stderr
-        return result.returncode, result.stdout, ""
     except FileNotFoundError:
         return 127, "", f"找不到命令: {cmd[0]}"
+    register_process(process)
+    try:
+        out, _ = process.communicate()
+    finally:
+        unregister_process(process)
+    # 由于 stderr 已重定向到 stdout，返回空字符串作为 stderr
+    return process.returncode, out, ""
 
 def print_step(name: str, step: int = 0, total: int = 0):
     """打印步骤信息，带进度提示"""
@@ -57,6 +119,175 @@ def print_warning(message: str):
     """打印警告信息"""
     print(f"⚠️ {message}")
 
+# 排除目录列表（与 GitHub CI 和 .flake8 保持一致）
+# 触发 RecursionError 的超复杂文件不再硬编码排除，而是按文件自动隔离 (见 check_flake8)
+FLAKE8_EXCLUDE = ".git,__pycache__,.venv,venv,env,build,dist,*.egg-info,tests/temp,.agent/temp,archive,alembic"
+# GitHub CI 第一阶段 (--select) 的致命错误码前缀: 语法错误、未定义名称等
+FLAKE8_CRITICAL = ("E9", "F63", "F7", "F82")
+# 与 GitHub CI 第二阶段相同的参数，并确保第一阶段的致命错误码一定启用
+# --jobs=1: 在本进程内逐文件检查 (不启动 multiprocessing 进程池)，批次之间可响应取消，RecursionError 也能在此捕获
+FLAKE8_ARGS = ["--max-complexity=10", "--max-line-length=127", f"--extend-select={','.join(FLAKE8_CRITICAL)}", "--jobs=1"]
+FLAKE8_CACHE_PATH = os.path.join("tests", "temp", "flake8_cache.json")
+FLAKE8_BATCH_FILES = 200  # 每批检查的文件数；批次之间响应取消
+
+# ---------------------------------------------------------
+# 增量模式: 按输入内容哈希缓存各阶段的通过结果
+# ---------------------------------------------------------
+CACHE_PATH = os.path.join("tests", "temp", "ci_cache.json")
+CACHE_VERSION = 1
+# 影响检查结果的配置文件 (仅项目根目录)
+CONFIG_FILES = [".flake8", "setup.cfg", "tox.ini", "pyproject.toml", "pytest.ini", "requirements.txt", "requirements-dev.txt"]
+# 不参与哈希的目录 (虚拟环境、缓存与 CI 自身的输出)
+SKIP_DIRS = {".git", "__pycache__", ".venv", "venv", "env", "build", "dist", "node_modules", ".pytest_cache", ".mypy_cache"}
+SKIP_PATHS = {"tests/temp", ".agent/temp"}
+
+
+def tool_version(package: str) -> str:
+    """已安装工具的版本号 (未安装时返回 missing)"""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return "unknown"
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return "missing"
+
+
+def walk_project(root_dir: str):
+    """遍历项目文件 (跳过 SKIP_DIRS / SKIP_PATHS)，产出 (相对路径, 绝对路径)"""
+    for root, dirs, names in os.walk(root_dir):
+        rel_root = os.path.relpath(root, root_dir).replace("\\", "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.endswith(".egg-info")
+                         and rel_root + d not in SKIP_PATHS)
+        for name in sorted(names):
+            yield rel_root + name, os.path.join(root, name)
+
+
+def is_skipped_path(rel: str) -> bool:
+    """相对路径是否位于 walk_project 跳过的目录下"""
+    parts = rel.split("/")[:-1]
+    return (any(d in SKIP_DIRS or d.endswith(".egg-info") for d in parts)
+            or any("/".join(parts[:i]) in SKIP_PATHS for i in range(1, len(parts) + 1)))
+
+
+def file_digest(path: str) -> str:
+    """文件内容的 SHA-1 (读取失败时返回空字符串)"""
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+    except OSError:
+        return ""
+    return digest.hexdigest()
+
+
+class StageCache:
+    """阶段结果缓存，保存在 tests/temp/ci_cache.json。
+
+    每个阶段的指纹 = 其输入文件 (Python 源码、测试文件、配置) 的内容哈希
+    + 工具版本 + 命令参数 + 本脚本自身。指纹与上次通过时一致的阶段直接跳过，
+    报告为 "cached (pass)"。文件哈希按 (大小, mtime) 记忆，未修改的文件不会重复读取。
+    只记录通过的结果：失败的阶段下次总会重跑。
+    """
+
+    def __init__(self, root_dir: str, enabled: bool = True):
+        self.root_dir = root_dir
+        self.enabled = enabled  # False: 忽略已有缓存强制重跑 (通过的结果仍会写入)
+        self.path = os.path.join(root_dir, CACHE_PATH)
+        self.stages: Dict[str, dict] = {}
+        self.files: Dict[str, list] = {}
+        self.misses = 0
+        self._tree: Optional[Dict[str, str]] = None
+        self._script = file_digest(os.path.abspath(__file__))
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.stages = data.get("stages", {})
+                self.files = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+
+    def tree(self) -> Dict[str, str]:
+        """工作区输入文件 (相对路径) -> 内容哈希，每次运行只扫描一次"""
+        if self._tree is not None:
+            return self._tree
+        tree, files = {}, {}
+        for rel, path in walk_project(self.root_dir):
+            if not (rel.endswith(".py") or rel.startswith("tests/") or rel in CONFIG_FILES):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            memo = self.files.get(rel)
+            if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+                digest = memo[2]
+            else:
+                digest = file_digest(path)
+            files[rel] = [st.st_size, st.st_mtime_ns, digest]
+            tree[rel] = digest
+        self.files = files
+        self._tree = tree
+        return tree
+
+    def fingerprint(self, stage: str, extra: List[str], scope: str = "all") -> str:
+        """阶段指纹: 输入文件哈希 + 附加参数 (工具版本、命令等)。
+        scope: python (仅 .py)、lint (.py + 配置文件) 或 all (另含 tests/ 下的全部文件)"""
+        digest = hashlib.sha1()
+        for part in [stage, sys.version, self._script] + list(extra):
+            digest.update(part.encode("utf-8") + b"\0")
+        for rel, file_hash in sorted(self.tree().items()):
+            if scope != "all" and not (rel.endswith(".py") or (scope == "lint" and rel in CONFIG_FILES)):
+                continue
+            digest.update(f"{rel}\0{file_hash}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def hit(self, stage: str, fingerprint: str) -> bool:
+        """该阶段上次通过且输入未变化"""
+        entry = self.stages.get(stage)
+        if self.enabled and entry and entry.get("fingerprint") == fingerprint:
+            return True
+        self.misses += 1
+        return False
+
+    def record(self, stage: str, fingerprint: str, elapsed: float):
+        """记录一次通过"""
+        self.stages[stage] = {"fingerprint": fingerprint, "elapsed": round(elapsed, 2),
+                              "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    def save(self):
+        """原子写入缓存文件"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "stages": self.stages, "files": self.files}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print_warning(f"无法保存 CI 缓存: {e}")
+
+
+def print_cached(name: str, entry: dict):
+    """打印缓存命中信息"""
+    print(f"⚡ {name}: cached (pass) — 输入未变化，上次通过于 {entry.get('date', '?')} (原耗时 {entry.get('elapsed', 0):.2f}s)")
+
+def run_stage(cache: StageCache, stage: str, fingerprint: str, title: str, check,
+              step: int = 0, total: int = 0) -> Optional[bool]:
+    """执行一个检查阶段，输入未变化且上次通过时跳过。返回 None 表示命中缓存 (视为通过)"""
+    if cache.hit(stage, fingerprint):
+        print_step(title, step, total)
+        print_cached(title, cache.stages[stage])
+        return None
+    start_time = time.time()
+    if not check():
+        return False
+    cache.record(stage, fingerprint, time.time() - start_time)
+    return True
+
 def check_architecture(root_dir: str, step: int = 0, total: int = 0) -> bool:
     """执行架构守卫检查"""
     print_step("架构守卫 (分层与依赖)", step, total)
@@ -80,98 +311,225 @@ def check_architecture(root_dir: str, step: int = 0, total: int = 0) -> bool:
     print_success(f"架构检查通过 (耗时: {elapsed:.2f}s)")
     return True
 
-def check_flake8(root_dir: str, step: int = 0, total: int = 0) -> bool:
-    """执行与 GitHub Actions 一致的 Flake8 检查"""
-    print_step("代码质量 (GitHub Flake8 Mode)", step, total)
-    start_time = time.time()
-    
+def flake8_excluded(rel_path: str) -> bool:
+    """按 FLAKE8_EXCLUDE 判断文件是否排除 (无斜杠的模式匹配任一路径段，有斜杠的模式匹配路径前缀)"""
+    import fnmatch
+    parts = rel_path.split("/")
+    for pattern in FLAKE8_EXCLUDE.split(","):
+        if "/" in pattern:
+            if rel_path == pattern or rel_path.startswith(pattern + "/"):
+                return True
+        elif any(fnmatch.fnmatch(part, pattern) for part in parts):
+            return True
+    return False
+
+
+def flake8_config_key(root_dir: str) -> str:
+    """flake8 及其插件版本、检查参数与配置文件内容的哈希；任一变化时检查结果失效"""
+    return hashlib.sha1("\0".join(
+        [tool_version(name) for name in ("flake8", "pyflakes", "pycodestyle", "mccabe")]
+        + [FLAKE8_EXCLUDE] + FLAKE8_ARGS
+        + [file_digest(os.path.join(root_dir, name)) for name in CONFIG_FILES]).encode("utf-8")).hexdigest()
+
+
+class _Flake8Collector:
+    """flake8 formatter 的工厂: 把结果收集到本实例的 errors 而不是打印"""
+
+    def __init__(self):
+        self.errors: List[tuple] = []
+
+    def formatter(self):
+        from flake8.formatting.base import BaseFormatter
+        errors = self.errors
+
+        class Collector(BaseFormatter):
+            def handle(self, error):
+                errors.append((error.filename, error.code, error.line_number, error.column_number, error.text,
+                               (error.physical_line or "").rstrip("\n")))
+
+            def start(self):
+                pass
+
+            def stop(self):
+                pass
+
+        return Collector
+
+
+def _flake8_run(style_guide, collector: _Flake8Collector, files: List[str], quarantine: List[str]) -> List[tuple]:
+    """检查一组文件。RecursionError 时二分定位出错文件并放入 quarantine，其余文件照常检查"""
+    if not files:
+        return []
+    collector.errors.clear()
+    try:
+        style_guide.check_files(files)
+        return list(collector.errors)
+    except RecursionError:
+        if len(files) == 1:
+            quarantine.append(files[0])
+            return []
+    middle = len(files) // 2
+    return (_flake8_run(style_guide, collector, files[:middle], quarantine)
+            + _flake8_run(style_guide, collector, files[middle:], quarantine))
+
+
+def _flake8_print(errors: List[tuple], show_source: bool):
+    """按 flake8 的 --count --statistics (--show-source) 格式打印"""
+    for path, code, line, col, text, source in errors:
+        print(f"./{path}:{line}:{col}: {code} {text}")
+        if show_source and source:
+            print(source)
+            print(" " * (col - 1) + "^")
+    stats = {}
+    for _, code, _, _, text, _ in errors:
+        count, first = stats.get(code, (0, text))
+        stats[code] = (count + 1, first)
+    for code in sorted(stats):
+        print(f"{stats[code][0]:<5} {code} {stats[code][1]}")
+    print(len(errors))
+
+
+def _flake8_style_guide(collector: _Flake8Collector):
+    """按 FLAKE8_ARGS 构建进程内 StyleGuide，结果交给 collector"""
+    from flake8.api import legacy
+    from flake8.main.application import Application
+    from flake8.options.parse_args import parse_args
+
+    # 选项需在插件加载时生效 (mccabe 在此读取 max-complexity)，所以走命令行解析而非 get_style_guide(**kwargs)
+    application = Application()
+    application.plugins, application.options = parse_args(list(FLAKE8_ARGS))
+    application.make_formatter()
+    application.make_guide()
+    application.make_file_checker_manager([])
+    style_guide = legacy.StyleGuide(application)
+    style_guide.init_report(collector.formatter())
+    return style_guide
+
+
+def _load_flake8_memo(cache_path: str, config_key: str) -> dict:
+    """上次的逐文件结果；配置或工具版本变化 (config_key 不同) 时整个缓存失效"""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        return cached.get("files", {}) if cached.get("key") == config_key else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_flake8_memo(cache_path: str, config_key: str, files: dict):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"key": config_key, "files": files}, f)
+    except OSError as e:
+        print_warning(f"无法保存 flake8 缓存: {e}")
+
+
+def _scan_flake8_files(root_dir: str, memo: dict) -> Tuple[dict, dict, List[str]]:
+    """待检查文件: (内容未变、沿用缓存的结果, 相对路径 -> (大小, mtime, 哈希), 需重新检查的文件)。
+    大小与 mtime 未变时沿用缓存的哈希，不重新读取文件"""
+    files, digests, stale = {}, {}, []
+    for rel, path in walk_project(root_dir):
+        if not rel.endswith(".py") or flake8_excluded(rel):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entry = memo.get(rel)
+        if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+            digest = entry["hash"]
+        else:
+            digest = file_digest(path)
+        digests[rel] = (st.st_size, st.st_mtime_ns, digest)
+        if entry and entry["hash"] == digest:
+            files[rel] = entry
+        else:
+            stale.append(rel)
+    return files, digests, stale
+
+
+def _flake8_check_stale(root_dir: str, stale: List[str]) -> Optional[dict]:
+    """分批检查 stale 文件，返回 相对路径 -> {errors, quarantined}；被取消时返回 None"""
+    collector = _Flake8Collector()
+    style_guide = _flake8_style_guide(collector)
+    quarantine, results = [], defaultdict(list)
+    paths = [os.path.join(root_dir, rel) for rel in stale]
+    for i in range(0, len(paths), FLAKE8_BATCH_FILES):
+        # 进程内检查无法被 cancel_processes 终止，批次之间检查取消标志
+        if CANCEL.is_set():
+            return None
+        for error in _flake8_run(style_guide, collector, paths[i:i + FLAKE8_BATCH_FILES], quarantine):
+            results[os.path.relpath(error[0], root_dir).replace("\\", "/")].append(list(error[1:]))
+    quarantine = {os.path.relpath(path, root_dir).replace("\\", "/") for path in quarantine}
+    return {rel: {"errors": results.get(rel, []), "quarantined": rel in quarantine} for rel in stale}
+
+
+def _flake8_report(errors: List[tuple], start_time: float) -> bool:
+    """按 GitHub CI 的两个阶段打印结果；有致命错误时返回 False"""
     # 1. Critical Errors (GitHub: Stop build if there are Python syntax errors or undefined names)
     # 对应: flake8 . --count --select=E9,F63,F7,F82 --show-source --statistics --exclude=...
     print("👉 阶段 1: 检查严重错误 (语法错误, 未定义名称)...")
-    
-    # 排除目录列表（与 GitHub CI 和 .flake8 保持一致）
-    # 注意：engine.py 和 new_menu_callback.py 因文件过大或逻辑过于复杂导致 mccabe 溢出，必须排除
-    exclude_dirs = ".git,__pycache__,.venv,venv,env,build,dist,*.egg-info,tests/temp,.agent/temp,archive,alembic,services/dedup/engine.py,handlers/button/callback/new_menu_callback.py"
-    
-    cmd_critical = [
-        sys.executable, "-m", "flake8", ".",
-        "--count",
-        "--select=E9,F63,F7,F82",
-        "--show-source",
-        "--statistics",
-        f"--exclude={exclude_dirs}"
-    ]
-    
-    code, out, err = run_command(cmd_critical, cwd=root_dir)
-    
-    # 检查致命错误（即使返回码可能不正确）
-    # 注意：Flake8 可能将错误输出到 stdout 或 stderr
-    fatal_errors = [
-        'RecursionError',
-        'ValueError: source code string cannot contain null bytes',
-        'SystemExit',
-        'KeyboardInterrupt',
-        'MemoryError'
-    ]
-    
-    has_fatal_error = False
-    combined_output = (out or "") + (err or "")
-    for fatal_error in fatal_errors:
-        if fatal_error in combined_output:
-            has_fatal_error = True
-            print_error(f"检测到致命错误: {fatal_error}")
-            if fatal_error == 'RecursionError':
-                print_warning("💡 提示: RecursionError 通常是由于某个函数圈复杂度过高。")
-                print_warning("💡 建议: 使用 '--jobs 1 --verbose' 找出出错的文件并将其加入 exclude 列表。")
-            break
-
-    
-    # 输出结果
-    if out: print(out)
-    if err: print(err)
-    
-    # 判断失败条件：返回码非0 或 存在致命错误
-    if code != 0 or has_fatal_error:
+    critical = [e for e in errors if e[1].startswith(FLAKE8_CRITICAL)]
+    _flake8_print(critical, show_source=True)
+    if critical:
         elapsed = time.time() - start_time
         print_error(f"GitHub Flake8 Critical Check 失败 (耗时: {elapsed:.2f}s)")
-        if has_fatal_error:
-            print("💡 检测到致命异常，这会导致 GitHub CI 构建失败。")
-            print("💡 建议: 检查并修复导致异常的文件（可能是圈复杂度过高或文件损坏）。")
-        else:
-            print("💡 这些错误会导致 GitHub CI 构建失败，必须修复。")
+        print("💡 这些错误会导致 GitHub CI 构建失败，必须修复。")
         return False
 
     # 2. Warnings (GitHub: exit-zero treats all errors as warnings)
     # 对应: flake8 . --count --exit-zero --max-complexity=10 --max-line-length=127 --statistics --exclude=...
     print("\n👉 阶段 2: 检查代码风格与复杂度 (仅供参考)...")
-    cmd_warning = [
-        sys.executable, "-m", "flake8", ".",
-        "--count",
-        "--exit-zero",
-        "--max-complexity=10",
-        "--max-line-length=127",
-        "--statistics",
-        f"--exclude={exclude_dirs}"
-    ]
-    
-    # 我们忽略这里的返回值，因为它带有 exit-zero，且 GitHub Action 不会因此失败
-    # 但我们打印输出供开发者参考
-    # 注意：即使遇到 RecursionError 也不应该导致 CI 失败（这只是警告阶段）
-    code_w, out_w, err_w = run_command(cmd_warning, cwd=root_dir)
-    
-    # 检查是否有 RecursionError（仅警告，不失败）
-    if 'RecursionError' in (out_w or ""):
-        print_warning("检测到复杂度检查时的 RecursionError（某些文件过于复杂）")
-        print_warning("这不影响 CI 通过，但建议后续重构相关文件")
-    elif out_w:
-        print(out_w)
-    if err_w: print(err_w)
-    
+    _flake8_print(errors, show_source=False)
+
     elapsed = time.time() - start_time
     print_success(f"GitHub Flake8 检查通过 (耗时: {elapsed:.2f}s)")
     return True
 
 
+def check_flake8(root_dir: str, step: int = 0, total: int = 0) -> bool:
+    """执行与 GitHub Actions 一致的 Flake8 检查。
+
+    两个阶段 (致命错误 / 风格与复杂度) 由同一次进程内 (--jobs=1) 检查得出，每个文件只解析一次；
+    结果按文件内容哈希缓存在 tests/temp/flake8_cache.json，未修改的文件直接复用。
+    触发 RecursionError (通常是 mccabe / AST 递归过深) 的文件被隔离: 跳过检查并给出警告，
+    隔离按内容哈希记住，文件修改后会重新尝试。
+    """
+    print_step("代码质量 (GitHub Flake8 Mode)", step, total)
+    start_time = time.time()
+    try:
+        import flake8.options.parse_args  # noqa: F401  (flake8 >= 6)
+    except ImportError:
+        print_error("未安装 flake8 >= 6 (uv pip install flake8)")
+        return False
+
+    config_key = flake8_config_key(root_dir)
+    cache_path = os.path.join(root_dir, FLAKE8_CACHE_PATH)
+    files, digests, stale = _scan_flake8_files(root_dir, _load_flake8_memo(cache_path, config_key))
+    if stale:
+        checked = _flake8_check_stale(root_dir, stale)
+        if checked is None:
+            print_warning("Flake8 检查已取消 (其他阶段失败)")
+            return False
+        files.update(checked)
+
+    errors, quarantined = [], []
+    for rel, entry in files.items():
+        size, mtime, digest = digests[rel]
+        entry.update(size=size, mtime=mtime, hash=digest)
+        if entry["quarantined"]:
+            quarantined.append(rel)
+        errors.extend((rel, *error) for error in entry["errors"])
+    errors.sort(key=lambda e: (e[0], e[2], e[3], e[1]))
+    _save_flake8_memo(cache_path, config_key, files)
+
+    print(f"🗂️ 检查 {len(files)} 个文件: 解析 {len(stale)} 个，{len(files) - len(stale)} 个未修改沿用缓存")
+    for rel in quarantined:
+        print_warning(f"已隔离 (RecursionError，函数圈复杂度或嵌套过深): {rel} — 跳过检查，建议重构")
+    return _flake8_report(errors, start_time)
+
+
 def get_test_count(root_dir: str, targets: List[str] = []) -> int:
     """获取测试用例总数，用于进度条展示"""
     cmd = [sys.executable, "-m", "pytest", "--collect-only", "-q"] + targets
@@ -215,53 +573,121 @@ def get_memory_usage() -> float:
     except ImportError:
         return 0.0
 
-def save_error_report(content: str, root_dir: str):
-    """保存错误报告到临时文件，供 AI 分析"""
+# Pytest 输出的流式解析: 只保留有界的结构化结果，驱动进程内存不随日志大小增长
+MAX_REPORTED_FAILURES = 100  # 报告中保留堆栈的失败用例数
+TRACEBACK_CONTEXT_LINES = 60  # 每个失败保留的堆栈尾部行数 (断言位置通常在末尾)
+ALERT_LINES = 50  # 控制台失败摘要的行数
+
+_STATUSES = "PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS"
+# 进度行: "node_id STATUS [ 50%]" (-vv) 或 "[gw0] [ 50%] STATUS node_id" (xdist)；
+# 参数化 id 可能含空格 (test_p[a b])，所以 node id 取到状态词 / 行尾为止
+_PROGRESS_RE = re.compile(rf"^(\S+::.+?)\s+({_STATUSES})\b"
+                          rf"|\b({_STATUSES})\s+(\S+::.+?)\s*$")
+
+
+class PytestLogParser:
+    """逐行解析 pytest (-vv) 输出。
+
+    统计各状态的用例数，记录失败 / 出错用例及其摘要信息，并为 FAILURES / ERRORS
+    区域中的每个失败保留一个有界的环形缓冲 (最后 TRACEBACK_CONTEXT_LINES 行)。
+    完整日志由调用方直接写入报告文件，这里不保存。
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.failures: Dict[str, str] = {}  # node id -> 摘要信息 (按出现顺序，最多 MAX_REPORTED_FAILURES 个)
+        self.failure_total = 0
+        self._seen = set()  # 全部失败 node id (含超出 MAX_REPORTED_FAILURES 未记录摘要的)，避免重复计数
+        self.sections = deque(maxlen=MAX_REPORTED_FAILURES)  # [标题, 环形缓冲, 已丢弃行数]
+        self.alerts = deque(maxlen=ALERT_LINES)  # 含 FAILED / ERROR / Traceback 的行
+        self.lines = 0
+        self.last_test = None
+        self._capture = False
+
+    def _add_failure(self, node_id: str, message: str = ""):
+        if node_id not in self._seen:
+            self._seen.add(node_id)
+            self.failure_total += 1
+        if node_id not in self.failures and len(self.failures) >= MAX_REPORTED_FAILURES:
+            return
+        if message or node_id not in self.failures:
+            self.failures[node_id] = message
+
+    def _capture_line(self, line: str) -> bool:
+        """详细堆栈区域: ==== FAILURES ==== / ==== ERRORS ==== 到下一个 ==== 标题。行被收入堆栈时返回 True"""
+        if "= FAILURES =" in line or "= ERRORS =" in line:
+            self._capture = True
+            self.sections.append([line.strip(" ="), deque(maxlen=TRACEBACK_CONTEXT_LINES), 0])
+            return True
+        if not self._capture:
+            return False
+        if "= short test summary info =" in line or line.startswith("==========") or " generated xml file: " in line:
+            self._capture = False
+            return False
+        if line.startswith("___") and line.endswith("___"):
+            # 每个失败用例的分隔标题: ____ test_name ____
+            self.sections.append([line.strip(" _"), deque(maxlen=TRACEBACK_CONTEXT_LINES), 0])
+            return True
+        if not line.strip():
+            return False
+        section = self.sections[-1]
+        if len(section[1]) == section[1].maxlen:
+            section[2] += 1
+        section[1].append(line)
+        return True
+
+    def feed(self, line: str):
+        line = line.rstrip("\n")
+        self.lines += 1
+        if "FAILED" in line or "ERROR" in line or "Traceback" in line:
+            self.alerts.append(line)
+
+        if self._capture_line(line):
+            return
+
+        # 结尾摘要: FAILED tests/x.py::test_y - AssertionError: ...
+        if line.startswith(("FAILED ", "ERROR ")):
+            status, _, rest = line.partition(" ")
+            node_id, _, message = rest.partition(" - ")
+            self._add_failure(node_id.strip(), message.strip())
+            return
+        match = _PROGRESS_RE.search(line)
+        if match:
+            node_id = match.group(1) or match.group(4)
+            status = match.group(2) or match.group(3)
+            self.counts[status] += 1
+            self.last_test = node_id
+            if status in ("FAILED", "ERROR"):
+                self._add_failure(node_id)
+
+    def summary(self) -> str:
+        return ", ".join(f"{count} {status.lower()}" for status, count in self.counts.most_common())
+
+
+def save_error_report(parser: PytestLogParser, root_dir: str, desc: str = "Test Run"):
+    """保存错误报告到临时文件，供 AI 分析 (由流式解析的结构化结果生成)"""
     temp_dir = os.path.join(root_dir, "tests", "temp")
     os.makedirs(temp_dir, exist_ok=True)
-    report_path = os.path.join(temp_dir, "ci_error_report.log")
-    
-    # 简单的过滤整理
-    filtered_lines = []
-    capture = False
-    lines = content.splitlines()
-    
-    failures = []
-    errors = []
+    suffix = "" if desc == "Test Run" else "_" + re.sub(r'[^a-zA-Z0-9_\-]', '_', desc)
+    report_path = os.path.join(temp_dir, f"ci_error_report{suffix}.log")
     
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     
-    for line in lines:
-        # 捕获失败摘要
-        if line.startswith("FAILED ") or line.startswith("ERROR "):
-             # FAILED tests/xxx.py::test_xxx - AssertionError...
-             parts = line.split(" - ", 1)
-             if len(parts) > 0:
-                 failures.append(parts[0])
-        
-        # 捕获详细 Traceback 区域
-        if "= FAILURES =" in line or "= ERRORS =" in line:
-            capture = True
-            filtered_lines.append(f"\n--- {line.strip(' =')} ---\n")
-            continue
-        
-        if capture:
-            # 停止捕获条件
-            if "= short test summary info =" in line or line.startswith("=========="):
-                capture = False
-                continue
-            
-            # 过滤掉一些不重要的行
-            if not line.strip(): continue
-            # 简单去重或保留关键行 (这里保留缩进的行通常是代码或Traceback)
-            filtered_lines.append(line)
+    filtered_lines = []
+    for title, lines, dropped in parser.sections:
+        filtered_lines.append(f"\n--- {title} ---\n")
+        if dropped:
+            filtered_lines.append(f"... (省略前 {dropped} 行)")
+        filtered_lines.extend(lines)
 
+    omitted = parser.failure_total - len(parser.failures)
     summary_text = [
         f"CI 错误分析报告 - {timestamp}",
         "=" * 50,
-        f"总计失败: {len(failures)}",
+        f"总计失败: {parser.failure_total}",
         "失败用例清单:"
-    ] + [f"- {f}" for f in failures] + [
+    ] + [f"- {node_id}" + (f" - {message}" if message else "") for node_id, message in parser.failures.items()] + (
+        [f"- ... 另有 {omitted} 个失败未列出"] if omitted > 0 else []) + [
         "=" * 50,
         "详细堆栈跟踪 (已过滤):"
     ] + filtered_lines
@@ -274,8 +700,711 @@ def save_error_report(content: str, root_dir: str):
     except Exception as e:
         print_error(f"保存错误报告失败: {e}")
 
-def run_tests(root_dir: str, test_targets: List[str], step: int = 0, total: int = 0, args: argparse.Namespace = None) -> bool:
-    """运行测试。若提供目标则针对性运行，否则全量分批运行。"""
+# ---------------------------------------------------------
+# 测试分片: 记录每个用例的耗时，按 LPT 装箱为耗时均衡的并发分片
+# ---------------------------------------------------------
+# 全量测试覆盖的目录 (与原分批范围一致)
+TEST_PATHS = ["tests/unit/core", "tests/unit/schemas", "tests/unit/models", "tests/unit/services", "tests/unit/handlers",
+              "tests/unit/middlewares", "tests/unit/web_admin", "tests/integration", "tests/fuzz"]
+DURATIONS_PATH = os.path.join("tests", "temp", "test_durations.json")
+JUNIT_DIR = os.path.join("tests", "temp", "junit")
+PYTEST_ARGFILE_VERSION = (8, 2)  # 分片用 @file 传入用例列表所需的 pytest 版本
+SHARD_CMDLINE_CHARS = 24000  # 不支持 @file 时每次调用传入的 node id 总长度 (Windows 命令行上限约 32k)
+SHARD_MEM_MB = 700  # 每个分片 (一个 pytest 进程) 的内存估算，2GB 内存可容纳 2 个分片
+DEFAULT_TEST_SECONDS = 0.5  # 尚无任何历史耗时时的新用例估算
+DURATION_SMOOTHING = 0.5  # 新测得耗时的权重 (指数平滑)
+
+
+def junit_args(root_dir: str, name: str) -> List[str]:
+    """让 pytest 输出带 file 属性的 JUnit XML，用于记录每个用例的耗时"""
+    os.makedirs(os.path.join(root_dir, JUNIT_DIR), exist_ok=True)
+    junit_path = os.path.join(JUNIT_DIR, name + ".xml")
+    if os.path.exists(os.path.join(root_dir, junit_path)):
+        os.remove(os.path.join(root_dir, junit_path))  # 未实际运行 (命中缓存) 时不重复记录旧耗时
+    return [f"--junitxml={junit_path}", "-o", "junit_family=xunit1"]
+
+
+def load_durations(root_dir: str) -> Dict[str, float]:
+    """历史用例耗时: node id -> 秒"""
+    try:
+        with open(os.path.join(root_dir, DURATIONS_PATH), "r", encoding="utf-8") as f:
+            return json.load(f).get("tests", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def record_durations(root_dir: str, junit_paths: List[str]):
+    """从 JUnit XML 读取本次各用例耗时，平滑后写回 test_durations.json"""
+    import xml.etree.ElementTree as ET
+    durations = load_durations(root_dir)
+    measured = 0
+    for junit_path in junit_paths:
+        try:
+            tree = ET.parse(os.path.join(root_dir, junit_path))
+        except (OSError, ET.ParseError):
+            continue
+        for case in tree.iter("testcase"):
+            file_path = (case.get("file") or "").replace("\\", "/")
+            if not file_path or case.find("skipped") is not None:
+                continue
+            # classname = 模块点分路径 [+ 类名]，还原为 pytest node id
+            module = file_path[:-3].replace("/", ".") if file_path.endswith(".py") else file_path
+            classes = (case.get("classname") or "")[len(module):].strip(".")
+            node_id = "::".join([file_path] + (classes.split(".") if classes else []) + [case.get("name", "")])
+            seconds = float(case.get("time") or 0.0)
+            old = durations.get(node_id)
+            durations[node_id] = round(seconds if old is None else
+                                       DURATION_SMOOTHING * seconds + (1 - DURATION_SMOOTHING) * old, 4)
+            measured += 1
+    if not measured:
+        return
+    path = os.path.join(root_dir, DURATIONS_PATH)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "tests": durations}, f, indent=0, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print_warning(f"无法保存用例耗时: {e}")
+
+
+def collect_test_ids(root_dir: str, base_cmd: List[str], select_args: List[str]) -> Optional[List[str]]:
+    """收集待运行用例的 node id；收集出错时返回 None"""
+    code, out, _ = run_command(base_cmd + ["--collect-only", "-q"] + select_args, cwd=root_dir)
+    if code not in (0, 5):  # 5: 没有收集到用例
+        return None
+    return [line.strip() for line in out.splitlines() if "::" in line and not line.startswith(" ")]
+
+
+def estimate_durations(test_ids: List[str], durations: Dict[str, float]) -> Tuple[Dict[str, float], int]:
+    """每个用例的预估耗时。新用例取同文件已知用例的均值，否则取全部已知用例的中位数"""
+    by_file = defaultdict(list)
+    for node_id, seconds in durations.items():
+        by_file[node_id.split("::", 1)[0]].append(seconds)
+    known = sorted(durations.values())
+    fallback = known[len(known) // 2] if known else DEFAULT_TEST_SECONDS
+    estimates, new = {}, 0
+    for node_id in test_ids:
+        if node_id in durations:
+            estimates[node_id] = durations[node_id]
+            continue
+        same_file = by_file.get(node_id.split("::", 1)[0])
+        estimates[node_id] = sum(same_file) / len(same_file) if same_file else fallback
+        new += 1
+    return estimates, new
+
+
+def lpt_shards(estimates: Dict[str, float], count: int) -> List[Tuple[float, List[str]]]:
+    """LPT 装箱: 按耗时从长到短，每个用例放入当前总耗时最小的分片。返回 [(预估秒数, node ids)]"""
+    heap = [(0.0, i) for i in range(count)]
+    shards = [[] for _ in range(count)]
+    for node_id in sorted(estimates, key=lambda n: (-estimates[n], n)):
+        load, i = heapq.heappop(heap)
+        shards[i].append(node_id)
+        heapq.heappush(heap, (load + estimates[node_id], i))
+    loads = {i: load for load, i in heap}
+    # 分片内保持收集顺序，便于阅读日志且保留模块内 fixture 复用
+    order = {node_id: n for n, node_id in enumerate(estimates)}
+    return [(loads[i], sorted(shard, key=order.get)) for i, shard in enumerate(shards) if shard]
+
+
+# ---------------------------------------------------------
+# 内存调度: 采样 pytest 进程树的 RSS，按历史峰值选择并发数，逼近上限时暂停进程
+# ---------------------------------------------------------
+MEMORY_PROFILE_PATH = os.path.join("tests", "temp", "memory_profile.json")
+MEMORY_SAMPLE_INTERVAL = 0.2  # 秒
+MEMORY_HEADROOM = 1.2  # 按历史单进程峰值的 1.2 倍预留
+THROTTLE_RATIO = 0.9  # 进程树总 RSS 超过预算的该比例时暂停最新启动的进程
+RESUME_RATIO = 0.7  # 回落到该比例以下时恢复
+
+
+def available_memory_mb() -> Optional[float]:
+    """系统可用内存 (MB)，无法获取时返回 None"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _psutil_trees(psutil, root_pids: List[int]) -> Dict[int, List[int]]:
+    """process_trees 的 psutil 实现"""
+    trees = {}
+    for pid in root_pids:
+        try:
+            root = psutil.Process(pid)
+            trees[pid] = [pid] + [child.pid for child in root.children(recursive=True)]
+        except psutil.Error:
+            trees[pid] = []
+    return trees
+
+
+def _proc_children() -> Optional[Dict[int, List[int]]]:
+    """/proc 中 父 pid -> 子 pid 列表；/proc 不可用时返回 None"""
+    children = defaultdict(list)
+    try:
+        entries = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+    except OSError:
+        return None
+    for entry in entries:
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                children[int(f.read().rsplit(")", 1)[1].split()[1])].append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def _proc_trees(root_pids: List[int]) -> Dict[int, List[int]]:
+    """process_trees 的 /proc 实现 (无 psutil 的 Linux)"""
+    children = _proc_children()
+    if children is None:
+        return {pid: [] for pid in root_pids}
+    trees = {}
+    for pid in root_pids:
+        tree, queue = [], [pid]
+        while queue:
+            current = queue.pop()
+            tree.append(current)
+            queue.extend(children.get(current, ()))
+        trees[pid] = tree
+    return trees
+
+
+def process_trees(root_pids: List[int]) -> Dict[int, List[int]]:
+    """每个根进程及其全部子孙进程的 pid"""
+    try:
+        import psutil
+    except ImportError:
+        return _proc_trees(root_pids)
+    return _psutil_trees(psutil, root_pids)
+
+
+def process_rss_mb(pid: int) -> float:
+    """单个进程的 RSS (MB)，进程已退出时返回 0"""
+    try:
+        import psutil
+        try:
+            return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+        except psutil.Error:
+            return 0.0
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def signal_tree(pids: List[int], resume: bool):
+    """暂停 / 恢复一组进程"""
+    try:
+        import psutil
+        for pid in pids:
+            try:
+                proc = psutil.Process(pid)
+                proc.resume() if resume else proc.suspend()
+            except psutil.Error:
+                pass
+        return
+    except ImportError:
+        pass
+    if sys.platform == "win32":
+        return
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGCONT if resume else signal.SIGSTOP)
+        except OSError:
+            pass
+
+
+def memory_supported() -> bool:
+    try:
+        import psutil  # noqa: F401
+        return True
+    except ImportError:
+        return os.path.isdir("/proc")
+
+
+def load_memory_profile(root_dir: str) -> dict:
+    try:
+        with open(os.path.join(root_dir, MEMORY_PROFILE_PATH), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def worker_memory_estimate(root_dir: str) -> float:
+    """单个 pytest 进程 (含子进程) 的预计峰值 MB: 历史峰值 x 余量，无历史时用 SHARD_MEM_MB"""
+    peak = load_memory_profile(root_dir).get("worker_peak_mb")
+    return peak * MEMORY_HEADROOM if peak else SHARD_MEM_MB
+
+
+def plan_workers(root_dir: str, concurrency: int, mem_budget: int) -> Tuple[int, float, str]:
+    """按内存预算、当前可用内存与历史单进程峰值选择并发进程数，返回 (数量, 有效预算 MB, 说明)"""
+    per_worker = worker_memory_estimate(root_dir)
+    available = available_memory_mb()
+    budget = mem_budget if available is None else min(mem_budget, available)
+    workers = max(1, min(concurrency, int(budget // per_worker)))
+    note = f"预算 {budget:.0f}MB" + (f" (可用 {available:.0f}MB)" if available is not None else "")
+    return workers, budget, f"{note} / 每进程 {per_worker:.0f}MB, 并发上限 {concurrency}"
+
+
+class MemoryGovernor:
+    """后台采样所有在途子进程 (含子孙进程，如 xdist workers) 的 RSS。
+
+    进程树总 RSS 超过预算的 THROTTLE_RATIO 时暂停最新启动的进程 (逐个串行化)，
+    回落到 RESUME_RATIO 以下时按启动顺序恢复。记录每个进程树与总量的高水位，
+    结束时把单进程峰值平滑后写入 tests/temp/memory_profile.json，供下次选择并发数。
+    """
+
+    def __init__(self, root_dir: str, limit_mb: float):
+        self.root_dir = root_dir
+        self.limit_mb = limit_mb
+        self.peaks: Dict[int, float] = {}  # 根进程 pid -> 进程树 RSS 峰值
+        self.labels: Dict[int, str] = {}
+        self.high_water = 0.0
+        self.throttled = 0
+        self._order: List[int] = []
+        self._suspended: List[int] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if memory_supported():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for pid in self._suspended:
+            signal_tree(process_trees([pid]).get(pid, [pid]), resume=True)
+        self._suspended = []
+        return False
+
+    def _run(self):
+        while not self._stop.wait(MEMORY_SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        with _PROCESS_LOCK:
+            processes = [p for p in _PROCESSES if p.poll() is None]
+        for process in processes:
+            if process.pid not in self.labels:
+                self._order.append(process.pid)
+                match = re.search(r"shard_(\d+)\.args", " ".join(map(str, process.args)))
+                self.labels[process.pid] = f"SHARD {match.group(1)}" if match else "pytest"
+        trees = process_trees([p.pid for p in processes])
+        usage = {pid: sum(process_rss_mb(child) for child in tree) for pid, tree in trees.items()}
+        total = sum(usage.values())
+        for pid, rss in usage.items():
+            self.peaks[pid] = max(self.peaks.get(pid, 0.0), rss)
+        self.high_water = max(self.high_water, total)
+        self._suspended = [pid for pid in self._suspended if pid in usage]
+
+        running = [pid for pid in self._order if pid in usage and pid not in self._suspended]
+        if total > self.limit_mb * THROTTLE_RATIO and len(running) > 1:
+            victim = running[-1]  # 暂停最新启动的进程，让较早的先完成
+            signal_tree(trees[victim], resume=False)
+            self._suspended.append(victim)
+            self.throttled += 1
+            print_warning(f"内存 {total:.0f}MB 逼近预算 {self.limit_mb:.0f}MB，暂停 {self.labels[victim]}")
+        elif self._suspended and (not running or total < self.limit_mb * RESUME_RATIO):
+            # 被暂停的进程仍占着内存: 其他进程都已结束时也要恢复一个，避免全部挂起
+            pid = self._suspended.pop(0)
+            signal_tree(trees[pid], resume=True)
+            print(f"▶️ 内存 {total:.0f}MB，恢复 {self.labels[pid]}")
+
+    def report(self, desc: str):
+        """打印内存高水位并更新历史单进程峰值"""
+        if not self.peaks:
+            return
+        per_process = " | ".join(f"{self.labels[pid]} {peak:.0f}MB" for pid, peak in self.peaks.items())
+        throttled = f", 暂停 {self.throttled} 次" if self.throttled else ""
+        print(f"🧠 {desc} 内存高水位: 合计 {self.high_water:.0f}MB / 预算 {self.limit_mb:.0f}MB ({per_process}){throttled}")
+        profile = load_memory_profile(self.root_dir)
+        peak = max(self.peaks.values())
+        old = profile.get("worker_peak_mb")
+        profile["worker_peak_mb"] = round(peak if old is None else max(peak, 0.5 * old + 0.5 * peak), 1)
+        profile["runs"] = (profile.get("runs", []) + [{
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"), "desc": desc, "processes": len(self.peaks),
+            "high_water_mb": round(self.high_water, 1), "throttled": self.throttled}])[-20:]
+        path = os.path.join(self.root_dir, MEMORY_PROFILE_PATH)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(profile, f, indent=2)
+        except OSError as e:
+            print_warning(f"无法保存内存记录: {e}")
+
+
+class ShardGroup:
+    """同一次分片运行的 pytest 进程: 任一分片失败时终止其余分片 (不置位全局 CANCEL，其他阶段不受影响)"""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def add(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled.is_set():
+            kill_process_tree(process)
+
+    def discard(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.discard(process)
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_tree(process)
+
+
+def pytest_supports_argfile() -> bool:
+    """pytest >= 8.2 支持 @file 参数文件"""
+    version = tuple(int(part) for part in re.findall(r"\d+", tool_version("pytest"))[:2])
+    return version >= PYTEST_ARGFILE_VERSION
+
+
+def chunk_node_ids(node_ids: List[str], limit: int = SHARD_CMDLINE_CHARS) -> List[List[str]]:
+    """按命令行长度把 node ids 分成若干组 (每组总长度不超过 limit，至少一个 id)"""
+    chunks, size = [[]], 0
+    for node_id in node_ids:
+        if chunks[-1] and size + len(node_id) + 1 > limit:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(node_id)
+        size += len(node_id) + 1
+    return chunks
+
+
+def shard_commands(root_dir: str, base_cmd: List[str], marker_args: List[str], common_args: List[str],
+                   index: int, node_ids: List[str]) -> List[Tuple[str, List[str]]]:
+    """一个分片依次执行的 [(JUnit 名称, pytest 命令)]。
+    用例列表写入参数文件 (pytest >= 8.2 的 @file)，避免命令行过长；更早的 pytest 按长度分组直接传参"""
+    name = f"shard_{index + 1}"
+    if pytest_supports_argfile():
+        args_path = os.path.join(root_dir, JUNIT_DIR, f"{name}.args")
+        cmd = base_cmd + marker_args + [f"@{args_path}"] + common_args + junit_args(root_dir, name)
+        with open(args_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(node_ids))
+        return [(name, cmd)]
+    chunks = chunk_node_ids(node_ids)
+    names = [name] if len(chunks) == 1 else [f"{name}_{c + 1}" for c in range(len(chunks))]
+    return [(chunk_name, base_cmd + marker_args + chunk + common_args + junit_args(root_dir, chunk_name))
+            for chunk_name, chunk in zip(names, chunks)]
+
+
+def _run_shards(root_dir: str, plans: List[List[Tuple[str, List[str]]]], budget: float) -> Tuple[list, List[float]]:
+    """并发运行各分片 (分片内的命令依次执行)；任一分片失败时终止其余分片。
+    返回 (各分片结果 True / False / "cancelled", 各分片耗时)"""
+    results = [None] * len(plans)
+    elapsed = [0.0] * len(plans)
+    group = ShardGroup()
+    # 在阶段调度器中运行时，分片线程沿用本阶段的输出缓冲区
+    stage_buffer = getattr(getattr(sys.stdout, "local", None), "buffer", None)
+
+    def run_shard(i: int):
+        if stage_buffer is not None:
+            sys.stdout.local.buffer = stage_buffer
+        start_time = time.time()
+        parts = len(plans[i])
+        descs = [f"SHARD {i + 1}/{len(plans)}" + (f" ({c + 1}/{parts})" if parts > 1 else "") for c in range(parts)]
+        ok = all(_execute_pytest(cmd, root_dir, desc=desc, announce=False, group=group)
+                 for desc, (_, cmd) in zip(descs, plans[i]))
+        elapsed[i] = time.time() - start_time
+        if ok:
+            results[i] = True
+        elif group.cancelled.is_set():
+            results[i] = "cancelled"  # 被其他分片的失败终止
+        else:
+            results[i] = False
+            group.cancel()
+
+    threads = [threading.Thread(target=run_shard, args=(i,), daemon=True) for i in range(len(plans))]
+    with MemoryGovernor(root_dir, budget) as governor:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    governor.report(f"{len(plans)} 个分片")
+    return results, elapsed
+
+
+def _print_shard_summary(shards: List[Tuple[float, List[str]]], results: list, elapsed: List[float], wall: float) -> bool:
+    """打印各分片实际 / 预估耗时与均衡度；全部分片通过时返回 True"""
+    mean = sum(elapsed) / len(elapsed)
+    print("\n⏱  分片耗时: " + " | ".join(f"#{i + 1} {e:.2f}s (预估 {load:.2f}s)"
+                                       for i, (e, (load, _)) in enumerate(zip(elapsed, shards))))
+    print(f"⏱  测试总耗时 {wall:.2f}s (分片累计 {sum(elapsed):.2f}s) | 均衡度 max/mean = {max(elapsed) / mean if mean else 1.0:.2f}")
+    if all(ok is True for ok in results):
+        return True
+    failed = [str(i + 1) for i, ok in enumerate(results) if ok is False]
+    cancelled = [str(i + 1) for i, ok in enumerate(results) if ok == "cancelled"]
+    print_error(f"分片失败: {', '.join(failed) or '-'}" + (f" (已终止其余分片: {', '.join(cancelled)})" if cancelled else ""))
+    return False
+
+
+def run_sharded_tests(root_dir: str, base_cmd: List[str], marker_args: List[str], path_args: List[str],
+                      common_args: List[str], args: argparse.Namespace) -> bool:
+    """按历史耗时把用例装入均衡分片，并发运行各分片 (每个分片一个 pytest 进程)。
+    marker_args 为 -m 过滤参数 (分片沿用)，path_args 为收集范围 (测试目录与 --ignore)"""
+    count, budget, plan = plan_workers(root_dir, getattr(args, "concurrency", 2), getattr(args, "mem_budget", 2048))
+
+    test_ids = collect_test_ids(root_dir, base_cmd, marker_args + path_args)
+    if test_ids is None:
+        # 收集失败 (语法错误、导入错误等)，直接运行以显示错误
+        print_warning("用例收集失败，改为单进程运行以显示错误")
+        return _execute_pytest(base_cmd + marker_args + path_args + common_args, root_dir, desc="Collection")
+    if not test_ids:
+        print_warning("没有需要运行的用例")
+        return True
+
+    estimates, new = estimate_durations(test_ids, load_durations(root_dir))
+    shards = lpt_shards(estimates, min(count, len(test_ids)))
+    print(f"📊 {len(test_ids)} 个用例 ({new} 个新用例使用估算耗时) -> {len(shards)} 个分片 ({plan})")
+
+    # 启动前统一打印各分片命令，避免并发分片的启动信息交错
+    plans = []
+    for i, (load, node_ids) in enumerate(shards):
+        plans.append(shard_commands(root_dir, base_cmd, marker_args, common_args, i, node_ids))
+        print(f"📦 [Shard {i + 1}/{len(shards)}] {len(node_ids)} 个用例, 预估 {load:.2f}s: " + (
+            " ".join(plans[-1][0][1]) if len(plans[-1]) == 1 else f"{len(plans[-1])} 次 pytest 调用 (pytest < 8.2，直接传入 node id)"))
+    start_time = time.time()
+    results, elapsed = _run_shards(root_dir, plans, budget)
+    wall = time.time() - start_time
+    record_durations(root_dir, [os.path.join(JUNIT_DIR, name + ".xml") for commands in plans for name, _ in commands])
+    return _print_shard_summary(shards, results, elapsed, wall)
+
+
+# ---------------------------------------------------------
+# 变更影响分析 (--changed): git diff + 反向 import 图，只运行受影响的测试文件
+# ---------------------------------------------------------
+IMPORTS_PATH = os.path.join("tests", "temp", "import_graph.json")
+
+
+def git_changed_files(root_dir: str, base: str) -> Optional[List[str]]:
+    """相对 base 的变更文件 (含未提交与未跟踪的文件)，路径相对 root_dir；git 不可用时返回 None"""
+    code, out, _ = run_command(["git", "diff", "--name-only", "--relative", base], cwd=root_dir)
+    if code != 0:
+        return None
+    code_u, untracked, _ = run_command(["git", "ls-files", "--others", "--exclude-standard"], cwd=root_dir)
+    lines = out.splitlines() + (untracked.splitlines() if code_u == 0 else [])
+    return sorted({line.strip().replace("\\", "/") for line in lines if line.strip()})
+
+
+def module_name(rel_path: str) -> str:
+    """相对路径 -> 模块名 (a/b/__init__.py -> a.b)"""
+    parts = rel_path[:-3].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def is_test_file(rel_path: str) -> bool:
+    name = rel_path.rsplit("/", 1)[-1]
+    return rel_path.startswith("tests/") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+def parse_imports(path: str, module: str, is_package: bool) -> List[str]:
+    """文件中 import 的全部模块名 (相对导入已解析为绝对名，含 from x import y 的 x.y 候选)"""
+    import ast
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError, RecursionError):
+        return []
+    package = module.split(".") if is_package else module.split(".")[:-1]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package[:len(package) - (node.level - 1)] if node.level - 1 <= len(package) else []
+                target = ".".join(base + ([node.module] if node.module else []))
+            else:
+                target = node.module or ""
+            if target:
+                names.add(target)
+            names.update(f"{target}.{alias.name}" if target else alias.name for alias in node.names if alias.name != "*")
+    return sorted(names)
+
+
+def _scan_imports(root_dir: str, memo: dict) -> Tuple[Dict[str, str], Dict[str, List[str]], dict]:
+    """项目模块 -> 文件、模块 -> 其 import 的模块名，以及新的解析缓存 (大小、mtime 未变的文件沿用 memo)"""
+    files, imports, fresh = {}, {}, {}
+    for rel, path in walk_project(root_dir):
+        if not rel.endswith(".py"):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        module = module_name(rel)
+        entry = memo.get(rel)
+        if not (entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns):
+            entry = [st.st_size, st.st_mtime_ns, parse_imports(path, module, rel.endswith("__init__.py"))]
+        fresh[rel] = entry
+        files[module] = rel
+        if module.startswith("src."):
+            files.setdefault(module[4:], rel)  # src 布局: 以包名导入
+        imports[module] = entry[2]
+    return files, imports, fresh
+
+
+def _import_targets(name: str, files: Dict[str, str]) -> List[str]:
+    """import name 依赖的模块: 项目内的模块取其文件的模块名，其余保留原名"""
+    # import a.b.c 会先执行 a 与 a.b 的 __init__
+    parts = name.split(".")
+    targets = (".".join(parts[:i]) for i in range(1, len(parts) + 1))
+    return [module_name(files[target]) if target in files else target for target in targets]
+
+
+def build_reverse_imports(root_dir: str) -> Tuple[Dict[str, str], Dict[str, set]]:
+    """项目模块 -> 文件，以及反向 import 图 (模块 -> 导入它的模块)。
+    不在项目中的模块也按名字记录导入方，使已删除或改名的模块仍能找到依赖它的文件。
+    解析结果按 (大小, mtime) 缓存在 tests/temp/import_graph.json"""
+    cache_path = os.path.join(root_dir, IMPORTS_PATH)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            memo = json.load(f)
+    except (OSError, ValueError):
+        memo = {}
+    files, imports, fresh = _scan_imports(root_dir, memo)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(fresh, f)
+    except OSError:
+        pass
+
+    importers = defaultdict(set)
+    for module, names in imports.items():
+        for name in names:
+            for target in _import_targets(name, files):
+                if target != module:
+                    importers[target].add(module)
+    return files, importers
+
+
+def needs_full_run(changed: List[str]) -> bool:
+    """配置、conftest.py 或测试数据变更时需要全量运行；其余非 .py 变更只给出提示"""
+    for rel in changed:
+        name = rel.rsplit("/", 1)[-1]
+        if rel in CONFIG_FILES or name == "conftest.py":
+            print_warning(f"配置变更 ({rel})，改为全量测试")
+            return True
+        if rel.startswith("tests/") and not rel.endswith(".py"):
+            print_warning(f"测试数据变更 ({rel})，改为全量测试")
+            return True
+    ignored = [rel for rel in changed if not rel.endswith(".py")]
+    if ignored:
+        print_warning(f"{len(ignored)} 个非 .py 文件变更不参与影响分析 (如: {', '.join(ignored[:3])})；需要时请去掉 --changed")
+    return False
+
+
+def select_impacted_tests(root_dir: str, base: str) -> Optional[List[str]]:
+    """受 base 以来变更影响的测试文件；需要全量运行时返回 None"""
+    changed = git_changed_files(root_dir, base)
+    if changed is None:
+        print_warning(f"无法获取相对 {base} 的 git diff，改为全量测试")
+        return None
+    changed = [rel for rel in changed if not is_skipped_path(rel)]  # tests/temp 等运行产物
+    if not changed:
+        print_success(f"相对 {base} 没有变更文件")
+        return []
+    if needs_full_run(changed):
+        return None
+
+    files, importers = build_reverse_imports(root_dir)
+    changed_py = [rel for rel in changed if rel.endswith(".py")]
+    reached = {module_name(rel) for rel in changed_py}
+    # 已删除的 src 布局模块以包名被导入
+    reached |= {m[4:] for m in reached if m.startswith("src.") and m[4:] not in files}
+    queue = list(reached)
+    while queue:
+        for importer in importers.get(queue.pop(), ()):
+            if importer not in reached:
+                reached.add(importer)
+                queue.append(importer)
+    selected = sorted({files[m] for m in reached if m in files and is_test_file(files[m])}
+                      | {rel for rel in changed_py if is_test_file(rel) and os.path.exists(os.path.join(root_dir, rel))})
+    selected = [rel for rel in selected if not rel.startswith("tests/performance/")]
+
+    # 以历史用例耗时估算选中比例与节省时间
+    all_tests = sorted(files[m] for m in files if is_test_file(files[m]) and not files[m].startswith("tests/performance/"))
+    durations = load_durations(root_dir)
+    chosen = set(selected)
+    known = [(node_id.split("::", 1)[0], seconds) for node_id, seconds in durations.items()
+             if os.path.exists(os.path.join(root_dir, node_id.split("::", 1)[0]))]
+    selected_tests = sum(1 for rel, _ in known if rel in chosen)
+    saved = sum(seconds for rel, seconds in known if rel not in chosen)
+    print(f"🎯 变更 {len(changed)} 个文件 (相对 {base}) -> 选中 {len(selected)}/{len(set(all_tests))} 个测试文件"
+          f" (历史记录中 {selected_tests}/{len(known)} 个用例), 预计节省 {saved:.2f}s")
+    for rel in selected:
+        print(f"   - {rel}")
+    return selected
+
+
+def _pytest_fingerprint(cache: StageCache, stage: str, cmd: List[str]) -> str:
+    """Pytest 阶段指纹；并发数 (-n) 不影响结果，不参与哈希"""
+    args = cmd[1:]
+    key_args = [a for i, a in enumerate(args) if a != "-n" and (i == 0 or args[i - 1] != "-n")]
+    return cache.fingerprint(stage, [tool_version("pytest"), tool_version("pytest-xdist")] + key_args)
+
+def _cached_pytest(cmd: List[str], root_dir: str, desc: str, stage: str, cache: Optional[StageCache]) -> bool:
+    """执行 Pytest；输入未变化且上次通过时跳过"""
+    if cache is None:
+        return _execute_pytest(cmd, root_dir, desc=desc)
+    fingerprint = _pytest_fingerprint(cache, stage, cmd)
+    if cache.hit(stage, fingerprint):
+        print_cached(desc, cache.stages[stage])
+        return True
+    start_time = time.time()
+    if not _execute_pytest(cmd, root_dir, desc=desc):
+        return False
+    cache.record(stage, fingerprint, time.time() - start_time)
+    return True
+
+def _run_targeted_tests(root_dir: str, cmd: List[str], test_targets: List[str], args: argparse.Namespace,
+                        cache: Optional[StageCache]) -> bool:
+    """针对性测试: 检查目标存在后单进程运行"""
+    for target in test_targets:
+        if not os.path.exists(os.path.join(root_dir, target)):
+            print_error(f"未找到测试文件: {target}")
+            return False
+
+    # 针对性测试直接运行，不强制并发限制，由用户参数决定或默认串行
+    # 如果用户想用 -n 4，他们需要在 local_ci 外部做，或者我们可以允许传递额外参数？
+    # 这里我们恢复默认行为（串行），保证稳定性。
+    cmd = cmd + junit_args(root_dir, "targeted")
+    with MemoryGovernor(root_dir, getattr(args, "mem_budget", 2048)) as governor:
+        passed = _cached_pytest(cmd, root_dir, "Test Run", "test:" + " ".join(test_targets), cache)
+    governor.report("针对性测试")
+    record_durations(root_dir, [os.path.join(JUNIT_DIR, "targeted.xml")])
+    return passed
+
+
+def run_tests(root_dir: str, test_targets: List[str], step: int = 0, total: int = 0, args: argparse.Namespace = None,
+              cache: Optional[StageCache] = None, test_paths: Optional[List[str]] = None) -> bool:
+    """运行测试。若提供目标则针对性运行，否则按分片运行 test_paths (默认全量 TEST_PATHS)。"""
     
     # 启动前先清理残留
     kill_residual_pytest()
@@ -300,139 +1429,40 @@ def run_tests(root_dir: str, test_targets: List[str], step: int = 0, total: int
     
     if test_targets:
         print_step(f"针对性测试: {', '.join(test_targets)}", step, total)
-        for target in test_targets:
-            if not os.path.exists(os.path.join(root_dir, target)):
-                print_error(f"未找到测试文件: {target}")
-                return False
-        
-        # 针对性测试直接运行，不强制并发限制，由用户参数决定或默认串行
-        # 如果用户想用 -n 4，他们需要在 local_ci 外部做，或者我们可以允许传递额外参数？
-        # 这里我们恢复默认行为（串行），保证稳定性。
-        cmd = base_cmd + test_targets + common_args
-        return _execute_pytest(cmd, root_dir)
-        
+        return _run_targeted_tests(root_dir, base_cmd + test_targets + common_args, test_targets, args, cache)
     else:
-        print_step("全量测试 (分批执行模式)", step, total)
-        
-        # 全量测试分批策略：
-        # 为了避免 2GB 内存限制和超时，我们将测试分为几个批次运行
-        # 1. 核心 Core & Helpers
-        # 2. Schema & Models
-        # 3. Services
-        # 4. Handlers
-        # 5. Middlewares & Web Admin
-        # 6. Others (Integration, etc)
+        print_step("全量测试 (按耗时均衡分片)" if test_paths is None else "受影响的测试 (按耗时均衡分片)", step, total)
         
-        batches = [
-            ("Core & Helpers", ["tests/unit/core"]),
-            ("Schema & Models", ["tests/unit/schemas", "tests/unit/models"]),
-            ("Services", ["tests/unit/services"]),
-            ("Handlers", ["tests/unit/handlers"]),
-            ("Web & Middleware", ["tests/unit/middlewares", "tests/unit/web_admin"]),
-            ("Integration & Others", ["tests/integration", "tests/fuzz"]), 
-        ]
+        # 全量测试范围 (不含性能与压力测试)
+        scope = TEST_PATHS if test_paths is None else test_paths
+        valid_paths = [p for p in scope if os.path.exists(os.path.join(root_dir, p))]
+        if not valid_paths:
+            print_warning("未找到任何测试目录")
+            return True
         
         # 排除性能目录
         ignore_args = []
         if os.path.exists(os.path.join(root_dir, "tests/performance")):
              ignore_args = ["--ignore", "tests/performance"]
 
-        total_batches = len(batches)
-        
-        for i, (batch_name, paths) in enumerate(batches):
-            # 过滤存在的路径
-            valid_paths = [p for p in paths if os.path.exists(os.path.join(root_dir, p))]
-            if not valid_paths:
-                continue
-                
-            print(f"\n📦 [Batch {i+1}/{total_batches}] Running {batch_name}...")
-            
-            # 批次内使用适度并发. 默认 -n 2 以符合 2GB 内存限制
-            # 用户可以通过 --concurrency 参数调整
-            
-            concurrency = str(args.concurrency) if hasattr(args, 'concurrency') else "2"
-            
-            cmd = base_cmd + ["-n", concurrency, "-m", default_filters[0]] + valid_paths + common_args + ignore_args
-            
-            if not _execute_pytest(cmd, root_dir, desc=f"BATCH: {batch_name}"):
-                print_error(f"Batch {batch_name} failed.")
-                return False
-                
-        return True
+        marker_args = ["-m", default_filters[0]]
+        path_args = valid_paths + ignore_args
+        fingerprint = None
+        if cache is not None:
+            fingerprint = _pytest_fingerprint(cache, "test:sharded", base_cmd + marker_args + path_args + common_args)
+            if cache.hit("test:sharded", fingerprint):
+                print_cached("全量测试", cache.stages["test:sharded"])
+                return True
 
-def _execute_pytest(cmd: List[str], root_dir: str, desc: str = "Test Run") -> bool:
-    """内部执行 Pytest 的逻辑"""
-    print(f"🔄 正在启动 Pytest ({desc}): {' '.join(cmd)}")
-    start_time = time.time()
-    
-    out = ""
-    code = 0
-
-    if HAS_TQDM:
-        # 简单进度条模式，不预估总数，因为分批后获取总数太慢
-        pbar = tqdm(desc=f"🧪 {desc}...", unit="line", leave=True)
-        
-        try:
-            process = subprocess.Popen(
-                cmd,
-                cwd=root_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                errors='replace',
-                bufsize=1,
-                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if sys.platform == "win32" else 0
-            )
-            
-            full_output = []
-            
-            while True:
-                line = process.stdout.readline()
-                if not line and process.poll() is not None:
-                    break
-                
-                if line:
-                    full_output.append(line)
-                    pbar.update(1)
-                    # 尝试从输出中提取当前测试名更新进度条描述
-                    if "::" in line and ("PASSED" in line or "FAILED" in line):
-                         parts = line.split("::")
-                         if len(parts) > 1:
-                             test_name = parts[-1].split(" ")[0]
-                             pbar.set_description(f"🧪 {desc}: {test_name[:20]}...")
-            
-            process.stdout.close()
-            code = process.wait()
-            out = "".join(full_output)
-            
-        except KeyboardInterrupt:
-            if process:
-                 if sys.platform == "win32":
-                      subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
-                 else:
-                      process.kill()
-            pbar.close()
-            print_error("\n用户取消测试。")
-            sys.exit(1)
-        except Exception as e:
-            if process:
-                process.kill()
-            print_error(f"运行测试时发生错误: {e}")
+        start_time = time.time()
+        if not run_sharded_tests(root_dir, base_cmd, marker_args, path_args, common_args, args):
             return False
-        finally:
-            pbar.close()
-            
-    else:
-        # No tqdm
-        code, out, err = run_command(cmd, cwd=root_dir)
-        if err: out += "\nSTDERR:\n" + err
+        if cache is not None:
+            cache.record("test:sharded", fingerprint, time.time() - start_time)
+        return True
 
-    elapsed = time.time() - start_time
-    
-    # ---------------------------------------------------------
-    # 报告持久化逻辑 (防止污染根目录)
-    # ---------------------------------------------------------
+def _open_report(root_dir: str, cmd: List[str], desc: str):
+    """创建本次运行的报告文件 (tests/temp/reports)，写入头部后返回 (路径, 文件)；失败时返回 (None, None)"""
     try:
         report_dir = os.path.join(root_dir, "tests", "temp", "reports")
         os.makedirs(report_dir, exist_ok=True)
@@ -442,42 +1472,323 @@ def _execute_pytest(cmd: List[str], root_dir: str, desc: str = "Test Run") -> bo
         report_filename = f"test_run_{timestamp}_{sanitized_desc}.txt"
         report_path = os.path.join(report_dir, report_filename)
         
-        with open(report_path, "w", encoding="utf-8") as f:
-            f.write(f"Command: {' '.join(cmd)}\n")
-            f.write(f"Date: {time.ctime()}\n")
-            f.write("-" * 40 + "\n\n")
-            f.write(out)
-            
-        # 仅保留最近 20 个报告，避免无限增长
+        report = open(report_path, "w", encoding="utf-8")
+        report.write(f"Command: {' '.join(cmd)}\n")
+        report.write(f"Date: {time.ctime()}\n")
+        report.write("-" * 40 + "\n\n")
+        return report_path, report
+    except Exception as e:
+        print_warning(f"无法保存测试报告: {e}")
+        return None, None
+
+
+def _prune_reports(root_dir: str):
+    """仅保留最近 20 个报告，避免无限增长"""
+    try:
+        report_dir = os.path.join(root_dir, "tests", "temp", "reports")
         reports = sorted([os.path.join(report_dir, f) for f in os.listdir(report_dir)], key=os.path.getmtime)
         while len(reports) > 20:
             os.remove(reports.pop(0))
-            
-    except Exception as e:
-        print_warning(f"无法保存测试报告: {e}")
-        report_path = None
+    except OSError:
+        pass
 
-    if code != 0:
-        # Show failures
-        lines = out.splitlines()
-        # Filter for failure info
-        fail_log = [l for l in lines if "FAILED" in l or "ERROR" in l or "Traceback" in l]
-        if len(fail_log) > 50:
-             print("\n".join(fail_log[-50:]))
+
+def _start_pytest(cmd: List[str], root_dir: str, group: Optional[ShardGroup]) -> subprocess.Popen:
+    """启动 pytest 子进程 (独立进程组) 并登记，使取消时可以终止"""
+    process = subprocess.Popen(
+        cmd,
+        cwd=root_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding='utf-8',
+        errors='replace',
+        bufsize=1,
+        **popen_group_kwargs()
+    )
+    register_process(process)
+    if group:
+        group.add(process)
+    return process
+
+
+def _stream_pytest(process: subprocess.Popen, report, parser: "PytestLogParser", pbar, desc: str) -> int:
+    """逐行写入报告文件并交给解析器，返回退出码"""
+    for line in process.stdout:
+        if report:
+            report.write(line)
+        parser.feed(line)
+        if pbar:
+            pbar.update(1)
+            # 从解析结果中取当前测试名更新进度条描述
+            if parser.last_test and ("PASSED" in line or "FAILED" in line):
+                pbar.set_description(f"🧪 {desc}: {parser.last_test.split('::')[-1][:20]}...")
+    process.stdout.close()
+    return process.wait()
+
+
+def _finish_pytest(process: Optional[subprocess.Popen], pbar, report, group: Optional[ShardGroup]):
+    if pbar:
+        pbar.close()
+    if report:
+        report.close()
+    if process:
+        unregister_process(process)
+        if group:
+            group.discard(process)
+
+
+def _pytest_outcome(parser: "PytestLogParser", root_dir: str, desc: str, code: int, elapsed: float,
+                    report_path: Optional[str], group: Optional[ShardGroup]) -> bool:
+    """打印一次 pytest 运行的结果 (失败时导出错误报告)，返回是否通过"""
+    # 并发分片的结果整块输出，避免交错
+    with _OUTPUT_LOCK:
+        if CANCEL.is_set():
+            print_warning(f"{desc} 已取消 (其他阶段失败)")
+            return False
+        if group and group.cancelled.is_set() and code != 0:
+            print_warning(f"{desc} 已取消 (其他分片失败)")
+            return False
+
+        if code != 0:
+            # Show failures
+            print("\n".join(parser.alerts))
+
+            print_error(f"测试失败 ({desc}) (耗时: {elapsed:.2f}s, 状态码: {code}, {parser.summary() or '无用例结果'})")
+
+            if report_path:
+                print_warning(f"📋 完整日志已保存至: {report_path}")
+            save_error_report(parser, root_dir, desc)
+            return False
         else:
-             print("\n".join(fail_log))
-             
-        print_error(f"测试失败 ({desc}) (耗时: {elapsed:.2f}s, 状态码: {code})")
-        
-        if report_path:
-            print_warning(f"📋 完整日志已保存至: {report_path}")
-        # save_error_report(out, root_dir) # report_path serves similar purpose, but save_error_report does AI analysis prep
+            print_success(f"{desc} 通过 (耗时: {elapsed:.2f}s, {parser.summary() or '无用例结果'})")
+            if report_path:
+                print(f"      📄 详情: {report_path}")
+            return True
+
+
+def _execute_pytest(cmd: List[str], root_dir: str, desc: str = "Test Run", announce: bool = True,
+                    group: Optional[ShardGroup] = None) -> bool:
+    """内部执行 Pytest 的逻辑。
+
+    输出逐行流式处理: 原样写入报告文件 (防止污染根目录)，同时交给 PytestLogParser
+    增量解析；驱动进程只保留有界的解析结果，内存不随日志大小增长。
+    announce=False 时由调用方打印启动信息 (并发分片)；group 为所属的分片组。
+    """
+    if announce:
+        print(f"🔄 正在启动 Pytest ({desc}): {' '.join(cmd)}")
+    start_time = time.time()
+
+    parser = PytestLogParser()
+    report_path, report = _open_report(root_dir, cmd, desc)
+    # 简单进度条模式，不预估总数，因为分批后获取总数太慢
+    pbar = tqdm(desc=f"🧪 {desc}...", unit="line", leave=True) if HAS_TQDM else None
+    process = None
+
+    try:
+        process = _start_pytest(cmd, root_dir, group)
+        code = _stream_pytest(process, report, parser, pbar, desc)
+    except KeyboardInterrupt:
+        if process:
+            kill_process_tree(process)
+        print_error("\n用户取消测试。")
+        sys.exit(1)
+    except FileNotFoundError:
+        print_error(f"找不到命令: {cmd[0]}")
         return False
-    else:
-        print_success(f"{desc} 通过 (耗时: {elapsed:.2f}s)")
-        if report_path:
-             print(f"      📄 详情: {report_path}")
-        return True
+    except Exception as e:
+        if process:
+            process.kill()
+        print_error(f"运行测试时发生错误: {e}")
+        return False
+    finally:
+        _finish_pytest(process, pbar, report, group)
+
+    elapsed = time.time() - start_time
+    _prune_reports(root_dir)
+    return _pytest_outcome(parser, root_dir, desc, code, elapsed, report_path, group)
+
+
+# ---------------------------------------------------------
+# 阶段调度器: 按依赖关系 (DAG) 在 CPU / 内存预算内并发执行独立阶段
+# ---------------------------------------------------------
+class StageOutput:
+    """sys.stdout 代理: 并发阶段的输出写入各自线程的缓冲区，阶段结束后整块打印，避免交错"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            buffer.append(text)
+            return len(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Stage:
+    """一个检查阶段。run(step, total) 返回 True (通过)、False (失败) 或 None (命中缓存)"""
+
+    def __init__(self, key: str, name: str, run, deps: Tuple[str, ...] = (), cpu: int = 1, mem_mb: int = 200):
+        self.key = key
+        self.name = name
+        self.run = run
+        self.deps = deps
+        self.cpu = cpu  # 预计占用的 CPU 核数
+        self.mem_mb = mem_mb  # 预计内存峰值 (MB)
+        self.status = "pending"  # pending / running / True / False / None / cancelled / skipped
+        self.elapsed = 0.0
+
+
+class StageScheduler:
+    """按依赖关系调度阶段: 依赖全部通过的阶段在预算允许时立即启动 (超出预算的阶段在空闲时单独运行)。
+    任一阶段失败即取消所有在途阶段 (终止其子进程)，未启动的阶段标记为 skipped。"""
+
+    def __init__(self, stages: List[Stage], cpu_budget: int, mem_budget_mb: int):
+        self.stages = stages
+        self.cpu_budget = cpu_budget
+        self.mem_budget_mb = mem_budget_mb
+        self._done = threading.Condition()
+        self._output = StageOutput(sys.stdout)
+
+    def _fits(self, stage: Stage, running: List[Stage]) -> bool:
+        if not running:
+            return True
+        return (sum(s.cpu for s in running) + stage.cpu <= self.cpu_budget
+                and sum(s.mem_mb for s in running) + stage.mem_mb <= self.mem_budget_mb)
+
+    def _worker(self, stage: Stage, step: int, total: int, buffered: bool):
+        if buffered:
+            self._output.local.buffer = []
+        start_time = time.time()
+        try:
+            status = stage.run(step, total)
+        except Exception as e:
+            print_error(f"{stage.name} 执行异常: {e}")
+            status = False
+        stage.elapsed = time.time() - start_time
+        buffer = getattr(self._output.local, "buffer", None)
+        self._output.local.buffer = None
+        with self._done:
+            if status is False and CANCEL.is_set():
+                stage.status = "cancelled"  # 被其他阶段的失败终止
+            else:
+                stage.status = status
+                if status is False:
+                    cancel_processes()
+            if buffer and stage.status != "cancelled":
+                self._output.stream.write("".join(buffer))
+                self._output.stream.flush()
+            self._done.notify_all()
+
+    def run(self) -> float:
+        """执行全部阶段，返回墙钟耗时"""
+        steps = {stage.key: i for i, stage in enumerate(self.stages, 1)}
+        by_key = {stage.key: stage for stage in self.stages}
+        start_time = time.time()
+        sys.stdout = self._output
+        try:
+            with self._done:
+                while True:
+                    running = [s for s in self.stages if s.status == "running"]
+                    for stage in self.stages:
+                        if stage.status != "pending":
+                            continue
+                        deps = [by_key[d] for d in stage.deps if d in by_key]
+                        if CANCEL.is_set() or any(d.status in (False, "cancelled", "skipped") for d in deps):
+                            stage.status = "skipped"
+                        elif all(d.status in (True, None) for d in deps) and self._fits(stage, running):
+                            # 已有其他阶段在跑时缓冲输出
+                            buffered = bool(running) or any(
+                                s is not stage and s.status == "pending" and all(by_key[d].status in (True, None)
+                                                                                 for d in s.deps if d in by_key)
+                                for s in self.stages)
+                            stage.status = "running"
+                            running.append(stage)
+                            threading.Thread(target=self._worker, args=(stage, steps[stage.key], len(self.stages), buffered),
+                                             daemon=True).start()
+                    if not running:
+                        break
+                    self._done.wait(timeout=0.2)
+        except KeyboardInterrupt:
+            cancel_processes()
+            sys.stdout = self._output.stream
+            print_error("\n用户取消。")
+            sys.exit(1)
+        finally:
+            sys.stdout = self._output.stream
+        return time.time() - start_time
+
+
+def build_stages(args, root_dir: str, cache: StageCache) -> List[Stage]:
+    """按命令行参数组装架构、flake8 与测试阶段"""
+    stages = []
+    # 1. Architecture 与 2. Flake8 互不依赖，可并发执行
+    if not args.skip_arch:
+        arch_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arch_guard.py")
+        arch_fingerprint = cache.fingerprint("arch", [file_digest(arch_script)], scope="python")
+        stages.append(Stage("arch", "架构检查", lambda step, total: run_stage(
+            cache, "arch", arch_fingerprint, "架构守卫 (分层与依赖)",
+            lambda: check_architecture(root_dir, step, total), step, total), cpu=1, mem_mb=150))
+            
+    if not args.skip_flake:
+        flake_fingerprint = cache.fingerprint("flake8", [flake8_config_key(root_dir)], scope="lint")
+        # flake8 在本进程内单线程检查 (--jobs=1)，只占一个核
+        stages.append(Stage("flake8", "代码质量", lambda step, total: run_stage(
+            cache, "flake8", flake_fingerprint, "代码质量 (GitHub Flake8 Mode)",
+            lambda: check_flake8(root_dir, step, total), step, total), cpu=1, mem_mb=400))
+            
+    # 3. Tests: 静态检查全部通过后才运行
+    if not args.skip_test:
+        def run_test_stage(step: int, total: int) -> Optional[bool]:
+            misses = cache.misses
+            test_paths = None
+            if args.changed and not args.test:
+                test_paths = select_impacted_tests(root_dir, args.base)
+                if test_paths == []:
+                    print_success("没有受影响的测试")
+                    return True
+            if not run_tests(root_dir, args.test, step, total, args, cache, test_paths):
+                return False
+            # 所有批次都命中缓存时整步报告为 cached
+            return True if cache.misses > misses else None
+
+        stages.append(Stage("test", "测试", run_test_stage, deps=("arch", "flake8"),
+                            cpu=args.concurrency + 1, mem_mb=int(worker_memory_estimate(root_dir) * args.concurrency)))
+    return stages
+
+
+def print_summary(stages: List[Stage], total_elapsed: float):
+    """打印各阶段状态、累计耗时与墙钟耗时"""
+    results = [(stage.name, stage.status, stage.elapsed) for stage in stages if stage.status != "skipped"]
+    summed = sum(stage.elapsed for stage in stages)
+
+    # 打印执行摘要
+    print("\n" + "="*60)
+    print("📊 执行摘要")
+    print("="*60)
+    print(f"{'步骤':<15} {'状态':<10} {'耗时':<10}")
+    print("-"*60)
+    for name, success, elapsed in results:
+        if success == "cancelled":
+            status = "⏹ 已取消"
+        else:
+            status = "⚡ cached (pass)" if success is None else "✅ 通过" if success else "❌ 失败"
+        print(f"{name:<15} {status:<10} {elapsed:>6.2f}s")
+    print("-"*60)
+    print(f"{'阶段累计':<15} {'':<10} {summed:>6.2f}s")
+    print(f"{'总计 (墙钟)':<15} {'':<10} {total_elapsed:>6.2f}s")
+    if summed > total_elapsed + 0.01:
+        print(f"⚡ 并发执行节省 {summed - total_elapsed:.2f}s ({summed / total_elapsed:.1f}x)")
+    print("="*60)
+
 
 def main():
     parser = argparse.ArgumentParser(description="TG ONE 本地 CI 运行器")
@@ -487,6 +1798,13 @@ def main():
     parser.add_argument("--skip-flake", action="store_true", help="跳过 flake8 检查")
     parser.add_argument("--skip-test", action="store_true", help="跳过测试")
     parser.add_argument("--concurrency", "-n", type=int, default=2, help="测试并发数 (默认: 2)")
+    parser.add_argument("--changed", action="store_true",
+                        help="只运行受变更影响的测试 (git diff + 反向 import 图)。配置文件、conftest.py 与 tests/ 下的"
+                             "非 .py 文件变更时全量运行；tests/ 之外的非 .py 文件 (如代码读取的数据文件) 不参与影响分析")
+    parser.add_argument("--base", default="HEAD", help="--changed 的比较基准 (默认: HEAD，即未提交的改动)")
+    parser.add_argument("--no-cache", action="store_true", help="忽略增量缓存，强制重跑所有阶段 (通过的结果仍会写入缓存)")
+    parser.add_argument("--cpu-budget", type=int, default=os.cpu_count() or 2, help="并发阶段可占用的 CPU 核数 (默认: CPU 数)")
+    parser.add_argument("--mem-budget", type=int, default=2048, help="并发阶段的内存预算 MB (默认: 2048)")
     
     args = parser.parse_args()
     root_dir = os.getcwd()
@@ -507,55 +1825,13 @@ def main():
     print(f"📁 工作目录: {root_dir}")
     print("="*60)
     
-    passes = True
-    current_step = 0
-    start_time = time.time()
-    results = []
-    
-    # 1. Architecture
-    if not args.skip_arch:
-        current_step += 1
-        step_start = time.time()
-        if not check_architecture(root_dir, current_step, total_steps):
-            passes = False
-            results.append(("架构检查", False, time.time() - step_start))
-        else:
-            results.append(("架构检查", True, time.time() - step_start))
-            
-    # 2. Flake8
-    if passes and not args.skip_flake:
-        current_step += 1
-        step_start = time.time()
-        if not check_flake8(root_dir, current_step, total_steps):
-            passes = False
-            results.append(("代码质量", False, time.time() - step_start))
-        else:
-            results.append(("代码质量", True, time.time() - step_start))
-            
-    # 3. Tests
-    if passes and not args.skip_test:
-        current_step += 1
-        step_start = time.time()
-        if not run_tests(root_dir, args.test, current_step, total_steps, args):
-            passes = False
-            results.append(("测试", False, time.time() - step_start))
-        else:
-            results.append(("测试", True, time.time() - step_start))
+    cache = StageCache(root_dir, enabled=not args.no_cache)
+    stages = build_stages(args, root_dir, cache)
 
-    total_elapsed = time.time() - start_time
-    
-    # 打印执行摘要
-    print("\n" + "="*60)
-    print("📊 执行摘要")
-    print("="*60)
-    print(f"{'步骤':<15} {'状态':<10} {'耗时':<10}")
-    print("-"*60)
-    for name, success, elapsed in results:
-        status = "✅ 通过" if success else "❌ 失败"
-        print(f"{name:<15} {status:<10} {elapsed:>6.2f}s")
-    print("-"*60)
-    print(f"{'总计':<15} {'':<10} {total_elapsed:>6.2f}s")
-    print("="*60)
+    total_elapsed = StageScheduler(stages, args.cpu_budget, args.mem_budget).run()
+    cache.save()
+    passes = all(stage.status in (True, None) for stage in stages)
+    print_summary(stages, total_elapsed)
 
     if passes:
         print("\n✨✨ 本地 CI 通过 - 准备发布 ✨✨")
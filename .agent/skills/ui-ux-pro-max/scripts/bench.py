@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI/UX Pro Max Bench - latency, memory and relevance benchmark for the search engine
+Usage: python bench.py [--sizes 100,10000,100000,1000000] [--schema stack:react] [--backend python|numpy]
+                       [--output report.json] [--baseline baseline.json] [--tolerance 0.25]
+       python bench.py --check   (update() vs fresh fit() and NumPy vs pure-Python rankings; exit 1 on mismatch)
+
+Synthetic corpora are generated from a shipped CSV's schema (column word pools
+and per-column lengths), each size is indexed in a fresh subprocess so peak
+RSS is isolated, and a fixed relevance judgment set on the shipped data checks
+that latency work does not change ranking quality. With NumPy installed the
+semantic and hybrid modes are scored and timed next to BM25, and synthetic
+corpora up to LATENT_MAX_ROWS also get a latent index (build time, query
+latency, IVF recall against exact search).
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from math import log2
+from pathlib import Path
+
+import core
+
+SIZES = (100, 10_000, 100_000, 1_000_000)
+DEFAULT_SCHEMA = "stack:react"
+QUERY_COUNT = 200
+SEED = 1337
+TOP_K = core.MAX_RESULTS
+LATENT_MAX_ROWS = 100_000
+ANN_K = 10
+NOISE_FLOOR = 0.05  # absolute ms / s / MB differences below this are never regressions
+
+# (query, domain or "stack:<name>", relevant key-column values)
+JUDGMENTS = [
+    ("glassmorphism frosted glass", "style", ["Glassmorphism"]),
+    ("dark mode oled", "style", ["Dark Mode (OLED)"]),
+    ("brutalism raw", "style", ["Brutalism", "Neubrutalism"]),
+    ("fintech crypto", "color", ["Fintech/Crypto"]),
+    ("healthcare app", "color", ["Healthcare App"]),
+    ("luxury serif elegant", "typography", ["Luxury Serif", "Classic Elegant"]),
+    ("developer code mono", "typography", ["Developer Mono"]),
+    ("trend over time", "chart", ["Trend Over Time"]),
+    ("funnel conversion flow", "chart", ["Funnel/Flow"]),
+    ("pricing page", "landing", ["Pricing Page + CTA", "Pricing-Focused Landing"]),
+    ("waitlist coming soon", "landing", ["Waitlist/Coming Soon"]),
+    ("touch target size", "ux", ["Touch Target Size"]),
+    ("reduced motion", "ux", ["Reduced Motion"]),
+    ("z-index stacking", "ux", ["Z-Index Management", "Stacking Context"]),
+    ("autocomplete attribute", "web", ["Autocomplete Attribute"]),
+    ("virtualize long lists", "web", ["Virtualize Lists"]),
+    ("barrel imports", "react", ["Barrel Imports"]),
+    ("suspense boundaries streaming", "react", ["Suspense Boundaries"]),
+    ("listview builder long list", "stack:flutter", ["Use ListView.builder"]),
+    ("flatlist long lists", "stack:react-native", ["Use FlatList for long lists"]),
+    ("usestate local state", "stack:react", ["Use useState for local state"]),
+    ("next/image optimization", "stack:nextjs", ["Use next/image for optimization"]),
+    ("pinia global state", "stack:vue", ["Use Pinia for global state"]),
+    ("dialog modal", "stack:shadcn", ["Use Dialog for modal content"]),
+    ("glassmorph", "style", ["Glassmorphism"]),
+    ("acessibility color contrast", "ux", ["Color Contrast"]),
+]
+
+
+def _target_config(target):
+    """(file, search_cols, output_cols, key column) for a domain or "stack:<name>" target"""
+    if target.startswith("stack:"):
+        file = core.STACK_CONFIG[target.split(":", 1)[1]]["file"]
+        return file, core._STACK_COLS["search_cols"], core._STACK_COLS["output_cols"], "Guideline"
+    config = core.CSV_CONFIG[target]
+    key = {"ux": "Issue", "react": "Issue", "web": "Issue", "icons": "Icon Name"}.get(target, config["output_cols"][0])
+    return config["file"], config["search_cols"], config["output_cols"], key
+
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 4)
+
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "mean": round(sum(ordered) / len(ordered), 4)}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+# ============ SYNTHETIC CORPORA ============
+def generate_corpus(schema, rows, path, seed=SEED):
+    """Write a synthetic CSV with the schema's header, sampling each column's words and lengths"""
+    file, _, _, _ = _target_config(schema)
+    with open(core.DATA_DIR / file, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames
+        source = list(reader)
+
+    pools = {col: [w for row in source for w in str(row.get(col, "")).split()] or [""] for col in header}
+    lengths = {col: [len(str(row.get(col, "")).split()) for row in source] for col in header}
+    rnd = random.Random(seed)
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i in range(rows):
+            writer.writerow([str(i + 1) if col == "No" else
+                             " ".join(rnd.choices(pools[col], k=rnd.choice(lengths[col]))) for col in header])
+    return header
+
+
+def _queries(bm25, count=QUERY_COUNT, seed=SEED):
+    """Deterministic mix of 1-3 term queries drawn from the corpus vocabulary (plus one typo each 10)"""
+    rnd = random.Random(seed)
+    vocab = sorted(bm25.postings)
+    queries = []
+    for i in range(count):
+        terms = rnd.sample(vocab, min(len(vocab), rnd.randint(1, 3)))
+        if i % 10 == 9 and len(terms[0]) > 4:
+            terms[0] = terms[0][:-1]
+        queries.append(" ".join(terms))
+    return queries
+
+
+def _digest(rankings):
+    """Stable hash of every query's ranked (doc, score) list, scores rounded to 9 places"""
+    canonical = [[(idx, round(score, 9)) for idx, score in ranked] for ranked in rankings]
+    return hashlib.sha256(json.dumps(canonical).encode("utf-8")).hexdigest()[:16]
+
+
+def _time_queries(index, csv_path, search_cols, output_cols, queries):
+    """Per-query _rank_csv latency (ms) with index serving the CSV, and index's own rankings"""
+    core._INDEX_CACHE[(str(csv_path), tuple(search_cols))] = index
+    samples, rankings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        core._rank_csv(csv_path, search_cols, output_cols, query, TOP_K)
+        samples.append((time.perf_counter() - start) * 1000)
+        rankings.append(index.bm25.score(query, top_k=TOP_K))
+    return samples, rankings
+
+
+def run_size(schema, rows, workdir):
+    """Build and query one synthetic corpus in this process; returns a report entry"""
+    csv_path = Path(workdir) / f"synthetic-{rows}.csv"
+    generate_corpus(schema, rows, csv_path)
+    _, search_cols, output_cols, _ = _target_config(schema)
+    core.INDEX_DIR = Path(workdir) / "index"
+
+    start = time.perf_counter()
+    index = core.get_index(csv_path, search_cols, rebuild=True)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    core._INDEX_CACHE.clear()
+    mapped = core.get_index(csv_path, search_cols)
+    load_s = time.perf_counter() - start
+
+    # get_index now returns the memory-mapped index; time the built backend and the mapped one separately
+    queries = _queries(index.bm25)
+    samples, rankings = _time_queries(index, csv_path, search_cols, output_cols, queries)
+    repeat = [index.bm25.score(query, top_k=TOP_K) for query in queries]
+
+    entry = {
+        "rows": rows,
+        "backend": type(index.bm25).__name__,
+        "csv_mb": round(csv_path.stat().st_size / (1024 * 1024), 2),
+        "build_s": round(build_s, 4),
+        "load_s": round(load_s, 4),
+        "latency_ms": _percentiles(samples),
+        "peak_rss_mb": _peak_rss_mb(),
+        "stable": repeat == rankings,
+        "digest": _digest(rankings),
+    }
+    if mapped is not index:
+        mapped_samples, mapped_rankings = _time_queries(mapped, csv_path, search_cols, output_cols, queries)
+        entry["mapped"] = {
+            "backend": type(mapped.bm25).__name__,
+            "latency_ms": _percentiles(mapped_samples),
+            "matches": mapped_rankings == rankings,
+        }
+    if core.np is not None and rows <= LATENT_MAX_ROWS:
+        entry["semantic"] = _run_latent(index.rows.documents(search_cols), queries)
+    return entry
+
+
+def _run_latent(documents, queries):
+    """Latent index build time, corpus-wide query latency and ANN recall@ANN_K vs exact search"""
+    start = time.perf_counter()
+    latent = core.LatentIndex()
+    latent.fit(documents)
+    build_s = time.perf_counter() - start
+
+    samples, recall, scored = [], 0.0, 0
+    for query in queries:
+        start = time.perf_counter()
+        hits = latent.search(query, ANN_K)
+        samples.append((time.perf_counter() - start) * 1000)
+        exact = {doc for doc, _ in latent.search(query, ANN_K, exact=True)}
+        if exact:
+            recall += len(exact & {doc for doc, _ in hits}) / len(exact)
+            scored += 1
+    return {
+        "build_s": round(build_s, 4),
+        "ivf": latent.centroids is not None,
+        "latency_ms": _percentiles(samples),
+        f"ann_recall@{ANN_K}": round(recall / scored, 4) if scored else None,
+    }
+
+
+def _run_size_isolated(schema, rows, backend):
+    """Run one size in a child interpreter so peak RSS is measured per size"""
+    with tempfile.TemporaryDirectory(prefix="uipro-bench-") as workdir:
+        env = dict(os.environ, UIPRO_BM25_BACKEND=backend, UIPRO_RESULT_CACHE="0")
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--schema", schema,
+               "--sizes", str(rows), "--workdir", workdir]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    if proc.returncode != 0:
+        return {"rows": rows, "error": (proc.stderr.strip().splitlines() or [f"exit {proc.returncode}"])[-1]}
+    return json.loads(proc.stdout)
+
+
+# ============ RELEVANCE ============
+def evaluate_relevance(mode="bm25", k=TOP_K):
+    """MRR, recall@k and nDCG@k of a search mode over JUDGMENTS on the shipped data"""
+    mrr = recall = ndcg = 0.0
+    for query, target, relevant in JUDGMENTS:
+        ranked = _rank_keys(query, target, k, mode)
+        hits = [i for i, key in enumerate(ranked[:k]) if key in relevant]
+        mrr += 1 / (hits[0] + 1) if hits else 0.0
+        recall += len(hits) / len(relevant)
+        dcg = sum(1 / log2(i + 2) for i in hits)
+        ideal = sum(1 / log2(i + 2) for i in range(min(k, len(relevant))))
+        ndcg += dcg / ideal
+    n = len(JUDGMENTS)
+    return {"mrr": round(mrr / n, 4), f"recall@{k}": round(recall / n, 4), f"ndcg@{k}": round(ndcg / n, 4)}
+
+
+def measure_mode(mode, repeat=5):
+    """Warm per-query latency (ms) of a search mode over the JUDGMENTS queries"""
+    for query, target, _ in JUDGMENTS:
+        _rank_keys(query, target, TOP_K, mode)
+    samples = []
+    for _ in range(repeat):
+        for query, target, _ in JUDGMENTS:
+            start = time.perf_counter()
+            _rank_keys(query, target, TOP_K, mode)
+            samples.append((time.perf_counter() - start) * 1000)
+    return _percentiles(samples)
+
+
+def _rank_keys(query, target, k, mode):
+    """Key-column values of a target's results, best first"""
+    _, _, _, key = _target_config(target)
+    if target.startswith("stack:"):
+        result = core.search_stack(query, target.split(":", 1)[1], k, mode)
+    else:
+        result = core.search(query, target, k, mode)
+    return [row.get(key) for row in result.get("results", [])]
+
+
+# ============ BACKEND EQUIVALENCE ============
+EDITS = {
+    "add": lambda docs: docs[:5] + ["glassmorphism neon frosted panel"] + docs[5:],
+    "remove": lambda docs: docs[:3] + docs[4:],
+    "modify": lambda docs: docs[:2] + [docs[2] + " neon glow"] + docs[3:],
+    "reorder": lambda docs: docs[::-1],
+    "swap": lambda docs: [docs[1], docs[0]] + docs[2:],
+}
+
+
+def check_backends(schema=DEFAULT_SCHEMA):
+    """Rankings after update() vs a fresh fit(), per backend and edit, and NumPy vs pure-Python on the result"""
+    file, search_cols, _, _ = _target_config(schema)
+    documents = core.RowStore.from_csv(core.DATA_DIR / file).documents(search_cols)
+    classes = [core.BM25] + ([core.NumpyBM25] if core.np is not None else [])
+    results = {}
+    for edit, apply in EDITS.items():
+        edited = apply(documents)
+        reference = core.BM25()
+        reference.fit(edited)
+        queries = _queries(reference, count=50)
+        expected = [reference.score(query, top_k=TOP_K) for query in queries]
+        for cls in classes:
+            bm25 = cls()
+            bm25.fit(documents)
+            bm25.update(edited)
+            results[f"{cls.__name__} {edit}"] = [bm25.score(query, top_k=TOP_K) for query in queries] == expected
+    return results
+
+
+# ============ REPORT ============
+def _slower(now, before, tolerance):
+    return now is not None and bool(before) and now > before * (1 + tolerance) and now - before > NOISE_FLOOR
+
+
+def _compare_synthetic(entries, baseline, tolerance):
+    base_sizes = {(e["backend"], e["rows"]): e for e in baseline.get("synthetic", []) if "error" not in e}
+    for entry in entries:
+        base = base_sizes.get((entry.get("backend"), entry["rows"]))
+        if base is None or "error" in entry:
+            continue
+        checks = [("build_s", entry["build_s"], base["build_s"]),
+                  ("latency p50", entry["latency_ms"]["p50"], base["latency_ms"]["p50"]),
+                  ("latency p95", entry["latency_ms"]["p95"], base["latency_ms"]["p95"]),
+                  ("peak_rss_mb", entry["peak_rss_mb"], base["peak_rss_mb"])]
+        for name, now, before in checks:
+            if _slower(now, before, tolerance):
+                yield f"{entry['backend']} {entry['rows']} rows: {name} {before} -> {now}"
+        if entry["digest"] != base["digest"]:
+            yield (f"{entry['backend']} {entry['rows']} rows: rankings changed "
+                   f"(digest {base['digest']} -> {entry['digest']})")
+
+
+def _compare_modes(report, baseline, tolerance):
+    for mode, metrics in report["relevance"].items():
+        for name, value in metrics.items():
+            before = baseline.get("relevance", {}).get(mode, {}).get(name)
+            if before is not None and value < before - 1e-4:
+                yield f"relevance {mode} {name}: {before} -> {value}"
+    for mode, latency in report.get("modes", {}).items():
+        before = baseline.get("modes", {}).get(mode, {}).get("p95")
+        if _slower(latency["p95"], before, tolerance):
+            yield f"{mode} mode latency p95 {before} -> {latency['p95']}"
+
+
+def compare(report, baseline, tolerance):
+    """List regressions of report vs baseline: slower/larger by > tolerance, worse relevance, changed rankings"""
+    return (list(_compare_synthetic(report["synthetic"], baseline, tolerance))
+            + list(_compare_modes(report, baseline, tolerance)))
+
+
+def print_summary(report):
+    print(f"{'backend':<10} {'rows':>9} {'csv MB':>8} {'build s':>9} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'RSS MB':>8} {'stable':>7}")
+    for e in report["synthetic"]:
+        if "error" in e:
+            print(f"{e.get('backend', '-'):<10} {e['rows']:>9} ERROR: {e['error']}")
+            continue
+        lat = e["latency_ms"]
+        print(f"{e['backend']:<10} {e['rows']:>9} {e['csv_mb']:>8} {e['build_s']:>9} {e['load_s']:>8} {lat['p50']:>8} "
+              f"{lat['p95']:>8} {lat['p99']:>8} {str(e['peak_rss_mb']):>8} {str(e['stable']):>7}")
+    for e in report["synthetic"]:
+        if "mapped" in e:
+            mapped = e["mapped"]
+            print(f"{mapped['backend']:<10} {e['rows']:>9} rows: p50 {mapped['latency_ms']['p50']}ms, "
+                  f"p95 {mapped['latency_ms']['p95']}ms, matches {e['backend']}: {mapped['matches']}")
+    for e in report["synthetic"]:
+        if "semantic" in e:
+            sem = e["semantic"]
+            print(f"semantic  {e['rows']:>9} rows: build {sem['build_s']}s, p50 {sem['latency_ms']['p50']}ms, "
+                  f"p95 {sem['latency_ms']['p95']}ms, ivf={sem['ivf']}, recall@{ANN_K} vs exact {sem[f'ann_recall@{ANN_K}']}")
+    for mode, metrics in report["relevance"].items():
+        latency = report.get("modes", {}).get(mode, {})
+        print(f"[{mode:<8}] " + ", ".join(f"{k}={v}" for k, v in metrics.items())
+              + (f" | p50 {latency['p50']}ms, p95 {latency['p95']}ms" if latency else ""))
+
+
+def _report_equivalence(results):
+    """Print equivalence mismatches; returns the exit status (1 when any check failed)"""
+    failed = [name for name, ok in results.items() if not ok]
+    for name in failed:
+        print(f"- {name}: update() rankings differ from a fresh BM25 fit()")
+    print(f"\nEquivalence: {len(results) - len(failed)}/{len(results)} checks passed.")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UI Pro Max search benchmark")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Comma-separated synthetic row counts")
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="Domain or stack:<name> whose CSV schema is synthesized")
+    parser.add_argument("--backend", action="append", choices=["python", "numpy"],
+                        help="BM25 backend(s) to benchmark (default: python, plus numpy when installed)")
+    parser.add_argument("--output", help="Report path (default: .index/bench/report-<timestamp>.json)")
+    parser.add_argument("--baseline", help="Compare against a stored report; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown/growth ratio (default: 0.25)")
+    parser.add_argument("--check", action="store_true", help="Only run the backend equivalence checks; exit 1 on mismatch")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if args.worker:
+        print(json.dumps(run_size(args.schema, sizes[0], args.workdir)))
+        return 0
+
+    if args.check:
+        return _report_equivalence(check_backends(args.schema))
+
+    backends = args.backend or (["python", "numpy"] if core.np is not None else ["python"])
+    modes = core.SEARCH_MODES if core.np is not None else ("bm25",)
+    core.RESULT_CACHE_ENABLED = False
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(core.np, "__version__", None),
+            "schema": args.schema,
+            "queries": QUERY_COUNT,
+            "top_k": TOP_K,
+        },
+        "synthetic": [],
+        "relevance": {mode: evaluate_relevance(mode) for mode in modes},
+        "modes": {mode: measure_mode(mode) for mode in modes},
+        "equivalence": check_backends(args.schema),
+    }
+    for backend in backends:
+        for rows in sizes:
+            print(f"... {backend}: {rows} rows", file=sys.stderr)
+            entry = _run_size_isolated(args.schema, rows, backend)
+            entry.setdefault("backend", {"python": "BM25", "numpy": "NumpyBM25"}[backend])
+            report["synthetic"].append(entry)
+
+    output = Path(args.output) if args.output else core.INDEX_DIR / "bench" / f"report-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print_summary(report)
+    print(f"\nReport: {output}")
+    if _report_equivalence(report["equivalence"]):
+        return 1
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        if problems:
+            print("\nRegressions vs baseline:")
+            for problem in problems:
+                print(f"- {problem}")
+            return 1
+        print("\nNo regressions vs baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
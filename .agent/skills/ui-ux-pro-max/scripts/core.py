@@ -4,16 +4,51 @@
 UI/UX Pro Max Core - BM25 search engine for UI/UX style guides
 """
 
+import bisect
 import csv
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import pickle
+import random
 import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from math import log
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import partial
+from itertools import islice, zip_longest
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python BM25 is the fallback
+    np = None
 
 # ============ CONFIGURATION ============
 DATA_DIR = Path(__file__).parent.parent / "data"
+INDEX_DIR = Path(__file__).parent.parent / ".index"
+INDEX_VERSION = 6
 MAX_RESULTS = 3
 
+# BM25 backend: "python", "numpy", or "auto" (numpy when installed and the corpus is large)
+BM25_BACKEND = os.environ.get("UIPRO_BM25_BACKEND", "auto")
+NUMPY_MIN_DOCS = 2000
+
+# Persistent query result cache (LRU by entry count and by JSON byte size)
+RESULT_CACHE_ENABLED = os.environ.get("UIPRO_RESULT_CACHE", "1") != "0"
+RESULT_CACHE_MAX_ENTRIES = 2000
+RESULT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
 CSV_CONFIG = {
     "style": {
         "file": "styles.csv",
@@ -95,99 +130,1772 @@ _STACK_COLS = {
 AVAILABLE_STACKS = list(STACK_CONFIG.keys())
 
 
+# Typo-tolerant expansion of query tokens missing from an index's vocabulary
+PREFIX_WEIGHT = 0.75
+FUZZY_WEIGHT = 0.6  # per edit
+MAX_EXPANSIONS = 5
+
+# Quoted phrase queries and proximity boosting over positional postings
+PROXIMITY_WINDOW = 3  # largest token distance between consecutive query tokens that earns a bonus
+PROXIMITY_WEIGHT = 0.5  # bonus for adjacent tokens, in units of the rarer token's idf
+
+# Latent semantic (LSI) retrieval and BM25 + LSI hybrid re-ranking (require NumPy)
+SEARCH_MODES = ("bm25", "semantic", "hybrid")
+LSI_DIMS = 100
+LSI_IVF_MIN_DOCS = 50000  # below this, nearest neighbours are scored exactly
+LSI_IVF_PROBES = 32
+
+# Near-duplicate rows across corpora (MinHash signatures + LSH banding)
+DUP_THRESHOLD = 0.7  # Jaccard similarity of two rows' shingle sets
+DUP_SHINGLE_SIZE = 1  # rows are short: single tokens separate paraphrases from distinct rules best
+MINHASH_PERMUTATIONS = 192
+LSH_BANDS = 32  # 6 rows per band: a pair at the threshold becomes a candidate with p > 0.98, at Jaccard 0.3 with p < 0.03
+DUP_SEED = 17
+HYBRID_CANDIDATES = 50
+HYBRID_ALPHA = 0.5  # weight of bound-normalized BM25 against cosine similarity
+
+# Token-budgeted rendering (search.py --budget): columns dropped first, in this order, when a result exceeds its share
+LOW_VALUE_COLS = ["Docs URL", "Code Example Bad", "Code Bad", "Code Example Good", "Code Good", "CSS Import",
+                  "Tailwind Config", "Google Fonts URL", "Import Code", "Framework Compatibility", "Secondary Options",
+                  "Secondary Styles", "Interactive Level", "Complexity", "Performance", "Platform"]
+CHARS_PER_TOKEN = 4  # token estimate for budgets given in tokens
+MIN_FIELD_CHARS = 60  # values are not trimmed below this before whole fields are dropped
+
+
+# ============ PROFILING ============
+class Profiler:
+    """Per-stage self times (and optional Chrome trace events) of search work, active while installed as core.PROFILER"""
+
+    def __init__(self, trace=False):
+        self.origin = time.perf_counter()
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.events = [] if trace else None
+        self._open = threading.local()
+        self._lock = threading.Lock()  # federated search records from pool threads
+
+    @contextmanager
+    def stage(self, name, **args):
+        stack = self._open.__dict__.setdefault("stack", [])
+        frame = [0.0]  # time spent in nested stages
+        self.totals.setdefault(name, 0.0)  # report stages in the order they start
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            self.record(name, elapsed - frame[0], start, elapsed, args)
+
+    def record(self, name, self_seconds, start=None, elapsed=None, args=None):
+        """Add a measured stage (start/elapsed in perf_counter seconds place it on the trace)"""
+        with self._lock:
+            self.totals[name] += self_seconds
+            self.calls[name] += 1
+            if self.events is not None and start is not None:
+                event = {"name": name, "ph": "X", "ts": round((start - self.origin) * 1e6, 3),
+                         "dur": round((elapsed if elapsed is not None else self_seconds) * 1e6, 3),
+                         "pid": os.getpid(), "tid": threading.get_ident()}
+                if args:
+                    event["args"] = args
+                self.events.append(event)
+
+    def report(self):
+        """{stage: {"ms", "calls"}} in the order stages first started"""
+        return {name: {"ms": round(seconds * 1000, 3), "calls": self.calls[name]}
+                for name, seconds in self.totals.items()}
+
+    def chrome_trace(self):
+        return {"traceEvents": self.events or [], "displayTimeUnit": "ms"}
+
+
+PROFILER = None
+_NO_STAGE = nullcontext()
+
+
+def install_profiler(profiler):
+    """Start collecting stage timings into profiler (None stops)"""
+    global PROFILER
+    PROFILER = profiler
+
+
+def profile_stage(name, **args):
+    """Time a block as a stage of the installed profiler (a shared no-op context without one)"""
+    return _NO_STAGE if PROFILER is None else PROFILER.stage(name, **args)
+
+
+# ============ VOCABULARY TRIE ============
+class VocabTrie:
+    """Character trie over an index vocabulary for prefix and edit-distance lookup"""
+
+    END = ""  # child key marking a complete term (real keys are single characters)
+
+    def __init__(self, terms=()):
+        self.root = {}
+        for term in terms:
+            self.insert(term)
+
+    def insert(self, term):
+        node = self.root
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[self.END] = term
+
+    def remove(self, term):
+        """Drop a term, pruning branches left without any term"""
+        path, node = [], self.root
+        for ch in term:
+            path.append((node, ch))
+            node = node.get(ch)
+            if node is None:
+                return
+        node.pop(self.END, None)
+        for parent, ch in reversed(path):
+            if parent[ch]:
+                break
+            del parent[ch]
+
+    def with_prefix(self, prefix):
+        """All terms starting with prefix (excluding prefix itself)"""
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        terms, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            for ch, child in node.items():
+                if ch == self.END:
+                    if child != prefix:
+                        terms.append(child)
+                else:
+                    stack.append(child)
+        return terms
+
+    def within_distance(self, word, max_dist):
+        """(term, distance) for terms within max_dist Levenshtein edits of word, sharing its first character"""
+        matches = []
+        first = self.root.get(word[:1])
+        if first is None:
+            return matches
+        n, limit = len(word), max_dist + 1
+        stack = [(first, word[0], 1, [min(i, limit) for i in range(n + 1)])]
+        while stack:
+            node, ch, depth, prev = stack.pop()
+            row = [limit] * (n + 1)
+            row[0] = min(depth, limit)
+            for i in range(max(1, depth - max_dist), min(n, depth + max_dist) + 1):
+                row[i] = min(row[i - 1] + 1, prev[i] + 1, prev[i - 1] + (word[i - 1] != ch), limit)
+            if row[n] <= max_dist and self.END in node:
+                matches.append((node[self.END], row[n]))
+            if min(row) <= max_dist:
+                stack.extend((child, c, depth + 1, row) for c, child in node.items() if c != self.END)
+        return matches
+
+
 # ============ BM25 IMPLEMENTATION ============
+class _IdfTable(dict):
+    """term -> BM25 idf, filled on first lookup from the live document frequencies"""
+
+    def __init__(self, n_docs, doc_freqs):
+        super().__init__()
+        self.n_docs = n_docs
+        self.doc_freqs = doc_freqs
+
+    def __missing__(self, term):
+        df = self.doc_freqs.get(term)
+        if not df:
+            raise KeyError(term)
+        value = self[term] = log((self.n_docs - df + 0.5) / (df + 0.5) + 1)
+        return value
+
+
+class _NormTable(dict):
+    """document length -> BM25 length normalization k1 * (1 - b + b * dl / avgdl)"""
+
+    def __init__(self, k1, b, avgdl):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+        self.avgdl = avgdl
+
+    def __missing__(self, doc_len):
+        value = self[doc_len] = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
+        return value
+
+
+def _doc_hash(document):
+    """Stable 8-byte content hash of one indexed document"""
+    return hashlib.blake2b(document.encode("utf-8"), digest_size=8).digest()
+
+
+def _common_prefix(a, b):
+    """Length of the longest common prefix of two iterables"""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
 class BM25:
-    """BM25 ranking algorithm for text search"""
+    """BM25 ranking algorithm for text search (slot-based inverted index, heap-based top-k)"""
 
     def __init__(self, k1=1.5, b=0.75):
         self.k1 = k1
         self.b = b
-        self.corpus = []
+        self.term_freqs = []
+        self.positions = []
+        self.postings = {}
         self.doc_lengths = []
+        self.doc_hashes = []
+        self.order = []
+        self.position = []
+        self.free = []
+        self.total_length = 0
         self.avgdl = 0
-        self.idf = {}
+        self.norms = _NormTable(k1, b, 0)
         self.doc_freqs = defaultdict(int)
+        self.idf = _IdfTable(0, self.doc_freqs)
+        self.trie = VocabTrie()
+        self._expansions = {}
         self.N = 0
 
-    def tokenize(self, text):
+    @staticmethod
+    def tokenize(text):
         """Lowercase, split, remove punctuation, filter short words"""
         text = re.sub(r'[^\w\s]', ' ', str(text).lower())
         return [w for w in text.split() if len(w) > 2]
 
+    @staticmethod
+    def phrases(query):
+        """Token tuples of the quoted phrases in a query ('"dark mode" toggle' -> [("dark", "mode")])"""
+        return [phrase for phrase in (tuple(BM25.tokenize(text)) for text in re.findall(r'"([^"]+)"', str(query)))
+                if phrase]
+
+    @staticmethod
+    def _term_positions(tokens):
+        """term -> ascending token offsets, in first-occurrence order"""
+        positions = defaultdict(list)
+        for offset, token in enumerate(tokens):
+            positions[token].append(offset)
+        return {term: tuple(offsets) for term, offsets in positions.items()}
+
     def fit(self, documents):
-        """Build BM25 index from documents"""
-        self.corpus = [self.tokenize(doc) for doc in documents]
-        self.N = len(self.corpus)
+        """Build BM25 index: per-document term frequencies and term -> doc posting lists"""
+        with profile_stage("tokenize"):
+            corpus = [self.tokenize(doc) for doc in documents]
+        self.N = len(corpus)
         if self.N == 0:
             return
-        self.doc_lengths = [len(doc) for doc in self.corpus]
-        self.avgdl = sum(self.doc_lengths) / self.N
+        self.doc_lengths = [len(doc) for doc in corpus]
+        self.doc_hashes = list(map(_doc_hash, documents))
+        self.order = list(range(self.N))
+        self.position = list(range(self.N))
+        self.total_length = sum(self.doc_lengths)
+
+        postings = defaultdict(list)
+        for idx, doc in enumerate(corpus):
+            positions = self._term_positions(doc)
+            self.positions.append(positions)
+            self.term_freqs.append({word: len(offsets) for word, offsets in positions.items()})
+            for word in positions:
+                postings[word].append(idx)
+        self.postings = dict(postings)
+
+        for word, docs in self.postings.items():
+            self.doc_freqs[word] = len(docs)
+        self._refresh_stats()
+        self.trie = VocabTrie(self.postings)
+
+    def _refresh_stats(self, touched=None):
+        """Reset avgdl-dependent norms and the idf of touched terms (of all terms when N changed)"""
+        self.avgdl = self.total_length / self.N if self.N else 0
+        self.norms = _NormTable(self.k1, self.b, self.avgdl)
+        if touched is None or self.N != self.idf.n_docs:
+            self.idf = _IdfTable(self.N, self.doc_freqs)
+        else:
+            for term in touched:
+                self.idf.pop(term, None)
+        self._expansions = {}
+
+    def update(self, documents):
+        """Re-index against a new document list, touching only changed documents; returns (added, removed)"""
+        hashes = list(map(_doc_hash, documents))
+        n_old, n_new = len(self.order), len(hashes)
+        head = _common_prefix(self.doc_hashes, hashes)
+        tail = _common_prefix(reversed(self.doc_hashes[head:]), reversed(hashes[head:]))
+        old_end, new_end = n_old - tail, n_new - tail
+
+        by_hash = defaultdict(list)
+        for pos in range(old_end - 1, head - 1, -1):
+            by_hash[self.doc_hashes[pos]].append(self.order[pos])
+        window, added = [], []
+        for pos in range(head, new_end):
+            slots = by_hash.get(hashes[pos])
+            window.append(slots.pop() if slots else None)
+            if window[-1] is None:
+                added.append(pos)
+        removed = [slot for slots in by_hash.values() for slot in slots]
+
+        if len(added) + len(removed) > max(n_old, n_new) // 2:
+            self.__init__(self.k1, self.b)
+            self.fit(documents)
+            return len(added), len(removed)
+
+        touched = set()
+        for slot in removed:
+            self._remove_doc(slot, touched)
+        for pos in added:
+            window[pos - head] = self._add_doc(documents[pos], touched)
+        self.order[head:old_end] = window
+        for pos in range(head, new_end if n_new == n_old else n_new):
+            self.position[self.order[pos]] = pos
+        self.doc_hashes = hashes
+        self.N = n_new
+        self._refresh_stats(touched)
+        return len(added), len(removed)
+
+    def _add_doc(self, document, touched):
+        tokens = self.tokenize(document)
+        positions = self._term_positions(tokens)
+        freqs = {word: len(offsets) for word, offsets in positions.items()}
+        if self.free:
+            slot = self.free.pop()
+            self.term_freqs[slot] = freqs
+            self.positions[slot] = positions
+            self.doc_lengths[slot] = len(tokens)
+        else:
+            slot = len(self.term_freqs)
+            self.term_freqs.append(freqs)
+            self.positions.append(positions)
+            self.doc_lengths.append(len(tokens))
+            self.position.append(None)
+        for word in freqs:
+            if word not in self.postings:
+                self.postings[word] = []
+                self.trie.insert(word)
+            self.postings[word].append(slot)
+            self.doc_freqs[word] += 1
+            touched.add(word)
+        self.total_length += len(tokens)
+        return slot
+
+    def _remove_doc(self, slot, touched):
+        for word in self.term_freqs[slot]:
+            self.postings[word].remove(slot)
+            self.doc_freqs[word] -= 1
+            if not self.postings[word]:
+                del self.postings[word]
+                del self.doc_freqs[word]
+                self.trie.remove(word)
+            touched.add(word)
+        self.total_length -= self.doc_lengths[slot]
+        self.term_freqs[slot] = {}
+        self.positions[slot] = {}
+        self.doc_lengths[slot] = 0
+        self.position[slot] = None
+        self.free.append(slot)
+
+    def expand(self, token):
+        """Weighted vocabulary terms standing in for a query token (itself, prefix completions or near typos)"""
+        if token in self.postings:
+            return [(token, 1.0)]
+        cache = self._expansions
+        if token in cache:
+            return cache[token]
+
+        weights = dict.fromkeys(self.trie.with_prefix(token), PREFIX_WEIGHT)
+        if not weights:
+            for term, dist in self.trie.within_distance(token, 2 if len(token) >= 8 else 1):
+                weights[term] = FUZZY_WEIGHT ** dist
+        best = sorted(weights.items(), key=lambda tw: (-tw[1], -self.doc_freqs[tw[0]], tw[0]))[:MAX_EXPANSIONS]
+        if len(cache) < 4096:
+            cache[token] = best
+        return best
+
+    def query_terms(self, query):
+        """Tokenize a query into (vocabulary term, weight) pairs, expanding unknown tokens"""
+        return [pair for token in self.tokenize(query) for pair in self.expand(token)]
+
+    def score(self, query, top_k=None):
+        """Best-first (idx, score) pairs of documents containing a query token or one of its expansions"""
+        scores = defaultdict(float)
+        k1_plus_1 = self.k1 + 1
+        term_freqs, lengths, norms, position = self.term_freqs, self.doc_lengths, self.norms, self.position
+
+        for token, weight in self.query_terms(query):
+            idf = self.idf[token]
+            for idx in self.postings[token]:
+                tf = term_freqs[idx][token]
+                scores[position[idx]] += weight * (idf * (tf * k1_plus_1) / (tf + norms[lengths[idx]]))
+        with profile_stage("top_k"):
+            return self._rank(scores, query, top_k)
+
+    def score_bound(self, query):
+        """Best score any document could reach (every token present, tf -> infinity), to map scores to [0, 1]"""
+        unseen_idf = log((self.N + 0.5) / 0.5 + 1)
+        bound = 0.0
+        tokens = self.tokenize(query)
+        for token in tokens:
+            expansions = self.expand(token)
+            bound += max((self.idf[term] for term, _ in expansions), default=unseen_idf)
+        return bound * (self.k1 + 1) + sum(weight for _, _, weight in self._proximity_pairs(tokens))
+
+    def _df(self, term):
+        return self.doc_freqs.get(term, 0)
+
+    def _idf(self, term):
+        return self.idf[term]
+
+    def _occurrences(self, term):
+        """(doc position, token offsets) of every document containing a vocabulary term"""
+        positions, position = self.positions, self.position
+        return [(position[slot], positions[slot][term]) for slot in self.postings[term]]
+
+    def _doc_set(self, term):
+        """Positions of the documents containing a vocabulary term"""
+        return set(map(self.position.__getitem__, self.postings[term]))
+
+    def _offsets_in(self, term, doc):
+        """Token offsets of a term in the document at a position, or None"""
+        return self.positions[self.order[doc]].get(term)
+
+    def _phrase_filter(self, query):
+        """Positions of the documents containing every quoted phrase, or None without phrases"""
+        allowed = None
+        for phrase in self.phrases(query):
+            docs = self._phrase_docs(phrase)
+            allowed = docs if allowed is None else allowed & docs
+        return allowed
+
+    def _rank(self, scores, query, top_k):
+        """Best-first (doc, score) pairs from a score dict, after the phrase filter and proximity bonuses"""
+        allowed = self._phrase_filter(query)
+        if allowed is not None:
+            scores = {doc: score for doc, score in scores.items() if doc in allowed}
+        pairs = self._proximity_pairs(self.tokenize(query))
+        if pairs:
+            candidates = None if allowed is None else list(scores)
+            if top_k is not None and len(scores) > top_k:
+                kth, max_bonus = heapq.nlargest(top_k, scores.values())[-1], sum(weight for _, _, weight in pairs)
+                candidates = [doc for doc, score in scores.items() if score + max_bonus >= kth]
+            for doc, bonus in self._proximity_bonuses(pairs, candidates).items():
+                scores[doc] += bonus
+        if top_k is None:
+            return sorted(scores.items(), key=_rank_key, reverse=True)
+        return heapq.nlargest(top_k, scores.items(), key=_rank_key)
+
+    def _rank_array(self, scores, query, top_k):
+        """Array counterpart of _rank: scores is indexed by doc position"""
+        matched = np.flatnonzero(scores)  # ascending doc order
+        allowed = self._phrase_filter(query)
+        if allowed is not None:
+            matched = matched[np.isin(matched, np.fromiter(allowed, dtype=np.int64, count=len(allowed)))]
+        pairs = self._proximity_pairs(self.tokenize(query))
+        if pairs:
+            candidates = None if allowed is None else matched.tolist()
+            if top_k is not None and 0 < top_k < len(matched):
+                kth = np.partition(scores[matched], -top_k)[-top_k]
+                max_bonus = sum(weight for _, _, weight in pairs)
+                candidates = matched[scores[matched] + max_bonus >= kth].tolist()
+            bonuses = self._proximity_bonuses(pairs, candidates)
+            if bonuses:
+                scores[np.fromiter(bonuses, dtype=np.int64, count=len(bonuses))] += np.fromiter(
+                    bonuses.values(), dtype=np.float64, count=len(bonuses))
+        return _top_k(matched, scores[matched], top_k)
+
+    def _proximity_bonuses(self, pairs, candidates=None):
+        """doc position -> proximity bonus, over candidate documents (default: all)"""
+        bonuses = {}
+        for a, b, weight in pairs:
+            if candidates is None:
+                if self._df(a) > self._df(b):
+                    a, b = b, a
+                found = ((doc, offsets, self._offsets_in(b, doc)) for doc, offsets in self._occurrences(a))
+            else:
+                found = ((doc, self._offsets_in(a, doc), self._offsets_in(b, doc)) for doc in candidates)
+            for doc, xs, ys in found:
+                if xs and ys:
+                    distance = _min_distance(xs, ys)
+                    if distance <= PROXIMITY_WINDOW:
+                        bonuses[doc] = bonuses.get(doc, 0.0) + weight / distance
+        return bonuses
+
+    def _proximity_pairs(self, tokens):
+        """(a, b, bonus at distance 1) for consecutive distinct query tokens in the vocabulary"""
+        return [(a, b, PROXIMITY_WEIGHT * min(self._idf(a), self._idf(b)))
+                for a, b in zip(tokens, tokens[1:]) if a != b and self._df(a) and self._df(b)]
+
+    def _phrase_docs(self, phrase):
+        """Positions of the documents containing a phrase as consecutive tokens"""
+        if not all(self._df(term) for term in phrase):
+            return set()
+        terms = sorted(set(phrase), key=self._df)
+        candidates = self._doc_set(terms[0]).intersection(*map(self._doc_set, terms[1:]))
+        docs = set()
+        for doc in candidates:
+            starts = set(self._offsets_in(phrase[0], doc))
+            for i, term in enumerate(phrase[1:], 1):
+                found = self._offsets_in(term, doc)
+                starts = {start for start in starts if start + i in found}
+                if not starts:
+                    break
+            if starts:
+                docs.add(doc)
+        return docs
+
+
+def _min_distance(xs, ys):
+    """Smallest |x - y| over two ascending offset sequences (a merge walk)"""
+    i = j = 0
+    best = float("inf")
+    while i < len(xs) and j < len(ys):
+        gap = xs[i] - ys[j]
+        best = min(best, abs(gap))
+        if gap < 0:
+            i += 1
+        else:
+            j += 1
+    return best
+
+
+def _rank_key(item):
+    """Order (idx, score) pairs by score, then by earlier document"""
+    return item[1], -item[0]
+
+
+class NumpyBM25(BM25):
+    """BM25 with vectorized scoring over CSR arrays; scores and rankings are identical to BM25"""
+
+    def fit(self, documents):
+        super().fit(documents)
+        self._build_arrays()
+
+    def update(self, documents):
+        self._removed, self._added = [], []
+        counts = super().update(documents)
+        if self._removed or self._added:
+            self._splice_arrays()
+        self.stale = True  # moved rows change doc positions even when no entry was spliced
+        return counts
+
+    def _add_doc(self, document, touched):
+        slot = super()._add_doc(document, touched)
+        self._added.append(slot)
+        return slot
+
+    def _remove_doc(self, slot, touched):
+        self._removed.append((slot, list(self.term_freqs[slot])))
+        super()._remove_doc(slot, touched)
+
+    def _build_arrays(self):
+        """Flatten posting lists into CSR arrays of doc slots and term frequencies"""
+        self.term_ids = {term: i for i, term in enumerate(self.postings)}
+        lengths = [len(docs) for docs in self.postings.values()]
+        self.indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.indptr[1:])
+        self.slots = np.array([idx for docs in self.postings.values() for idx in docs], dtype=np.int32)
+        self.tfs = np.array([self.term_freqs[idx][term] for term, docs in self.postings.items() for idx in docs],
+                            dtype=np.int32)
+        self._derive_arrays()
+
+    def _splice_arrays(self):
+        """Apply the pending removed/added documents to the CSR arrays in one pass each"""
+        term_ids = self.term_ids
+        for slot in self._added:
+            for term in self.term_freqs[slot]:
+                term_ids.setdefault(term, len(term_ids))
+        indptr = np.concatenate([self.indptr, np.full(len(term_ids) + 1 - len(self.indptr), self.indptr[-1])])
+        slots, tfs = self.slots, self.tfs
+
+        if self._removed:
+            counts = np.zeros(len(term_ids), dtype=np.int64)
+            for _, terms in self._removed:
+                for term in terms:
+                    counts[term_ids[term]] += 1
+            keep = ~np.isin(slots, [slot for slot, _ in self._removed])
+            slots, tfs = slots[keep], tfs[keep]
+            indptr[1:] -= np.cumsum(counts)
+
+        if self._added:
+            entries = [(term_ids[term], slot, tf) for slot in self._added for term, tf in self.term_freqs[slot].items()]
+            tids, new_slots, new_tfs = (np.array(column, dtype=np.int64) for column in zip(*entries))
+            at = indptr[tids + 1]
+            slots, tfs = np.insert(slots, at, new_slots), np.insert(tfs, at, new_tfs)
+            indptr[1:] += np.cumsum(np.bincount(tids, minlength=len(term_ids)))
+
+        self.indptr, self.slots, self.tfs = indptr, slots, tfs
+        self.stale = True
+
+    def _derive_arrays(self):
+        """Doc positions and BM25 weights of every CSR entry under the current norms and idf"""
+        terms = list(self.term_ids)
+        idfs = np.array([self.idf[term] if term in self.postings else 0.0 for term in terms], dtype=np.float64)
+        lengths = np.array(self.doc_lengths, dtype=np.float64)
+        norms = self.k1 * (1 - self.b + self.b * lengths / self.avgdl) if self.avgdl else lengths
+        positions = np.array([-1 if pos is None else pos for pos in self.position], dtype=np.int64)
+
+        tf = self.tfs.astype(np.float64)
+        self.indices = positions[self.slots].astype(np.int32)
+        self.weights = np.repeat(idfs, np.diff(self.indptr)) * (tf * (self.k1 + 1)) / (tf + norms[self.slots])
+        self.stale = False
+
+    def score(self, query, top_k=None):
+        """Vectorized equivalent of BM25.score (same output, same tie-breaking)"""
+        if self.stale:
+            self._derive_arrays()
+        terms = [(self.term_ids[token], weight) for token, weight in self.query_terms(query)]
+        if not terms:
+            return []
+
+        slices = [slice(self.indptr[i], self.indptr[i + 1]) for i, _ in terms]
+        docs = np.concatenate([self.indices[s] for s in slices])
+        weights = [self.weights[s] if weight == 1.0 else weight * self.weights[s] for s, (_, weight) in zip(slices, terms)]
+        scores = np.bincount(docs, weights=np.concatenate(weights), minlength=self.N)
+        with profile_stage("top_k"):
+            return self._rank_array(scores, query, top_k)
+
+
+def _top_k(ids, scores, top_k=None):
+    """Best-first (id, score) pairs from parallel arrays with ids ascending; ties keep the lower id"""
+    if top_k is not None and top_k < len(ids):
+        if top_k <= 0:
+            return []
+        kth = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+        better = scores > kth
+        better[np.flatnonzero(scores == kth)[:top_k - np.count_nonzero(better)]] = True
+        ids, scores = ids[better], scores[better]
+
+    order = np.lexsort((ids, -scores))
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def select_bm25(n_docs):
+    """BM25 class for a corpus of n_docs under the configured BM25_BACKEND"""
+    if np is None or BM25_BACKEND == "python":
+        return BM25
+    if BM25_BACKEND == "numpy" or n_docs >= NUMPY_MIN_DOCS:
+        return NumpyBM25
+    return BM25
+
+
+# ============ ROW STORE ============
+class RowStore:
+    """Column-oriented CSV rows: one list per column, identical cells share one string"""
+
+    CHUNK_ROWS = 4096
+
+    def __init__(self, header, columns):
+        self.header = list(header)
+        self.columns = columns
+        self.n_rows = len(columns[self.header[0]]) if self.header else 0
+
+    @classmethod
+    def from_csv(cls, filepath):
+        """Stream a CSV into column lists, transposing and interning a chunk of lines at a time"""
+        with open(filepath, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            lists = [[] for _ in header]
+            pool = {}
+            records = (record for record in reader if record)
+            while True:
+                chunk = list(islice(records, cls.CHUNK_ROWS))
+                if not chunk:
+                    break
+                transposed = islice(zip_longest(*chunk), len(header))
+                for values, target in zip_longest(transposed, lists):
+                    target.extend(map(pool.setdefault, values, values) if values else [None] * len(chunk))
+        return cls(header, dict(zip(header, lists)))
+
+    def __len__(self):
+        return self.n_rows
+
+    def documents(self, cols):
+        """Per-row text of the given columns joined by spaces (absent columns count as empty)"""
+        arrays = [self.columns.get(col) or [""] * self.n_rows for col in cols]
+        return [" ".join(map(str, values)) for values in zip(*arrays)]
+
+    def project(self, idx, cols):
+        """Materialize one row as {col: value} for the requested columns present in the CSV"""
+        return {col: self.columns[col][idx] for col in cols if col in self.columns}
+
+
+# ============ MEMORY-MAPPED INDEX ============
+_NULL_CELL = 0xFFFFFFFF  # cell id of a value missing from a short CSV line
+
+
+def _align8(n):
+    """Round a byte count up to the next multiple of 8"""
+    return (n + 7) & ~7
+
+
+def _write_mapped(index, target):
+    """Export a CorpusIndex to the fixed-width binary layout read by MappedIndex"""
+    bm25, rows = index.bm25, index.rows
+    k1_plus_1 = bm25.k1 + 1
+    terms = sorted(bm25.postings)
+    vocab = [term.encode("utf-8") for term in terms]
+    vocab_offsets = array('Q', [0])
+    indptr, idfs = array('Q', [0]), array('d')
+    doc_ids, tfs, weights = array('i'), array('i'), array('d')
+    position_offsets, positions = array('Q', [0]), array('I')
+    for term, encoded in zip(terms, vocab):
+        vocab_offsets.append(vocab_offsets[-1] + len(encoded))
+        idf = bm25.idf[term]
+        for pos, slot in sorted((bm25.position[slot], slot) for slot in bm25.postings[term]):
+            tf, norm = bm25.term_freqs[slot][term], bm25.norms[bm25.doc_lengths[slot]]
+            doc_ids.append(pos)
+            tfs.append(tf)
+            weights.append(idf * (tf * k1_plus_1) / (tf + norm))
+            positions.extend(bm25.positions[slot][term])
+            position_offsets.append(len(positions))
+        indptr.append(len(doc_ids))
+        idfs.append(idf)
+
+    strings, cells = {}, array('I')
+    for col in rows.header:
+        cells.extend(_NULL_CELL if value is None else strings.setdefault(value, len(strings))
+                     for value in rows.columns[col])
+    encoded_strings = [value.encode("utf-8") for value in strings]
+    string_offsets = array('Q', [0])
+    for encoded in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(encoded))
+
+    sections = [
+        ("vocab_offsets", vocab_offsets.tobytes()), ("vocab", b"".join(vocab)),
+        ("indptr", indptr.tobytes()), ("idf", idfs.tobytes()),
+        ("doc_ids", doc_ids.tobytes()), ("tfs", tfs.tobytes()), ("weights", weights.tobytes()),
+        ("position_offsets", position_offsets.tobytes()), ("positions", positions.tobytes()),
+        ("doc_lengths", array('I', (bm25.doc_lengths[slot] for slot in bm25.order)).tobytes()),
+        ("cells", cells.tobytes()), ("string_offsets", string_offsets.tobytes()),
+        ("strings", b"".join(encoded_strings)),
+    ]
+    layout, offset = {}, 0
+    for name, data in sections:
+        layout[name] = (offset, len(data))
+        offset = _align8(offset + len(data))
+    header = json.dumps({
+        "version": index.version, "byteorder": sys.byteorder, "filepath": index.filepath,
+        "search_cols": index.search_cols, "size": index.size, "sha256": index.sha256,
+        "k1": bm25.k1, "b": bm25.b, "n_docs": bm25.N, "n_terms": len(terms), "columns": rows.header,
+        "sections": layout,
+    }).encode("utf-8")
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MappedIndex.MAGIC + struct.pack("<QQ", index.mtime_ns, len(header)) + header)
+            f.write(b"\0" * (_align8(24 + len(header)) - 24 - len(header)))
+            for _, data in sections:
+                f.write(data + b"\0" * (_align8(len(data)) - len(data)))
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class MappedIndex:
+    """Read-only corpus index served as zero-copy views of a memory-mapped binary file"""
+
+    MAGIC = b"UIPXIDX1"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != self.MAGIC:
+            raise ValueError(f"Not a mapped index: {path}")
+        self.mtime_ns, header_len = struct.unpack_from("<QQ", self._map, 8)
+        header = json.loads(self._map[24:24 + header_len])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Mapped index written on a {header['byteorder']}-endian machine: {path}")
+        base, view = _align8(24 + header_len), memoryview(self._map)
+
+        def section(name, fmt):
+            offset, nbytes = header["sections"][name]
+            return view[base + offset:base + offset + nbytes].cast(fmt)
+
+        self.filepath = header["filepath"]
+        self.search_cols = header["search_cols"]
+        self.version = header["version"]
+        self.size = header["size"]
+        self.sha256 = header["sha256"]
+        self.bm25 = MappedBM25(header, section)
+        self.rows = MappedRows(header, section)
+        self.source = "mmap"
+
+    def adopt_mtime(self, mtime_ns):
+        """Record a new CSV mtime (content unchanged) in place in the file header"""
+        try:
+            with open(self.path, 'r+b') as f:
+                f.seek(8)
+                f.write(struct.pack("<Q", mtime_ns))
+        except OSError:
+            pass
+        self.mtime_ns = mtime_ns
+
+
+class MappedBM25:
+    """BM25 scoring over memory-mapped postings, with the BM25 query interface"""
+
+    tokenize = staticmethod(BM25.tokenize)
+
+    def __init__(self, header, section):
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.N = header["n_docs"]
+        self.n_terms = header["n_terms"]
+        self.vocab_offsets = section("vocab_offsets", "Q")
+        self.vocab = section("vocab", "B")
+        self.indptr = section("indptr", "Q")
+        self.idfs = section("idf", "d")
+        self.doc_ids = section("doc_ids", "i")
+        self.tfs = section("tfs", "i")
+        self.weights = section("weights", "d")
+        self.position_offsets = section("position_offsets", "Q")
+        self.positions = section("positions", "I")
+        self.doc_lengths = section("doc_lengths", "I")
+        self._ids = {}
+        self._expansions = {}
+        self._tries = {}
+
+    def _term(self, i):
+        return bytes(self.vocab[self.vocab_offsets[i]:self.vocab_offsets[i + 1]]).decode("utf-8")
+
+    def _lower_bound(self, word):
+        """Index of the first vocabulary term >= word (binary search over the sorted vocabulary)"""
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def term_id(self, term):
+        """Vocabulary id of a term, or -1"""
+        term_id = self._ids.get(term)
+        if term_id is None:
+            i = self._lower_bound(term)
+            term_id = i if i < self.n_terms and self._term(i) == term else -1
+            if len(self._ids) < 65536:
+                self._ids[term] = term_id
+        return term_id
+
+    def _df(self, term):
+        i = self.term_id(term)
+        return self.indptr[i + 1] - self.indptr[i] if i >= 0 else 0
+
+    def _idf(self, term):
+        return self.idfs[self.term_id(term)]
+
+    def _occurrences(self, term):
+        i, offsets = self.term_id(term), self.position_offsets
+        return [(self.doc_ids[e], self.positions[offsets[e]:offsets[e + 1]])
+                for e in range(self.indptr[i], self.indptr[i + 1])]
+
+    def _doc_set(self, term):
+        i = self.term_id(term)
+        return set(self.doc_ids[self.indptr[i]:self.indptr[i + 1]])
+
+    def _offsets_in(self, term, doc):
+        i = self.term_id(term)
+        hi = self.indptr[i + 1]
+        e = bisect.bisect_left(self.doc_ids, doc, self.indptr[i], hi)
+        if e < hi and self.doc_ids[e] == doc:
+            return self.positions[self.position_offsets[e]:self.position_offsets[e + 1]]
+        return None
+
+    def _with_prefix(self, prefix):
+        terms, i = [], self._lower_bound(prefix)
+        while i < self.n_terms:
+            term = self._term(i)
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                terms.append(term)
+            i += 1
+        return terms
+
+    def _trie(self, first):
+        """VocabTrie of the terms starting with one character, built on first use"""
+        trie = self._tries.get(first)
+        if trie is None:
+            lo, hi = self._lower_bound(first), self._lower_bound(chr(ord(first) + 1))
+            trie = self._tries[first] = VocabTrie(self._term(i) for i in range(lo, hi))
+        return trie
+
+    def expand(self, token):
+        """Same expansion as BM25.expand, from the sorted vocabulary"""
+        if self.term_id(token) >= 0:
+            return [(token, 1.0)]
+        cache = self._expansions
+        if token in cache:
+            return cache[token]
+
+        weights = dict.fromkeys(self._with_prefix(token), PREFIX_WEIGHT)
+        if not weights:
+            for term, dist in self._trie(token[0]).within_distance(token, 2 if len(token) >= 8 else 1):
+                weights[term] = FUZZY_WEIGHT ** dist
+        best = sorted(weights.items(), key=lambda tw: (-tw[1], -self._df(tw[0]), tw[0]))[:MAX_EXPANSIONS]
+        if len(cache) < 4096:
+            cache[token] = best
+        return best
+
+    phrases = staticmethod(BM25.phrases)
+    query_terms = BM25.query_terms
+    _phrase_filter = BM25._phrase_filter
+    _phrase_docs = BM25._phrase_docs
+    _proximity_pairs = BM25._proximity_pairs
+    _proximity_bonuses = BM25._proximity_bonuses
+    _rank = BM25._rank
+    _rank_array = BM25._rank_array
+
+    def score(self, query, top_k=None):
+        """Equivalent of BM25.score (vectorized when NumPy is installed)"""
+        spans = [(self.indptr[i], self.indptr[i + 1], weight)
+                 for i, weight in ((self.term_id(token), weight) for token, weight in self.query_terms(query))]
+        if np is not None:
+            if not spans:
+                return []
+            docs = np.concatenate([np.frombuffer(self.doc_ids[lo:hi], dtype=np.int32) for lo, hi, _ in spans])
+            weights = [np.frombuffer(self.weights[lo:hi], dtype=np.float64) for lo, hi, _ in spans]
+            weights = [w if weight == 1.0 else weight * w for w, (_, _, weight) in zip(weights, spans)]
+            scores = np.bincount(docs, weights=np.concatenate(weights), minlength=self.N)
+            with profile_stage("top_k"):
+                return self._rank_array(scores, query, top_k)
+
+        scores = defaultdict(float)
+        for lo, hi, weight in spans:
+            for doc, contribution in zip(self.doc_ids[lo:hi], self.weights[lo:hi]):
+                scores[doc] += weight * contribution
+        with profile_stage("top_k"):
+            return self._rank(scores, query, top_k)
+
+    def score_bound(self, query):
+        """Same bound as BM25.score_bound"""
+        unseen_idf = log((self.N + 0.5) / 0.5 + 1)
+        bound = 0.0
+        tokens = self.tokenize(query)
+        for token in tokens:
+            expansions = self.expand(token)
+            bound += max((self._idf(term) for term, _ in expansions), default=unseen_idf)
+        return bound * (self.k1 + 1) + sum(weight for _, _, weight in self._proximity_pairs(tokens))
+
+
+class MappedRows:
+    """RowStore interface over the mapped column-major cell table"""
+
+    def __init__(self, header, section):
+        self.header = header["columns"]
+        self.n_rows = header["n_docs"]
+        self.col_ids = {col: i for i, col in enumerate(self.header)}
+        self.cells = section("cells", "I")
+        self.string_offsets = section("string_offsets", "Q")
+        self.strings = section("strings", "B")
+
+    def __len__(self):
+        return self.n_rows
+
+    def _value(self, cell):
+        if cell == _NULL_CELL:
+            return None
+        return bytes(self.strings[self.string_offsets[cell]:self.string_offsets[cell + 1]]).decode("utf-8")
+
+    def column(self, col):
+        """All values of one column (None if the CSV has no such column)"""
+        if col not in self.col_ids:
+            return None
+        start = self.col_ids[col] * self.n_rows
+        decoded = {}
+        return [decoded[cell] if cell in decoded else decoded.setdefault(cell, self._value(cell))
+                for cell in self.cells[start:start + self.n_rows]]
+
+    def documents(self, cols):
+        """Same as RowStore.documents"""
+        arrays = [self.column(col) or [""] * self.n_rows for col in cols]
+        return [" ".join(map(str, values)) for values in zip(*arrays)]
+
+    def project(self, idx, cols):
+        """Same as RowStore.project, decoding only the requested cells"""
+        return {col: self._value(self.cells[self.col_ids[col] * self.n_rows + idx])
+                for col in cols if col in self.col_ids}
+
+
+# ============ INDEX CACHE ============
+class CorpusIndex:
+    """Fitted BM25 index plus the columnar CSV rows it was built from"""
+
+    def __init__(self, filepath, search_cols, rows, bm25, mtime_ns, size, sha256):
+        self.filepath = str(filepath)
+        self.search_cols = list(search_cols)
+        self.rows = rows
+        self.bm25 = bm25
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.sha256 = sha256
+        self.version = INDEX_VERSION
+        self.source = "built"
 
-        for doc in self.corpus:
-            seen = set()
-            for word in doc:
-                if word not in seen:
-                    self.doc_freqs[word] += 1
-                    seen.add(word)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("source", None)
+        return state
 
-        for word, freq in self.doc_freqs.items():
-            self.idf[word] = log((self.N - freq + 0.5) / (freq + 0.5) + 1)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.source = "disk"
 
-    def score(self, query):
-        """Score all documents against query"""
-        query_tokens = self.tokenize(query)
-        scores = []
 
-        for idx, doc in enumerate(self.corpus):
-            score = 0
-            doc_len = self.doc_lengths[idx]
-            term_freqs = defaultdict(int)
-            for word in doc:
-                term_freqs[word] += 1
+_INDEX_CACHE = {}
+_INDEX_LOCKS = {}  # per-index lock: one thread loads, updates or builds a given index
 
-            for token in query_tokens:
-                if token in self.idf:
-                    tf = term_freqs[token]
-                    idf = self.idf[token]
-                    numerator = tf * (self.k1 + 1)
-                    denominator = tf + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
-                    score += idf * numerator / denominator
 
-            scores.append((idx, score))
+def _file_sha256(filepath):
+    """Content hash used when mtime alone cannot prove a CSV is unchanged"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-        return sorted(scores, key=lambda x: x[1], reverse=True)
+
+def _index_path(filepath):
+    """Serialized index location for a CSV, e.g. .index/stacks__react.csv.pkl"""
+    try:
+        name = Path(filepath).resolve().relative_to(DATA_DIR.resolve()).as_posix()
+    except ValueError:
+        name = Path(filepath).name
+    return INDEX_DIR / (name.replace("/", "__") + ".pkl")
+
+
+def _mapped_path(filepath):
+    """Memory-mapped index location for a CSV, e.g. .index/stacks__react.csv.bin"""
+    return _index_path(filepath).with_suffix(".bin")
+
+
+def _is_compatible(index, search_cols):
+    """Whether a cached index can serve (or be updated for) these search columns and backend"""
+    if index.version != INDEX_VERSION or index.search_cols != list(search_cols):
+        return False
+    return isinstance(index, MappedIndex) or type(index.bm25) is select_bm25(index.bm25.N)
+
+
+def _is_fresh(index, filepath, stat):
+    """Check a cached index against the CSV: mtime/size first, content hash second"""
+    if (index.mtime_ns, index.size) == (stat.st_mtime_ns, stat.st_size):
+        return True
+    if index.size != stat.st_size or index.sha256 != _file_sha256(filepath):
+        return False
+    # Touched but unchanged (checkout, copy): adopt the new mtime
+    if isinstance(index, MappedIndex):
+        index.adopt_mtime(stat.st_mtime_ns)
+        pickled = _read_index(filepath)
+        if pickled is not None and pickled.sha256 == index.sha256:
+            pickled.mtime_ns = stat.st_mtime_ns
+            _write_pickle(pickled, _index_path(filepath))
+        return True
+    index.mtime_ns = stat.st_mtime_ns
+    _write_index(index)
+    return True
+
+
+def _write_index(index):
+    """Atomically persist an index (pickle for updates, binary for mapping); skipped on a read-only checkout"""
+    with profile_stage("index_write"):
+        _write_pickle(index, _index_path(index.filepath))
+        try:
+            _write_mapped(index, _mapped_path(index.filepath))
+        except OSError:
+            pass
+
+
+def _write_pickle(obj, target):
+    """Write obj to target via a temp file and rename, ignoring OSError"""
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def _read_index(filepath):
+    """Load a serialized index, treating any unreadable file as a cache miss"""
+    try:
+        with open(_index_path(filepath), 'rb') as f:
+            index = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    return index if isinstance(index, CorpusIndex) else None
+
+
+def _open_mapped(filepath):
+    """Map a binary index, treating any unreadable file as a cache miss"""
+    try:
+        return MappedIndex(_mapped_path(filepath))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _build_index(filepath, search_cols):
+    """Parse the CSV and fit a fresh BM25 index over its search columns"""
+    stat = os.stat(filepath)
+    with profile_stage("csv_load"):
+        rows = RowStore.from_csv(filepath)
+    documents = rows.documents(search_cols)
+    bm25 = select_bm25(len(documents))()
+    with profile_stage("fit"):
+        bm25.fit(documents)
+    return CorpusIndex(filepath, search_cols, rows, bm25,
+                       stat.st_mtime_ns, stat.st_size, _file_sha256(filepath))
+
+
+def _update_index(index, filepath, stat):
+    """Bring a stale index up to date in place; None when it has to be rebuilt instead"""
+    if isinstance(index, MappedIndex):
+        search_cols, index = index.search_cols, _read_index(filepath)
+        if index is None or not _is_compatible(index, search_cols):
+            return None
+    with profile_stage("csv_load"):
+        rows = RowStore.from_csv(filepath)
+    if type(index.bm25) is not select_bm25(len(rows)):
+        return None
+    with profile_stage("update"):
+        index.bm25.update(rows.documents(index.search_cols))
+    index.rows = rows
+    index.mtime_ns, index.size, index.sha256 = stat.st_mtime_ns, stat.st_size, _file_sha256(filepath)
+    index.source = "updated"
+    _write_index(index)
+    return index
+
+
+def _cached_index(key, filepath, search_cols):
+    """A compatible, possibly stale index from memory, else mapped, else unpickled from disk"""
+    index = _INDEX_CACHE.get(key)
+    if index is not None and _is_compatible(index, search_cols):
+        index.source = "memory"
+        return index
+    for load in (_open_mapped, _read_index):
+        with profile_stage("index_load"):
+            index = load(filepath)
+        if index is not None and _is_compatible(index, search_cols):
+            return index
+    return None
+
+
+def get_index(filepath, search_cols, rebuild=False):
+    """Return the index for a CSV from memory or disk, updated incrementally if the CSV changed, or freshly built"""
+    key = (str(filepath), tuple(search_cols))
+    stat = os.stat(filepath)
+
+    with _INDEX_LOCKS.setdefault(key, threading.Lock()):
+        index = None if rebuild else _cached_index(key, filepath, search_cols)
+        if index is not None and not _is_fresh(index, filepath, stat):
+            index = _update_index(index, filepath, stat)
+        if index is None:
+            index = _build_index(filepath, search_cols)
+            _write_index(index)
+        _INDEX_CACHE[key] = index
+        return index
+
+
+def clear_index_cache(disk=False):
+    """Drop in-process indexes, and optionally the serialized ones and cached results"""
+    global _LATENT_INDEX, _DEDUP_INDEX
+    _INDEX_CACHE.clear()
+    _LATENT_INDEX = None
+    _DEDUP_INDEX = None
+    if disk:
+        RESULT_CACHE.clear()
+        if INDEX_DIR.exists():
+            for pattern in ("*.pkl", "*.bin"):
+                for path in INDEX_DIR.glob(pattern):
+                    path.unlink()
+
+
+# ============ RESULT CACHE ============
+class ResultCache:
+    """LRU cache of search results in SQLite, keyed by query, target and CSV versions; errors act as misses"""
+
+    def __init__(self, path, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS results "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, bytes INTEGER NOT NULL, used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def _count(self, db, name, n=1):
+        db.execute("INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                   (name, n, n))
+
+    @staticmethod
+    def key(target, filepaths, query, max_results):
+        versions = []
+        for filepath in filepaths:
+            try:
+                stat = os.stat(filepath)
+                versions.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+            except OSError:
+                versions.append("-")
+        tokens = " ".join(BM25.tokenize(query))
+        phrases = ";".join(" ".join(phrase) for phrase in BM25.phrases(query))
+        return f"{INDEX_VERSION}|{target}|{tokens}|{phrases}|{max_results}|{','.join(versions)}"
+
+    def get(self, key):
+        """Cached result (a fresh copy) or None; counts the hit or miss"""
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self._count(db, "misses")
+                    return None
+                db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                self._count(db, "hits")
+        except (sqlite3.Error, OSError):
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        text = json.dumps(result, ensure_ascii=False)
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, text, size, time.time()))
+                self._evict(db)
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _evict(self, db):
+        entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in db.execute("SELECT key, bytes FROM results ORDER BY used"):
+            if entries <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            entries -= 1
+            total -= size
+        db.executemany("DELETE FROM results WHERE key = ?", victims)
+        self._count(db, "evictions", len(victims))
+
+    def clear(self):
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("DELETE FROM results")
+                db.execute("DELETE FROM counters")
+        except (sqlite3.Error, OSError):
+            pass
+
+    def stats(self):
+        """Cumulative hit/miss/eviction counters plus current size"""
+        stats = {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0}
+        try:
+            with self._lock:
+                db = self._db()
+                stats.update(db.execute("SELECT name, value FROM counters").fetchall())
+                stats["entries"], stats["bytes"] = db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+        except (sqlite3.Error, OSError):
+            pass
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        stats["max_entries"] = self.max_entries
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+RESULT_CACHE = ResultCache(INDEX_DIR / "results.sqlite")
+
+
+def _cached(target, filepaths, query, max_results, compute):
+    """Serve a search result from RESULT_CACHE, computing and storing it on a miss"""
+    if not RESULT_CACHE_ENABLED:
+        return compute()
+    key = ResultCache.key(target, filepaths, query, max_results)
+    with profile_stage("result_cache"):
+        result = RESULT_CACHE.get(key)
+    if result is None:
+        result = compute()
+        with profile_stage("result_cache"):
+            RESULT_CACHE.put(key, result)
+    result["query"] = query
+    return result
+
+
+# ============ LATENT SEMANTIC INDEX ============
+class _SparseRows:
+    """Minimal CSR matrix (row pointers, column ids, values) with chunked dense products"""
+
+    CHUNK = 1 << 18  # nonzeros per product chunk
+
+    def __init__(self, indptr, indices, data, n_cols):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = (len(indptr) - 1, n_cols)
+
+    def dot(self, dense):
+        """self @ dense, accumulated a chunk of nonzeros at a time"""
+        out = np.zeros((self.shape[0], dense.shape[1]))
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        for start in range(0, len(self.data), self.CHUNK):
+            chunk = slice(start, start + self.CHUNK)
+            products = self.data[chunk, None] * dense[self.indices[chunk]]
+            chunk_rows = rows[chunk]
+            firsts = np.flatnonzero(np.r_[True, chunk_rows[1:] != chunk_rows[:-1]])
+            out[chunk_rows[firsts]] += np.add.reduceat(products, firsts)
+        return out
+
+    def transpose(self):
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind="stable")
+        indptr = np.zeros(self.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=self.shape[1]), out=indptr[1:])
+        return _SparseRows(indptr, rows[order], self.data[order], self.shape[0])
+
+
+def _truncated_svd(matrix, dims, seed, power_iters=4):
+    """Top right singular vectors (dims x n_cols) by randomized SVD (Halko et al.)"""
+    rng = np.random.default_rng(seed)
+    width = min(dims + 10, *matrix.shape)
+    transposed = matrix.transpose()
+    basis, _ = np.linalg.qr(matrix.dot(rng.standard_normal((matrix.shape[1], width))))
+    for _ in range(power_iters):
+        basis, _ = np.linalg.qr(transposed.dot(basis))
+        basis, _ = np.linalg.qr(matrix.dot(basis))
+    _, _, vt = np.linalg.svd(transposed.dot(basis).T, full_matrices=False)
+    return vt[:dims]
+
+
+class LatentIndex:
+    """Latent semantic index: TF-IDF document vectors reduced by truncated SVD, with IVF lists for large corpora"""
+
+    KMEANS_ITERS = 10
+    ASSIGN_CHUNK = 16384
+
+    def __init__(self, dims=LSI_DIMS, seed=0):
+        self.dims = dims
+        self.seed = seed
+        self.bm25 = BM25()
+        self.term_ids = {}
+        self.term_vectors = None
+        self.doc_vectors = None
+        self.centroids = None
+        self.list_indptr = None
+        self.list_docs = None
+        self.N = 0
+
+    def fit(self, documents):
+        self.bm25.fit(documents)
+        self.N = self.bm25.N
+        self.term_ids = {term: i for i, term in enumerate(self.bm25.postings)}
+        dims = min(self.dims, self.N - 1, len(self.term_ids) - 1)
+        if dims < 1:
+            return
+
+        indptr, indices, data = [0], [], []
+        for freqs in self.bm25.term_freqs:
+            for term, tf in freqs.items():
+                indices.append(self.term_ids[term])
+                data.append((1 + log(tf)) * self.bm25.idf[term])
+            indptr.append(len(indices))
+        indptr = np.array(indptr, dtype=np.int64)
+        data = np.array(data, dtype=np.float64)
+        rows = np.repeat(np.arange(self.N), np.diff(indptr))
+        data /= np.sqrt(np.bincount(rows, weights=data * data, minlength=self.N))[rows]
+        matrix = _SparseRows(indptr, np.array(indices, dtype=np.int64), data, len(self.term_ids))
+
+        components = _truncated_svd(matrix, dims, self.seed)
+        self.term_vectors = components.T.astype(np.float32)
+        self.doc_vectors = _unit_rows(matrix.dot(components.T)).astype(np.float32)
+        if self.N >= LSI_IVF_MIN_DOCS:
+            self._build_ivf()
+
+    def _assign(self, centroids):
+        """Nearest centroid of every document vector"""
+        return np.concatenate([np.argmax(self.doc_vectors[i:i + self.ASSIGN_CHUNK] @ centroids.T, axis=1)
+                               for i in range(0, self.N, self.ASSIGN_CHUNK)])
+
+    def _build_ivf(self):
+        """Spherical k-means over document vectors; list_docs[list_indptr[c]:list_indptr[c + 1]] is list c"""
+        rng = np.random.default_rng(self.seed)
+        n_lists = int(np.sqrt(self.N))
+        centroids = self.doc_vectors[rng.choice(self.N, n_lists, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERS):
+            assign = self._assign(centroids)
+            order = np.argsort(assign, kind="stable")
+            members = assign[order]
+            firsts = np.flatnonzero(np.r_[True, members[1:] != members[:-1]])
+            sums = np.add.reduceat(self.doc_vectors[order], firsts)
+            centroids[members[firsts]] = _unit_rows(sums)
+        assign = self._assign(centroids)
+        self.centroids = centroids
+        self.list_docs = np.argsort(assign, kind="stable").astype(np.int32)
+        self.list_indptr = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=self.list_indptr[1:])
+
+    def query_vector(self, query):
+        """Unit vector of a query in the latent space, or None when no token is known"""
+        if self.term_vectors is None:
+            return None
+        counts, weights = Counter(), {}
+        for term, weight in self.bm25.query_terms(query):
+            counts[term] += 1
+            weights[term] = max(weights.get(term, 0.0), weight)
+        if not counts:
+            return None
+        terms = list(counts)
+        coeffs = np.array([weights[t] * (1 + log(counts[t])) * self.bm25.idf[t] for t in terms], dtype=np.float32)
+        vector = coeffs @ self.term_vectors[[self.term_ids[t] for t in terms]]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def search(self, query, top_k, span=None, exact=False):
+        """Best-first (doc, cosine) pairs with positive similarity, optionally within span=(start, stop)"""
+        vector = self.query_vector(query)
+        if vector is None:
+            return []
+        if span is None and self.centroids is not None and not exact:
+            probes = np.argsort(-(self.centroids @ vector))[:LSI_IVF_PROBES]
+            ids = np.sort(np.concatenate([self.list_docs[self.list_indptr[c]:self.list_indptr[c + 1]] for c in probes]))
+            scores = self.doc_vectors[ids] @ vector
+        else:
+            start, stop = span or (0, self.N)
+            ids = np.arange(start, stop)
+            scores = self.doc_vectors[start:stop] @ vector
+        positive = scores > 0
+        return _top_k(ids[positive], scores[positive].astype(np.float64), top_k)
+
+    def similarity(self, query, docs):
+        """Cosine similarity of the query to each listed doc (0 for an unknown query)"""
+        vector = self.query_vector(query)
+        if vector is None:
+            return [0.0] * len(docs)
+        return [float(s) for s in self.doc_vectors[docs] @ vector]
+
+
+def _unit_rows(matrix):
+    """Rows scaled to unit L2 norm (all-zero rows stay zero)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+_LATENT_INDEX = None
+_LATENT_LOCK = threading.Lock()
+
+
+def _corpus_versions():
+    """(file, search_cols, mtime, size) of every existing corpus, identifying corpus-wide indexes' data"""
+    versions = []
+    for _, file, search_cols, _ in _iter_corpora():
+        filepath = DATA_DIR / file
+        if filepath.exists():
+            stat = os.stat(filepath)
+            versions.append((file, tuple(search_cols), stat.st_mtime_ns, stat.st_size))
+    return tuple(versions)
+
+
+def _latent_fingerprint():
+    """Identity of the data a corpus-wide latent index was built from"""
+    return INDEX_VERSION, LSI_DIMS, _corpus_versions()
+
+
+def get_latent_index():
+    """The latent index over every domain and stack, from memory, disk or a fresh build"""
+    global _LATENT_INDEX
+    fingerprint = _latent_fingerprint()
+    with _LATENT_LOCK:
+        if _LATENT_INDEX is not None and _LATENT_INDEX.fingerprint == fingerprint:
+            return _LATENT_INDEX
+        target = INDEX_DIR / "latent.pkl"
+        try:
+            with open(target, 'rb') as f, profile_stage("index_load"):
+                latent = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            latent = None
+        if not isinstance(latent, LatentIndex) or getattr(latent, "fingerprint", None) != fingerprint:
+            documents, latent_ranges, sources = [], {}, []
+            for source, file, search_cols, _ in _iter_corpora():
+                filepath = DATA_DIR / file
+                if not filepath.exists():
+                    continue
+                sources.append((len(documents), source, file))
+                documents += get_index(filepath, search_cols).rows.documents(search_cols)
+                latent_ranges[str(filepath)] = (sources[-1][0], len(documents))
+            latent = LatentIndex()
+            with profile_stage("latent_fit"):
+                latent.fit(documents)
+            latent.fingerprint, latent.ranges, latent.sources = fingerprint, latent_ranges, sources
+            _write_pickle(latent, target)
+        _LATENT_INDEX = latent
+        return latent
+
+
+# ============ NEAR-DUPLICATE DETECTION ============
+_MINHASH_PRIME = 4294967311  # smallest prime above 2**32: shingle hashes are 32-bit
+
+
+def _shingles(text, size=DUP_SHINGLE_SIZE):
+    """Set of size-token shingles of a text's BM25 tokens"""
+    tokens = BM25.tokenize(text)
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)} if len(tokens) >= size else set()
+
+
+def minhash_signatures(shingle_sets, permutations=MINHASH_PERMUTATIONS, seed=DUP_SEED):
+    """MinHash signature of each shingle set (None for an empty set)"""
+    rng = random.Random(seed)
+    a = [rng.randrange(1, 1 << 31) for _ in range(permutations)]
+    b = [rng.randrange(0, 1 << 32) for _ in range(permutations)]
+    if np is not None:
+        a_col, b_col = np.array(a, dtype=np.uint64)[:, None], np.array(b, dtype=np.uint64)[:, None]
+
+    signatures = []
+    for shingles in shingle_sets:
+        if not shingles:
+            signatures.append(None)
+            continue
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                  for s in shingles]
+        if np is not None:
+            values = (a_col * np.array(hashes, dtype=np.uint64) + b_col) % np.uint64(_MINHASH_PRIME)
+            signatures.append(tuple(values.min(axis=1).tolist()))
+        else:
+            signatures.append(tuple(min((ai * h + bi) % _MINHASH_PRIME for h in hashes) for ai, bi in zip(a, b)))
+    return signatures
+
+
+def _lsh_candidates(signatures, bands):
+    """Distinct (i, j) pairs, i < j, of documents whose signatures agree on every value of some band"""
+    rows = MINHASH_PERMUTATIONS // bands
+    buckets = defaultdict(list)
+    for doc, signature in enumerate(signatures):
+        if signature is not None:
+            for band in range(bands):
+                buckets[band, signature[band * rows:(band + 1) * rows]].append(doc)
+    checked = set()
+    for members in buckets.values():
+        for n, i in enumerate(members):
+            for j in members[n + 1:]:
+                if (i, j) not in checked:
+                    checked.add((i, j))
+                    yield i, j
+
+
+def find_near_duplicates(documents, threshold=DUP_THRESHOLD, bands=LSH_BANDS):
+    """Group near-duplicate documents with MinHash + LSH; returns (clusters, confirmed (i, j, similarity) pairs)"""
+    shingle_sets = [_shingles(doc) for doc in documents]
+    parent = list(range(len(documents)))
+
+    def find(doc):
+        while parent[doc] != doc:
+            parent[doc] = parent[parent[doc]]
+            doc = parent[doc]
+        return doc
+
+    pairs = []
+    for i, j in _lsh_candidates(minhash_signatures(shingle_sets), bands):
+        a, b = shingle_sets[i], shingle_sets[j]
+        similarity = len(a & b) / len(a | b)
+        if similarity >= threshold:
+            pairs.append((i, j, similarity))
+            parent[find(j)] = find(i)
+
+    clusters = defaultdict(list)
+    for i, j, _ in pairs:
+        for doc in (i, j):
+            clusters[find(doc)].append(doc)
+    clusters = sorted(sorted(set(docs)) for docs in clusters.values())
+    return clusters, sorted(pairs)
+
+
+class DedupIndex:
+    """Near-duplicate clusters over every domain and stack row, numbered in _iter_corpora order"""
+
+    def __init__(self, clusters, pairs, ranges, sources):
+        self.clusters = clusters
+        self.pairs = pairs
+        self.ranges = ranges
+        self.sources = sources
+        self.n_docs = max((stop for _, stop in ranges.values()), default=0)
+        self.cluster_of = {doc: n for n, docs in enumerate(clusters) for doc in docs}
+
+    def doc_id(self, filepath, idx):
+        return self.ranges[str(filepath)][0] + idx
+
+    def locate(self, doc):
+        """(source tag, file, row index) of a row number"""
+        start, source, file = self.sources[bisect.bisect_right([s for s, _, _ in self.sources], doc) - 1]
+        return source, file, doc - start
+
+    def source_tags(self, doc, source):
+        """Source tags of a row's cluster, its own first ([source] for a unique row)"""
+        tags = [source]
+        for member in self.clusters[self.cluster_of[doc]] if doc in self.cluster_of else ():
+            tag = self.locate(member)[0]
+            if tag not in tags:
+                tags.append(tag)
+        return tags
+
+
+_DEDUP_INDEX = None
+_DEDUP_LOCK = threading.Lock()
+
+
+def get_dedup_index():
+    """The near-duplicate clusters of all corpora, from memory, disk or a fresh MinHash pass"""
+    global _DEDUP_INDEX
+    fingerprint = (INDEX_VERSION, DUP_THRESHOLD, DUP_SHINGLE_SIZE, MINHASH_PERMUTATIONS, LSH_BANDS, DUP_SEED,
+                   _corpus_versions())
+    with _DEDUP_LOCK:
+        if _DEDUP_INDEX is not None and _DEDUP_INDEX.fingerprint == fingerprint:
+            return _DEDUP_INDEX
+        target = INDEX_DIR / "dedup.pkl"
+        try:
+            with open(target, 'rb') as f:
+                dedup = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            dedup = None
+        if not isinstance(dedup, DedupIndex) or getattr(dedup, "fingerprint", None) != fingerprint:
+            documents, ranges, sources = [], {}, []
+            for source, file, search_cols, _ in _iter_corpora():
+                filepath = DATA_DIR / file
+                if filepath.exists():
+                    sources.append((len(documents), source, file))
+                    documents += get_index(filepath, search_cols).rows.documents(search_cols)
+                    ranges[str(filepath)] = (sources[-1][0], len(documents))
+            dedup = DedupIndex(*find_near_duplicates(documents), ranges, sources)
+            dedup.fingerprint = fingerprint
+            _write_pickle(dedup, target)
+        _DEDUP_INDEX = dedup
+        return dedup
+
+
+def near_duplicate_report():
+    """Near-duplicate clusters of all corpora as a JSON-ready report"""
+    start = time.perf_counter()
+    dedup = get_dedup_index()
+    columns = {source: (search_cols, output_cols) for source, _, search_cols, output_cols in _iter_corpora()}
+    best = defaultdict(float)
+    for i, _, similarity in dedup.pairs:
+        best[dedup.cluster_of[i]] = max(best[dedup.cluster_of[i]], similarity)
+
+    clusters = []
+    for n, docs in enumerate(dedup.clusters):
+        rows = []
+        for doc in docs:
+            source, file, idx = dedup.locate(doc)
+            search_cols, output_cols = columns[source]
+            label = get_index(DATA_DIR / file, search_cols).rows.project(idx, output_cols[:2])
+            rows.append({"source": source, "file": file, "row": idx, "label": " / ".join(map(str, label.values()))})
+        clusters.append({"similarity": round(best[n], 4), "rows": rows})
+    clusters.sort(key=lambda cluster: -cluster["similarity"])
+    return {
+        "documents": dedup.n_docs,
+        "clusters": clusters,
+        "duplicate_rows": sum(len(docs) - 1 for docs in dedup.clusters),
+        "threshold": DUP_THRESHOLD,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
 
 
 # ============ SEARCH FUNCTIONS ============
-def _load_csv(filepath):
-    """Load CSV and return list of dicts"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        return list(csv.DictReader(f))
+def _rank_csv(filepath, search_cols, output_cols, query, max_results, mode="bm25"):
+    """Return the top (projected row, score) pairs with score > 0 (bm25, semantic or hybrid scores)"""
+    return [(row, score) for _, row, score in _rank_rows(filepath, search_cols, output_cols, query, max_results, mode)]
 
 
-def _search_csv(filepath, search_cols, output_cols, query, max_results):
-    """Core search function using BM25"""
+def _rank_rows(filepath, search_cols, output_cols, query, max_results, mode="bm25"):
+    """_rank_csv with the row index: (idx, projected row, score) triples"""
     if not filepath.exists():
         return []
 
-    data = _load_csv(filepath)
+    index = get_index(filepath, search_cols)
+    with profile_stage("score"):
+        if mode == "bm25":
+            ranked = index.bm25.score(query, top_k=max_results)
+        else:
+            ranked = _rank_latent(index, query, max_results, mode)
 
-    # Build documents from search columns
-    documents = [" ".join(str(row.get(col, "")) for col in search_cols) for row in data]
+    with profile_stage("project"):
+        return [(idx, index.rows.project(idx, output_cols), score) for idx, score in ranked if score > 0]
 
-    # BM25 search
-    bm25 = BM25()
-    bm25.fit(documents)
-    ranked = bm25.score(query)
 
-    # Get top results with score > 0
-    results = []
-    for idx, score in ranked[:max_results]:
-        if score > 0:
-            row = data[idx]
-            results.append({col: row.get(col, "") for col in output_cols if col in row})
+def _rank_latent(index, query, max_results, mode):
+    """(idx, score) pairs of one corpus in semantic or hybrid mode"""
+    latent = get_latent_index()
+    start, stop = latent.ranges[index.filepath]
+    candidates = index.bm25.score(query, top_k=HYBRID_CANDIDATES) if mode == "hybrid" else []
+    if not candidates:
+        # Semantic mode, or a hybrid query without any keyword hit: latent similarity alone
+        weight = 1.0 if mode == "semantic" else 1 - HYBRID_ALPHA
+        return [(doc - start, weight * score) for doc, score in latent.search(query, max_results, span=(start, stop))]
 
-    return results
+    bound = index.bm25.score_bound(query)
+    cosines = latent.similarity(query, [start + idx for idx, _ in candidates])
+    blended = [(idx, HYBRID_ALPHA * score / bound + (1 - HYBRID_ALPHA) * max(cosine, 0.0))
+               for (idx, score), cosine in zip(candidates, cosines)]
+    return heapq.nlargest(max_results, blended, key=_rank_key)
+
+
+def _search_csv(filepath, search_cols, output_cols, query, max_results, mode="bm25"):
+    """Core search function using BM25 (or the latent index, see _rank_csv)"""
+    return [row for row, _ in _rank_csv(filepath, search_cols, output_cols, query, max_results, mode)]
+
+
+def _mode_error(mode):
+    """Error message for an unusable search mode, else None"""
+    if mode not in SEARCH_MODES:
+        return f"Unknown mode: {mode}. Available: {', '.join(SEARCH_MODES)}"
+    if mode != "bm25" and np is None:
+        return f"The {mode} mode requires NumPy (pip install numpy)"
+    return None
+
+
+def _mode_target(target, mode):
+    """Result cache target for a search mode (bm25 keys are unchanged)"""
+    return target if mode == "bm25" else f"{target}|{mode}"
+
+
+def _mode_files(filepath, mode):
+    """CSVs a single-target result depends on: the latent index of non-bm25 modes spans every corpus"""
+    if mode == "bm25":
+        return [filepath]
+    return [DATA_DIR / file for _, file, _, _ in _iter_corpora()]
 
 
 def detect_domain(query):
@@ -213,8 +1921,10 @@ def detect_domain(query):
     return best if scores[best] > 0 else "style"
 
 
-def search(query, domain=None, max_results=MAX_RESULTS):
+def search(query, domain=None, max_results=MAX_RESULTS, mode="bm25"):
     """Main search function with auto-domain detection"""
+    if _mode_error(mode):
+        return {"error": _mode_error(mode)}
     if domain is None:
         domain = detect_domain(query)
 
@@ -224,19 +1934,23 @@ def search(query, domain=None, max_results=MAX_RESULTS):
     if not filepath.exists():
         return {"error": f"File not found: {filepath}", "domain": domain}
 
-    results = _search_csv(filepath, config["search_cols"], config["output_cols"], query, max_results)
+    def compute():
+        results = _search_csv(filepath, config["search_cols"], config["output_cols"], query, max_results, mode)
+        return {
+            "domain": domain,
+            "query": query,
+            "file": config["file"],
+            "count": len(results),
+            "results": results
+        }
 
-    return {
-        "domain": domain,
-        "query": query,
-        "file": config["file"],
-        "count": len(results),
-        "results": results
-    }
+    return _cached(_mode_target(f"domain:{domain}", mode), _mode_files(filepath, mode), query, max_results, compute)
 
 
-def search_stack(query, stack, max_results=MAX_RESULTS):
+def search_stack(query, stack, max_results=MAX_RESULTS, mode="bm25"):
     """Search stack-specific guidelines"""
+    if _mode_error(mode):
+        return {"error": _mode_error(mode)}
     if stack not in STACK_CONFIG:
         return {"error": f"Unknown stack: {stack}. Available: {', '.join(AVAILABLE_STACKS)}"}
 
@@ -245,13 +1959,245 @@ def search_stack(query, stack, max_results=MAX_RESULTS):
     if not filepath.exists():
         return {"error": f"Stack file not found: {filepath}", "stack": stack}
 
-    results = _search_csv(filepath, _STACK_COLS["search_cols"], _STACK_COLS["output_cols"], query, max_results)
+    def compute():
+        results = _search_csv(filepath, _STACK_COLS["search_cols"], _STACK_COLS["output_cols"], query, max_results, mode)
+        return {
+            "domain": "stack",
+            "stack": stack,
+            "query": query,
+            "file": STACK_CONFIG[stack]["file"],
+            "count": len(results),
+            "results": results
+        }
 
-    return {
-        "domain": "stack",
-        "stack": stack,
+    return _cached(_mode_target(f"stack:{stack}", mode), _mode_files(filepath, mode), query, max_results, compute)
+
+
+def _iter_corpora():
+    """Yield (source tag, file, search_cols, output_cols) for every domain and stack"""
+    for domain, config in CSV_CONFIG.items():
+        yield domain, config["file"], config["search_cols"], config["output_cols"]
+    for stack, config in STACK_CONFIG.items():
+        yield f"stack:{stack}", config["file"], _STACK_COLS["search_cols"], _STACK_COLS["output_cols"]
+
+
+_POOL = None
+
+
+def _search_pool():
+    """Shared thread pool for federated search, created on first use"""
+    global _POOL
+    if _POOL is None:
+        corpora = len(CSV_CONFIG) + len(STACK_CONFIG)
+        _POOL = ThreadPoolExecutor(max_workers=min(corpora, (os.cpu_count() or 4) * 2),
+                                   thread_name_prefix="uipro-search")
+    return _POOL
+
+
+def _rank_normalized(corpus, query, max_results, mode="bm25"):
+    """Top (score, idx, row) of one corpus with scores on a [0, 1] scale (BM25 divided by that index's score bound)"""
+    _, file, search_cols, output_cols = corpus
+    filepath = DATA_DIR / file
+    ranked = _rank_rows(filepath, search_cols, output_cols, query, max_results, mode)
+    if not ranked or mode != "bm25":
+        return [(score, idx, row) for idx, row, score in ranked]
+    bound = get_index(filepath, search_cols).bm25.score_bound(query)
+    return [(score / bound, idx, row) for idx, row, score in ranked]
+
+
+def search_all(query, max_results=MAX_RESULTS, mode="bm25", dedup=False):
+    """Federated search over every domain and stack, merged into one ranked top-k"""
+    if _mode_error(mode):
+        return {"error": _mode_error(mode)}
+    filepaths = [DATA_DIR / file for _, file, _, _ in _iter_corpora()]
+    compute = partial(_search_all_semantic if mode == "semantic" else _search_all, query, max_results, mode, dedup)
+    target = _mode_target("all", mode) + ("|dedup" if dedup else "")
+    return _cached(target, filepaths, query, max_results, compute)
+
+
+def _search_all(query, max_results, mode="bm25", dedup=False):
+    corpora = list(_iter_corpora())
+    fetch = max_results
+    while True:
+        rank = partial(_rank_normalized, query=query, max_results=fetch, mode=mode)
+        # Once every index is warm, scoring all corpora is cheaper than pool dispatch
+        if all((str(DATA_DIR / file), tuple(cols)) in _INDEX_CACHE for _, file, cols, _ in corpora):
+            per_corpus = list(map(rank, corpora))
+        else:
+            per_corpus = list(_search_pool().map(rank, corpora))
+
+        candidates = [(score, order, corpora[order][0], corpora[order][1], idx, row)
+                      for order, hits in enumerate(per_corpus)
+                      for score, idx, row in hits]
+        if not dedup:
+            return _federated_result(query, heapq.nsmallest(max_results, candidates, key=lambda c: (-c[0], c[1])))
+        top = _collapse_duplicates(sorted(candidates, key=lambda c: (-c[0], c[1])), max_results)
+        # Collapsed hits leave gaps: ask every corpus for more until the top k is full or all are exhausted
+        if len(top) == max_results or all(len(hits) < fetch for hits in per_corpus):
+            return _federated_result(query, top)
+        fetch *= 2
+
+
+def _search_all_semantic(query, max_results, mode="semantic", dedup=False):
+    latent = get_latent_index()
+    corpora = {corpus[0]: corpus for corpus in _iter_corpora()}
+    starts = [start for start, _, _ in latent.sources]
+    fetch = max_results
+    while True:
+        hits = latent.search(query, fetch)
+        candidates = []
+        for doc, score in hits:
+            start, source, file = latent.sources[bisect.bisect_right(starts, doc) - 1]
+            _, _, search_cols, output_cols = corpora[source]
+            row = get_index(DATA_DIR / file, search_cols).rows.project(doc - start, output_cols)
+            candidates.append((score, doc, source, file, doc - start, row))
+        if not dedup:
+            return _federated_result(query, candidates)
+        top = _collapse_duplicates(candidates, max_results)
+        if len(top) == max_results or len(hits) < fetch:
+            return _federated_result(query, top)
+        fetch *= 2
+
+
+def _collapse_duplicates(candidates, max_results):
+    """Keep the first (best) hit of each near-duplicate cluster, tagged with all the cluster's sources"""
+    dedup = get_dedup_index()
+    seen, top = set(), []
+    for score, order, source, file, idx, row in candidates:
+        doc = dedup.doc_id(DATA_DIR / file, idx)
+        key = ("cluster", dedup.cluster_of[doc]) if doc in dedup.cluster_of else ("row", doc)
+        if key not in seen:
+            seen.add(key)
+            top.append((score, order, dedup.source_tags(doc, source), file, idx, row))
+            if len(top) == max_results:
+                break
+    return top
+
+
+def _federated_result(query, top):
+    """Result dict for merged (score, order, source, file, idx, row) hits, best first"""
+    result = {
+        "domain": "all",
         "query": query,
-        "file": STACK_CONFIG[stack]["file"],
-        "count": len(results),
-        "results": results
+        "file": "*",
+        "count": len(top),
+        "results": [row for *_, row in top],
+        "sources": [source if isinstance(source, str) else source[0] for _, _, source, *_ in top],
+        "scores": [round(score, 4) for score, *_ in top]
+    }
+    if any(not isinstance(source, str) for _, _, source, *_ in top):
+        result["source_tags"] = [[source] if isinstance(source, str) else source for _, _, source, *_ in top]
+    return result
+
+
+def search_many(queries):
+    """Run a batch of queries (strings or spec dicts), lazily yielding one result per query in order"""
+    for spec in queries:
+        if isinstance(spec, str):
+            spec = {"query": spec}
+        if not isinstance(spec, dict) or not isinstance(spec.get("query"), str):
+            error = spec.get("error") if isinstance(spec, dict) else None
+            result = {"error": error or f"Invalid query spec: {spec!r}"}
+        elif not isinstance(spec.get("max_results", MAX_RESULTS), int):
+            result = {"error": f"Invalid max_results: {spec['max_results']!r}"}
+        else:
+            max_results = spec.get("max_results", MAX_RESULTS)
+            mode = spec.get("mode", "bm25")
+            with profile_stage("query", query=spec["query"]):
+                if spec.get("stack"):
+                    result = search_stack(spec["query"], spec["stack"], max_results, mode)
+                elif spec.get("domain") == "all":
+                    result = search_all(spec["query"], max_results, mode, bool(spec.get("dedup")))
+                else:
+                    result = search(spec["query"], spec.get("domain"), max_results, mode)
+        if isinstance(spec, dict) and "id" in spec:
+            result = {"id": spec["id"], **result}
+        yield result
+
+
+def _resolve_target(domain=None, stack=None):
+    """Map a domain or stack name to (filepath, search_cols)"""
+    if stack:
+        return DATA_DIR / STACK_CONFIG[stack]["file"], _STACK_COLS["search_cols"]
+    config = CSV_CONFIG.get(domain, CSV_CONFIG["style"])
+    return DATA_DIR / config["file"], config["search_cols"]
+
+
+def measure_latency(query, domain=None, stack=None, max_results=MAX_RESULTS, repeat=3, mode="bm25"):
+    """Time one query cold (CSV parse + fit), warm from disk and warm in memory (best of N, ms)"""
+    if stack:
+        run = partial(search_stack, query, stack, max_results, mode)
+        filepaths = [_resolve_target(stack=stack)[0]]
+    elif domain == "all":
+        run = partial(search_all, query, max_results, mode)
+        filepaths = [DATA_DIR / file for _, file, _, _ in _iter_corpora()]
+    else:
+        domain = domain or detect_domain(query)
+        run = partial(search, query, domain, max_results, mode)
+        filepaths = [_resolve_target(domain)[0]]
+
+    global RESULT_CACHE_ENABLED, _LATENT_INDEX
+    cache_enabled, RESULT_CACHE_ENABLED = RESULT_CACHE_ENABLED, False
+    timings = {}
+    try:
+        for label in ("cold", "warm_disk", "warm_memory"):
+            best = float("inf")
+            for _ in range(repeat):
+                if label != "warm_memory":
+                    _INDEX_CACHE.clear()
+                    _LATENT_INDEX = None
+                if label == "cold":
+                    for filepath in filepaths:
+                        _index_path(filepath).unlink(missing_ok=True)
+                        _mapped_path(filepath).unlink(missing_ok=True)
+                    if mode != "bm25":
+                        (INDEX_DIR / "latent.pkl").unlink(missing_ok=True)
+                start = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - start)
+            timings[f"{label}_ms"] = best * 1000
+    finally:
+        RESULT_CACHE_ENABLED = cache_enabled
+    return timings
+
+
+# ============ PARALLEL INDEX BUILD ============
+def _build_corpus(source, file, search_cols):
+    """Process-pool worker: build and persist one corpus index; returns (source, rows, CPU seconds)"""
+    start = time.process_time()
+    index = _build_index(DATA_DIR / file, search_cols)
+    _write_index(index)
+    return source, len(index.rows), time.process_time() - start
+
+
+def build_indexes(workers=None):
+    """Rebuild every domain and stack index in a process pool (the server / CI warm-up step)"""
+    corpora = [(source, file, search_cols) for source, file, search_cols, _ in _iter_corpora()
+               if (DATA_DIR / file).exists()]
+    if not corpora:
+        return {"workers": 0, "wall_s": 0.0, "serial_s": 0.0, "corpora": [], "speedup": None}
+    corpora.sort(key=lambda corpus: os.path.getsize(DATA_DIR / corpus[1]), reverse=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(corpora)))
+
+    start = time.perf_counter()
+    if workers == 1:
+        built = list(map(_build_corpus, *zip(*corpora)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            built = list(pool.map(_build_corpus, *zip(*corpora)))
+    wall = time.perf_counter() - start
+    clear_index_cache()
+
+    report = {
+        "workers": workers,
+        "wall_s": round(wall, 4),
+        "serial_s": round(sum(seconds for _, _, seconds in built), 4),
+        "corpora": [{"source": source, "rows": rows, "seconds": round(seconds, 4)} for source, rows, seconds in built],
     }
+    report["speedup"] = round(report["serial_s"] / wall, 2) if wall > 0 else None
+    if np is not None:
+        (INDEX_DIR / "latent.pkl").unlink(missing_ok=True)
+        start = time.perf_counter()
+        get_latent_index()
+        report["latent_s"] = round(time.perf_counter() - start, 4)
+    return report
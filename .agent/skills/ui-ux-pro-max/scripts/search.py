@@ -2,18 +2,52 @@
 # -*- coding: utf-8 -*-
 """
 UI/UX Pro Max Search - BM25 search engine for UI/UX style guides
-Usage: python search.py "<query>" [--domain <domain>] [--stack <stack>] [--max-results 3]
+Usage: python search.py "<query>" [--domain <domain>] [--stack <stack>] [--max-results 3] [--timing]
+       python search.py "<query>" --all [--dedup]   (federated search over every domain and stack)
+       python search.py "<query>" --mode semantic|hybrid   (latent semantic index; requires NumPy)
+       python search.py '"dark mode" toggle'   (quoted phrases must appear verbatim; nearby terms rank higher)
+       python search.py --build-index [--workers N]   (rebuild every index in a process pool)
+       python search.py --dedup-report   (near-duplicate rows across all domains and stacks)
+       python search.py "<query>" --all -n 10 --budget 800   (fit the answer into ~800 tokens, shared by score)
+       python search.py "<query>" --profile [--trace trace.json]   (per-stage timings, peak memory, Chrome trace)
+       python search.py --batch < queries.jsonl   (one {"query", "domain"|"stack", "max_results", "mode"} per line)
 
 Domains: style, prompt, color, chart, landing, product, ux, typography
 Stacks: html-tailwind, react, nextjs
+
+A running `server.py` (warm indexes) is used automatically; pass --no-server to search in-process.
 """
 
 import argparse
-from core import CSV_CONFIG, AVAILABLE_STACKS, MAX_RESULTS, search, search_stack
+import json
+import os
+import sys
+import time
+import tracemalloc
+from core import (CSV_CONFIG, AVAILABLE_STACKS, MAX_RESULTS, SEARCH_MODES, search, search_stack, search_all, search_many,
+                  measure_latency, clear_index_cache, build_indexes, near_duplicate_report, RESULT_CACHE,
+                  Profiler, install_profiler, profile_stage, LOW_VALUE_COLS, CHARS_PER_TOKEN, MIN_FIELD_CHARS)
+from server import call as server_call
+
+BUDGET_FOOTER = "**Budget:** {total} {unit} | omitted {omitted} fields, trimmed {trimmed}"
+
+
+def _result_title(result, i):
+    """Heading of the i-th (1-based) result, with source and score for federated results"""
+    if "source_tags" in result:
+        return f"### Result {i} ({', '.join(result['source_tags'][i - 1])}, score {result['scores'][i - 1]:.2f})"
+    if "sources" in result:
+        return f"### Result {i} ({result['sources'][i - 1]}, score {result['scores'][i - 1]:.2f})"
+    return f"### Result {i}"
 
 
-def format_output(result):
-    """Format results for Claude consumption (token-optimized)"""
+def _clip(value):
+    value_str = str(value)
+    return value_str[:300] + "..." if len(value_str) > 300 else value_str
+
+
+def format_output(result, budget=None, unit="tokens"):
+    """Format results for Claude consumption (token-optimized); see _budgeted_results for budget"""
     if "error" in result:
         return f"Error: {result['error']}"
 
@@ -24,38 +58,343 @@ def format_output(result):
     else:
         output.append(f"## UI Pro Max Search Results")
         output.append(f"**Domain:** {result['domain']} | **Query:** {result['query']}")
-    output.append(f"**Source:** {result['file']} | **Found:** {result['count']} results\n")
+    source = "all domains and stacks" if result['domain'] == "all" else result['file']
+    output.append(f"**Source:** {source} | **Found:** {result['count']} results\n")
+
+    if budget is not None:
+        return "\n".join(output + _budgeted_results(result, budget - _cost("\n".join(output), unit), unit, budget))
 
     for i, row in enumerate(result['results'], 1):
-        output.append(f"### Result {i}")
+        output.append(_result_title(result, i))
         for key, value in row.items():
-            value_str = str(value)
-            if len(value_str) > 300:
-                value_str = value_str[:300] + "..."
-            output.append(f"- **{key}:** {value_str}")
+            output.append(f"- **{key}:** {_clip(value)}")
         output.append("")
 
     return "\n".join(output)
 
 
-if __name__ == "__main__":
+def _cost(text, unit):
+    """Size of one output line (plus its newline) in bytes or estimated tokens"""
+    if unit == "bytes":
+        return len(text.encode("utf-8")) + 1
+    return (len(text) + 1) / CHARS_PER_TOKEN
+
+
+def _fit_fields(fields, budget, unit):
+    """Trim one result's (key, value) fields to budget; returns (kept, dropped keys, trimmed count).
+
+    Low-value columns go first (LOW_VALUE_COLS order), then the longest
+    values are trimmed down to MIN_FIELD_CHARS, then fields are dropped
+    from the end. The first field (the row's label) is always kept.
+    """
+    kept, dropped, trimmed = list(fields), [], 0
+
+    def size():
+        return sum(_cost(f"- **{key}:** {value}", unit) for key, value in kept)
+
+    for field in sorted((f for f in kept[1:] if f[0] in LOW_VALUE_COLS), key=lambda f: LOW_VALUE_COLS.index(f[0])):
+        if size() <= budget:
+            break
+        kept.remove(field)
+        dropped.append(field[0])
+    for i in sorted(range(len(kept)), key=lambda i: -len(kept[i][1])):
+        excess = size() - budget
+        if excess <= 0:
+            break
+        key, value = kept[i]
+        chars = max(MIN_FIELD_CHARS, len(value) - int(excess * (CHARS_PER_TOKEN if unit == "tokens" else 1)) - 3)
+        if chars < len(value):
+            kept[i] = (key, value[:chars].rstrip() + "...")
+            trimmed += 1
+    while len(kept) > 1 and size() > budget:
+        dropped.append(kept.pop()[0])
+    return kept, dropped, trimmed
+
+
+def _budgeted_results(result, budget, unit, total):
+    """Result lines that fit budget (in unit), shared across results in proportion to their scores.
+
+    Results keep their rank order and each one gets budget * weight / sum of the
+    remaining weights, so space a result does not use rolls over to the ones
+    below it. Weights are the scores when the result has them, else 1 / rank.
+    Empty values are skipped, and a value already shown in full by a higher
+    result is replaced by a reference to it.
+    """
+    rows = result['results']
+    scores = result.get("scores") or []
+    weights = [max(score, 0.0) for score in scores] if len(scores) == len(rows) and any(s > 0 for s in scores) \
+        else [1 / rank for rank in range(1, len(rows) + 1)]
+    # reserve the footer at its widest: neither count can exceed the number of fields
+    fields_total = sum(len(row) for row in rows)
+    budget -= _cost(BUDGET_FOOTER.format(total=total, unit=unit, omitted=fields_total, trimmed=fields_total), unit)
+
+    lines, shown, omitted, trimmed = [], {}, 0, 0
+    for i, (row, weight) in enumerate(zip(rows, weights), 1):
+        title = _result_title(result, i)
+        budget -= _cost(title, unit) + _cost("", unit)
+        fields = []
+        for key, value in row.items():
+            value = _clip(value)
+            if not value.strip():
+                continue
+            if value in shown:
+                rank, source_key = shown[value]
+                ref = f"(same as Result {rank})" if source_key == key else f"(same as Result {rank} {source_key})"
+                value = ref if len(ref) < len(value) else value
+            fields.append((key, value))
+        remaining = sum(weights[i - 1:])
+        share = budget * weight / remaining if remaining else budget
+        kept, dropped, cut = _fit_fields(fields, share, unit)
+        lines.append(title)
+        for key, value in kept:
+            lines.append(f"- **{key}:** {value}")
+            original = _clip(row[key])
+            if value == original and original not in shown:
+                shown[original] = (i, key)
+        lines.append("")
+        budget -= sum(_cost(f"- **{key}:** {value}", unit) for key, value in kept)
+        omitted += len(dropped)
+        trimmed += cut
+    if omitted or trimmed:
+        lines.append(BUDGET_FOOTER.format(total=total, unit=unit, omitted=omitted, trimmed=trimmed))
+    return lines
+
+
+def _read_batch(stream):
+    """Parse JSONL query specs, passing malformed lines through as error specs"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"query": None, "error": f"Invalid JSON ({e.msg}): {line[:80]}"}
+
+
+def run_batch(stream=None, out=None):
+    """Stream JSONL results for JSONL queries; summary (incl. queries/s) goes to stderr"""
+    stream = stream or sys.stdin
+    out = out or sys.stdout
+    count = errors = 0
+    start = time.perf_counter()
+    for result in search_many(_read_batch(stream)):
+        count += 1
+        errors += "error" in result
+        with profile_stage("format"):
+            line = json.dumps(result, ensure_ascii=False)
+        out.write(line + "\n")
+        out.flush()
+    elapsed = time.perf_counter() - start
+    summary = {"queries": count, "errors": errors, "seconds": round(elapsed, 4),
+               "queries_per_second": round(count / elapsed, 1) if elapsed > 0 else None}
+    print(json.dumps({"summary": summary}), file=sys.stderr)
+
+
+def _process_age():
+    """Seconds since this process started (interpreter startup + imports when called early), None off Linux"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def start_profile(trace=False):
+    """Install a Profiler (startup already recorded) and start tracemalloc"""
+    profiler = Profiler(trace=trace)
+    startup = _process_age()
+    if startup is not None:
+        profiler.origin -= startup  # the trace starts at process start
+        profiler.record("startup", startup, profiler.origin, startup)
+    install_profiler(profiler)
+    tracemalloc.start()
+    return profiler
+
+
+def finish_profile(profiler, trace_path=None):
+    """Stop profiling; print per-stage timings and peak traced memory to stderr, optionally write a Chrome trace"""
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    install_profiler(None)
+    wall = (time.perf_counter() - profiler.origin) * 1000
+    stages = profiler.report()
+    stages["other"] = {"ms": round(max(0.0, wall - sum(stage["ms"] for stage in stages.values())), 3), "calls": ""}
+    total = sum(stage["ms"] for stage in stages.values())
+    lines = [f"**Profile** (in-process, wall {wall:.3f}ms; tracemalloc adds overhead to the timed stages,"
+             " and stages run in pool threads overlap)",
+             f"{'stage':<14} {'ms':>10} {'calls':>7} {'share':>7}"]
+    for name, stage in stages.items():
+        share = stage["ms"] / total * 100 if total else 0.0
+        lines.append(f"{name:<14} {stage['ms']:>10.3f} {stage['calls']:>7} {share:>6.1f}%")
+    lines.append(f"{'total':<14} {total:>10.3f}")
+    lines.append(f"**Peak traced memory:** {peak / 2 ** 20:.2f}MB")
+    if trace_path:
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump(profiler.chrome_trace(), f)
+        lines.append(f"**Trace:** {trace_path} ({len(profiler.events)} events; open in chrome://tracing or ui.perfetto.dev)")
+    print("\n".join(lines), file=sys.stderr)
+
+
+def run_query(args):
+    """Answer one CLI query through a running server when possible, else in-process"""
+    if args.stack:
+        method, params = "search_stack", {"query": args.query, "stack": args.stack}
+    elif args.all:
+        method, params = "search_all", {"query": args.query, "dedup": args.dedup}
+    else:
+        method, params = "search", {"query": args.query, "domain": args.domain}
+    params["max_results"] = args.max_results
+    params["mode"] = args.mode
+
+    if not args.no_server:
+        result = server_call(method, params)
+        if result is not None:
+            return result
+
+    local = {"search_stack": search_stack, "search_all": search_all, "search": search}[method]
+    return local(**params)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="UI Pro Max Search")
-    parser.add_argument("query", help="Search query")
+    parser.add_argument("query", nargs="?", help="Search query")
     parser.add_argument("--domain", "-d", choices=list(CSV_CONFIG.keys()), help="Search domain")
     parser.add_argument("--stack", "-s", choices=AVAILABLE_STACKS, help="Stack-specific search (html-tailwind, react, nextjs)")
+    parser.add_argument("--all", "-a", action="store_true", help="Federated search across every domain and stack")
+    parser.add_argument("--dedup", action="store_true", help="With --all, collapse near-duplicate rows into one result")
+    parser.add_argument("--dedup-report", action="store_true", help="Report near-duplicate rows across all domains and stacks")
     parser.add_argument("--max-results", "-n", type=int, default=MAX_RESULTS, help="Max results (default: 3)")
+    parser.add_argument("--mode", "-m", choices=SEARCH_MODES, default="bm25",
+                        help="Ranking: bm25 keywords, semantic (latent), or hybrid re-ranking (default: bm25)")
     parser.add_argument("--json", action="store_true", help="Output as JSON")
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument("--budget", type=int, metavar="TOKENS",
+                        help="Fit the results into about this many tokens, shared across results by score")
+    budget.add_argument("--budget-bytes", type=int, metavar="BYTES", help="Like --budget, in UTF-8 bytes")
+    parser.add_argument("--timing", action="store_true", help="Report cold vs warm (disk/memory) index latency")
+    parser.add_argument("--rebuild-index", action="store_true", help="Discard cached indexes before searching")
+    parser.add_argument("--batch", action="store_true", help="Read JSONL queries from stdin, stream JSONL results")
+    parser.add_argument("--build-index", action="store_true", help="Rebuild every domain and stack index in parallel")
+    parser.add_argument("--workers", type=int, help="Worker processes for --build-index (default: CPU count)")
+    parser.add_argument("--no-server", action="store_true", help="Do not use a running server.py")
+    parser.add_argument("--cache-stats", action="store_true", help="Print result cache hit/miss counters")
+    parser.add_argument("--server-stats", action="store_true",
+                        help="Print request count and p50/p95 latency of a running server.py")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print per-stage timings and peak memory to stderr (searches in-process)")
+    parser.add_argument("--trace", metavar="PATH", help="With --profile, also write a Chrome trace-event JSON file")
+    return parser
 
-    args = parser.parse_args()
 
+def print_server_stats():
+    stats = server_call("stats")
+    print(json.dumps(stats, indent=2) if stats is not None else "No search server is running.")
+    return 0 if stats is not None else 1
+
+
+def print_build_report(workers, as_json):
+    report = build_indexes(workers)
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return 0
+    for corpus in report["corpora"]:
+        print(f"{corpus['source']:<20} {corpus['rows']:>6} rows  {corpus['seconds'] * 1000:>8.1f}ms")
+    print(f"\n**Build:** {len(report['corpora'])} indexes on {report['workers']} workers in {report['wall_s']:.3f}s"
+          f" | serial {report['serial_s']:.3f}s | speedup {report['speedup']}x")
+    if "latent_s" in report:
+        print(f"**Latent index:** {report['latent_s']:.3f}s")
+    return 0
+
+
+def print_dedup_report(as_json):
+    report = near_duplicate_report()
+    if as_json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0
+    for cluster in report["clusters"]:
+        print(f"**Similarity {cluster['similarity']:.2f}**")
+        for row in cluster["rows"]:
+            print(f"- {row['source']} row {row['row']}: {row['label']}")
+        print()
+    print(f"**Near-duplicates:** {len(report['clusters'])} clusters, {report['duplicate_rows']} redundant rows"
+          f" of {report['documents']} (Jaccard >= {report['threshold']}) in {report['seconds']:.3f}s")
+    return 0
+
+
+def print_query(args):
+    """Run one query and print it as JSON or budgeted markdown"""
     # Stack search takes priority
-    if args.stack:
-        result = search_stack(args.query, args.stack, args.max_results)
-    else:
-        result = search(args.query, args.domain, args.max_results)
+    result = run_query(args)
 
-    if args.json:
-        import json
-        print(json.dumps(result, indent=2, ensure_ascii=False))
+    with profile_stage("format"):
+        if args.json:
+            output = json.dumps(result, indent=2, ensure_ascii=False)
+        elif args.budget_bytes is not None:
+            output = format_output(result, args.budget_bytes, "bytes")
+        else:
+            output = format_output(result, args.budget)
+    print(output)
+
+
+def print_diagnostics(args):
+    """Trailing --timing and --cache-stats lines for a single query"""
+    if args.timing:
+        t = measure_latency(args.query, "all" if args.all else args.domain, args.stack, args.max_results, mode=args.mode)
+        print(f"\n**Latency:** cold {t['cold_ms']:.2f}ms | warm (disk) {t['warm_disk_ms']:.2f}ms"
+              f" | warm (memory) {t['warm_memory_ms']:.2f}ms")
+
+    if args.cache_stats:
+        s = RESULT_CACHE.stats()
+        print(f"\n**Result cache:** {s['hits']} hits / {s['misses']} misses (hit rate {s['hit_rate']})"
+              f" | {s['entries']} entries, {s['bytes']} bytes | {s['evictions']} evictions")
+
+
+def run_report(args):
+    """Exit code of a standalone report mode (server stats, index build, dedup), or None for a search"""
+    if args.server_stats:
+        return print_server_stats()
+    if args.build_index:
+        return print_build_report(args.workers, args.json)
+    if args.dedup_report:
+        return print_dedup_report(args.json)
+    return None
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    profiler = start_profile(trace=bool(args.trace)) if args.profile or args.trace else None
+    if profiler is not None:
+        args.no_server = True  # stages are only visible in this process
+
+    code = run_report(args)
+    if code is not None:
+        return code
+
+    if args.query is None and not args.batch:
+        if args.cache_stats:
+            print(json.dumps(RESULT_CACHE.stats(), indent=2))
+            return 0
+        parser.error("query is required unless --batch, --build-index, --dedup-report,"
+                     " --cache-stats or --server-stats is given")
+
+    if args.rebuild_index:
+        clear_index_cache(disk=True)
+
+    if args.batch:
+        run_batch()
     else:
-        print(format_output(result))
+        print_query(args)
+    if profiler is not None:
+        finish_profile(profiler, args.trace)
+    if not args.batch:
+        print_diagnostics(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI/UX Pro Max Server - resident JSON-RPC search process with warm indexes
+Usage: python server.py [--socket <path>]   (Unix socket, default per checkout)
+       python server.py --stdio             (JSON-RPC over stdin/stdout)
+
+Every CSV_CONFIG / STACK_CONFIG index is loaded once at startup. Requests are
+newline-delimited JSON-RPC 2.0 objects; methods: search, search_stack,
+search_all (each with an optional "mode": bm25, semantic, hybrid; search_all
+also takes "dedup"), stats, ping, shutdown. search.py uses a running server
+transparently and falls back to in-process search otherwise.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+import core
+
+LATENCY_WINDOW = 10000
+CONNECT_TIMEOUT = 0.2
+REQUEST_TIMEOUT = 10.0
+
+
+def default_socket_path():
+    """Per-checkout socket path (overridable via UIPRO_SEARCH_SOCKET)"""
+    env = os.environ.get("UIPRO_SEARCH_SOCKET")
+    if env:
+        return env
+    checkout = hashlib.sha1(str(core.DATA_DIR.resolve()).encode("utf-8")).hexdigest()[:10]
+    return os.path.join(tempfile.gettempdir(), f"uipro-search-{checkout}.sock")
+
+
+# ============ SERVER ============
+class SearchService:
+    """Dispatches JSON-RPC requests to core and records per-request latency"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.methods = {
+            "search": lambda p: core.search(p["query"], p.get("domain"), p.get("max_results", core.MAX_RESULTS),
+                                            p.get("mode", "bm25")),
+            "search_stack": lambda p: core.search_stack(p["query"], p["stack"], p.get("max_results", core.MAX_RESULTS),
+                                                        p.get("mode", "bm25")),
+            "search_all": lambda p: core.search_all(p["query"], p.get("max_results", core.MAX_RESULTS), p.get("mode", "bm25"),
+                                                    p.get("dedup", False)),
+            "stats": lambda p: self.stats(),
+            "ping": lambda p: "pong",
+            "shutdown": lambda p: self.shutdown(),
+        }
+
+    def warm(self):
+        """Load every domain and stack index (and the latent index when NumPy is available); returns the number loaded"""
+        loaded = 0
+        for _, file, search_cols, _ in core._iter_corpora():
+            filepath = core.DATA_DIR / file
+            if filepath.exists():
+                core.get_index(filepath, search_cols)
+                loaded += 1
+        if core.np is not None:
+            core.get_latent_index()
+            loaded += 1
+        return loaded
+
+    def handle(self, line):
+        """Answer one JSON-RPC request line with one JSON response line"""
+        start = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                response = self._error(None, -32600, "Invalid Request: expected a JSON object")
+            else:
+                request_id = request.get("id")
+                method = self.methods.get(request.get("method"))
+                if method is None:
+                    response = self._error(request_id, -32601, f"Method not found: {request.get('method')}")
+                else:
+                    response = {"jsonrpc": "2.0", "id": request_id, "result": method(request.get("params") or {})}
+        except json.JSONDecodeError as e:
+            response = self._error(None, -32700, f"Parse error: {e.msg}")
+        except (KeyError, TypeError, AttributeError) as e:
+            response = self._error(request_id, -32602, f"Invalid params: {e}")
+        except Exception as e:
+            response = self._error(request_id, -32603, f"Internal error: {e}")
+
+        elapsed = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.requests += 1
+            self.errors += "error" in response
+            self.latencies.append(elapsed)
+        return json.dumps(response, ensure_ascii=False)
+
+    def shutdown(self):
+        """Ask the serving loop to stop after answering this request"""
+        self.stopping.set()
+        return "stopping"
+
+    @staticmethod
+    def _error(request_id, code, message):
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+    def stats(self):
+        """Request counters and p50/p95 latency (ms) over the recent window"""
+        with self.lock:
+            samples = sorted(self.latencies)
+            requests, errors = self.requests, self.errors
+
+        def percentile(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 3)
+
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": requests,
+            "errors": errors,
+            "indexes": len(core._INDEX_CACHE),
+            "latency_ms": {"p50": percentile(50), "p95": percentile(95), "window": len(samples)},
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            self.wfile.write((self.server.service.handle(line) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            if self.server.service.stopping.is_set():
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+
+def serve_socket(service, path):
+    """Serve JSON-RPC on a Unix socket until a shutdown request or Ctrl+C"""
+    if not hasattr(socket, "AF_UNIX"):
+        print("Error: Unix sockets are not available on this platform, use --stdio", file=sys.stderr)
+        return 1
+    if os.path.exists(path):
+        if call("ping", socket_path=path) is not None:
+            print(f"Error: a server is already listening on {path}", file=sys.stderr)
+            return 1
+        os.unlink(path)  # stale socket left by a crashed server
+
+    server = socketserver.ThreadingUnixStreamServer(path, _RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"UI Pro Max search server listening on {path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+    return 0
+
+
+def serve_stdio(service, stdin=None, stdout=None):
+    """Serve JSON-RPC lines from stdin, one response line per request on stdout"""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        stdout.write(service.handle(line) + "\n")
+        stdout.flush()
+        if service.stopping.is_set():
+            break
+    return 0
+
+
+# ============ CLIENT ============
+def call(method, params=None, socket_path=None):
+    """Call a running server; returns the RPC result, or None when no server answers"""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = socket_path or default_socket_path()
+    if not os.path.exists(path):
+        return None
+
+    request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(path)
+            sock.settimeout(REQUEST_TIMEOUT)
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as reader:
+                response = json.loads(reader.readline() or b"null")
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(response, dict) or "result" not in response:
+        return None
+    return response["result"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UI Pro Max Search Server")
+    parser.add_argument("--socket", help="Unix socket path (default: per-checkout path in the temp dir)")
+    parser.add_argument("--stdio", action="store_true", help="Serve JSON-RPC over stdin/stdout instead of a socket")
+    args = parser.parse_args()
+
+    service = SearchService()
+    start = time.perf_counter()
+    loaded = service.warm()
+    print(f"Loaded {loaded} indexes in {(time.perf_counter() - start) * 1000:.1f}ms", file=sys.stderr)
+
+    if args.stdio:
+        sys.exit(serve_stdio(service))
+    sys.exit(serve_socket(service, args.socket or default_socket_path()))